@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Проверка и бенчмарк AnalyticsService против локальной заглушки Amplitude batch API:
+стоимость одного track_* в обработчике, сжатие батчей, повторы при 503/429
+и фильтрация blocked_users.
+
+Запуск:
+    python bench_analytics.py --events 5000 --fail-first 2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+PORT = 8768
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:8765")
+os.environ.setdefault("SUPABASE_ANON_KEY", "bench-key")
+os.environ.setdefault("AMPLITUDE_API_KEY", "bench-amplitude-key")
+os.environ["AMPLITUDE_API_URL"] = f"http://127.0.0.1:{PORT}/batch"
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import web
+
+from bot.config import ANALYTICS
+from bot.services.analytics_service import AnalyticsService
+from bot.services.http_client import close_http_client
+
+received = {"requests": 0, "events": 0, "raw_bytes": 0, "wire_bytes": 0, "insert_ids": set()}
+
+
+async def start_stub_server(fail_first: int, latency: float) -> None:
+    async def batch(request: web.Request) -> web.Response:
+        received["requests"] += 1
+        await asyncio.sleep(latency)
+        if received["requests"] <= fail_first:
+            return web.json_response({"code": 503}, status=503)
+
+        # aiohttp распаковывает gzip сам, размер на проводе берём из Content-Length
+        assert request.headers.get("Content-Encoding") == "gzip"
+        body = await request.read()
+        received["wire_bytes"] += int(request.headers["Content-Length"])
+        received["raw_bytes"] += len(body)
+        payload = json.loads(body)
+        assert payload["api_key"] == os.environ["AMPLITUDE_API_KEY"]
+        received["events"] += len(payload["events"])
+        received["insert_ids"].update(event["insert_id"] for event in payload["events"])
+        return web.json_response({"code": 200, "events_ingested": len(payload["events"])})
+
+    app = web.Application()
+    app.router.add_post("/batch", batch)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--fail-first", type=int, default=2, help="сколько первых запросов вернут 503")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка заглушки, сек")
+    args = parser.parse_args()
+
+    await start_stub_server(args.fail_first, args.latency)
+
+    analytics = AnalyticsService()
+    assert analytics.enabled, "analytics disabled: check ANALYTICS config"
+    analytics.start()
+    blocked_user = ANALYTICS["blocked_users"][0] if ANALYTICS["blocked_users"] else None
+
+    started = time.perf_counter()
+    for i in range(args.events):
+        await analytics.track_flight_search(100000 + i % 500, "QR30", "2025-07-20", success=True, response_time=0.42)
+        if i % 100 == 0:
+            # Обработчики отдают управление на I/O — даём фоновой отправке работать
+            await asyncio.sleep(0)
+    per_event = (time.perf_counter() - started) / args.events
+    if blocked_user:
+        for _ in range(1000):
+            await analytics.track_user_action(blocked_user, "start_command")
+
+    started = time.perf_counter()
+    await analytics.shutdown()
+    drain = time.perf_counter() - started
+    await close_http_client()
+
+    stats = analytics.get_stats()
+    print(f"track_*: {per_event * 1e6:.1f}µs per event (handler-side cost)")
+    print(f"delivered {received['events']}/{args.events} events in {stats['batches']} batches, "
+          f"{received['requests']} HTTP requests ({stats['retries']} retries), drain {drain:.2f}s")
+    print(f"gzip: {received['raw_bytes'] / 1024:.0f}KB -> {received['wire_bytes'] / 1024:.0f}KB on the wire "
+          f"({received['raw_bytes'] / max(received['wire_bytes'], 1):.1f}x)")
+    print(f"unique insert_id: {len(received['insert_ids'])}, blocked: {stats['blocked']}, "
+          f"overwritten: {stats['overwritten']}, failed: {stats['failed_events']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест дедупликации запросов FlightService.get_flight_data:
+всплеск одинаковых Refresh по одному рейсу против локальной заглушки flight-api.
+Считает, сколько запросов дошло до upstream без и с coalescing.
+
+Запуск:
+    python bench_coalescing.py --burst 100 --latency 0.3
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+PORT = 8767
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("SUPABASE_ANON_KEY", "bench-key")
+os.environ["SUPABASE_URL"] = f"http://127.0.0.1:{PORT}"
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import web
+
+from bot.services.flight_service import FlightService
+from bot.services.http_client import close_http_client
+
+upstream_calls = 0
+
+
+async def start_stub_server(latency: float) -> None:
+    async def flight_api(request: web.Request) -> web.Response:
+        global upstream_calls
+        upstream_calls += 1
+        await asyncio.sleep(latency)
+        return web.json_response({
+            "success": True,
+            "data": [{"number": "QR 30", "status": "Delayed"}],
+            "message": "QR 30 EDI→DOH",
+            "buttons": []
+        })
+
+    app = web.Application()
+    app.router.add_post("/functions/v1/flight-api", flight_api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+
+async def burst(name: str, call, size: int) -> None:
+    global upstream_calls
+    upstream_calls = 0
+    started = time.perf_counter()
+    results = await asyncio.gather(*(call() for _ in range(size)))
+    wall = time.perf_counter() - started
+    errors = sum(1 for result in results if result.get("error"))
+    print(f"{name:>20}: {size} refreshes -> {upstream_calls} upstream calls, "
+          f"{errors} errors, {wall:.2f}s")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--burst", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.3, help="задержка flight-api, сек")
+    args = parser.parse_args()
+
+    await start_stub_server(args.latency)
+
+    flight_service = FlightService()
+    # Кэш отключаем, чтобы измерить только coalescing
+    flight_service.cache = None
+
+    await burst("without coalescing",
+                lambda: flight_service._fetch_flight_data("QR30", "2025-07-20"), args.burst)
+    await burst("with coalescing",
+                lambda: flight_service.get_flight_data("QR30", "2025-07-20"), args.burst)
+    print(f"coalesced={flight_service.coalesced_requests}, upstream={flight_service.upstream_requests}")
+
+    await close_http_client()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
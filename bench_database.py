@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк слоя данных: сколько параллельных handle_text_message выдерживает
+DatabaseService с синхронным клиентом (как раньше) и с асинхронным пулом.
+
+Запуск:
+    python bench_database.py --concurrency 50 --latency 0.02
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+# Заглушки окружения, чтобы bot.config импортировался без .env
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:8765")
+os.environ.setdefault("SUPABASE_ANON_KEY", "bench-key")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import web
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from postgrest import SyncPostgrestClient
+
+from bot.services.database import DatabaseService, create_async_client
+from bot.handlers.text import handle_text_message
+
+STUB_HOST = "127.0.0.1"
+STUB_PORT = 8765
+STUB_USER = {"id": "00000000-0000-0000-0000-000000000001", "telegram_id": 1,
+             "username": "bench", "language_code": "en"}
+
+
+def start_stub_server(latency: float) -> None:
+    """Поднимает заглушку PostgREST в отдельном потоке (свой event loop)"""
+
+    async def handle(request: web.Request) -> web.Response:
+        await asyncio.sleep(latency)
+        return web.json_response([STUB_USER])
+
+    async def run() -> None:
+        app = web.Application()
+        app.router.add_route("*", "/rest/v1/{table}", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, STUB_HOST, STUB_PORT).start()
+        while True:
+            await asyncio.sleep(3600)
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_until_complete, args=(run(),), daemon=True).start()
+    time.sleep(0.5)
+
+
+class LegacyDatabaseService(DatabaseService):
+    """Прежнее поведение: синхронный клиент внутри async-методов"""
+
+    def __init__(self):
+        super().__init__(client=create_async_client())
+        self.sync_client = SyncPostgrestClient(
+            f"{os.environ['SUPABASE_URL']}/rest/v1",
+            headers={"apiKey": "bench-key", "Authorization": "Bearer bench-key"}
+        )
+
+    async def get_or_create_user(self, telegram_id, username=None, language_code="en", platform="telegram"):
+        response = self.sync_client.table('users').select('*').eq('telegram_id', telegram_id).execute()
+        user = response.data[0]
+        self.sync_client.table('users').update({'username': username}).eq('id', user['id']).execute()
+        return user
+
+
+class FakeFlightService:
+    """Имитация edge-функции flight-api"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def get_flight_data(self, flight_number, date, user_id=None, date_local_role=None):
+        await asyncio.sleep(self.latency)
+        return {"message": f"{flight_number} OK", "buttons": []}
+
+
+def make_message(chat_id: int) -> SimpleNamespace:
+    async def answer(*args, **kwargs):
+        return SimpleNamespace(message_id=chat_id, delete=noop)
+
+    async def noop(*args, **kwargs):
+        return True
+
+    return SimpleNamespace(
+        text="SU100",
+        message_id=chat_id,
+        from_user=SimpleNamespace(id=chat_id, username="bench"),
+        chat=SimpleNamespace(id=chat_id),
+        bot=SimpleNamespace(delete_message=noop),
+        answer=answer,
+        delete=noop
+    )
+
+
+async def run_batch(db: DatabaseService, concurrency: int, api_latency: float) -> dict:
+    storage = MemoryStorage()
+    flight_service = FakeFlightService(api_latency)
+    latencies = []
+
+    async def one(i: int) -> None:
+        state = FSMContext(storage=storage, key=StorageKey(bot_id=1, chat_id=i, user_id=i))
+        started = time.perf_counter()
+        await handle_text_message(make_message(i), state, db, flight_service, None, None, None)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "wall": wall,
+        "throughput": concurrency / wall,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1]
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка БД на запрос, сек")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="задержка flight-api, сек")
+    args = parser.parse_args()
+
+    start_stub_server(args.latency)
+
+    for name, db in (("sync (legacy)", LegacyDatabaseService()), ("async pool", DatabaseService())):
+        result = await run_batch(db, args.concurrency, args.api_latency)
+        print(f"{name:>14}: {args.concurrency} msgs in {result['wall']:.2f}s "
+              f"-> {result['throughput']:.1f} msg/s, p50={result['p50'] * 1000:.0f}ms, "
+              f"p95={result['p95'] * 1000:.0f}ms")
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк рассылки уведомления о рейсе подписчикам (NotificationService.fan_out)
+через очередь отправки против локальной заглушки Bot API: ~30 сообщений/с на
+бота и ~1 сообщение/с на чат, иначе 429 с retry_after; часть пользователей
+заблокировала бота (403).
+
+Показывает время до первой и последней доставки, ход рассылки по четвертям,
+число 429 и сколько CPU уходит на текст: рендер на каждого получателя (как
+раньше) против рендера один раз на язык.
+
+Запуск:
+    python bench_fanout.py --subscribers 5000 --rate 30
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+import time
+
+PORT = 8770
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:8765")
+os.environ.setdefault("SUPABASE_ANON_KEY", "bench-key")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from bot.middlewares.send_queue import SendQueueMiddleware
+from bot.services.flight_diff import FieldChange
+from bot.services.notification_service import NotificationService
+from bot.services.rate_limiter import TokenBucket
+from bot.services.send_queue import TelegramSendQueue
+
+FLIGHT = {
+    "number": "QR 30",
+    "status": "Boarding",
+    "departure": {"airport": {"iata": "EDI"}, "gate": "D9", "terminal": "1",
+                  "revisedTime": {"local": "2025-07-20 14:35+01:00", "utc": "2025-07-20 13:35Z"}},
+    "arrival": {"airport": {"iata": "DOH"}}
+}
+CHANGES = [FieldChange("status", "GateClosed", "Boarding"), FieldChange("dep_gate", "D7", "D9")]
+
+stub = {"accepted": 0, "rejected": 0, "blocked": set(), "global": None, "chats": {}}
+
+
+async def start_stub_server(rate: float) -> None:
+    stub["global"] = TokenBucket(rate, period=1.0)
+
+    async def send_message(request: web.Request) -> web.Response:
+        form = await request.post()
+        chat_id = int(form["chat_id"])
+        if chat_id in stub["blocked"]:
+            return web.json_response({"ok": False, "error_code": 403,
+                                      "description": "Forbidden: bot was blocked by the user"}, status=403)
+        chat = stub["chats"].setdefault(chat_id, TokenBucket(3, period=3.0))
+        for bucket in (stub["global"], chat):
+            if not bucket.consume():
+                stub["rejected"] += 1
+                retry_after = max(1, math.ceil(bucket.time_until_available()))
+                return web.json_response({"ok": False, "error_code": 429,
+                                          "description": f"Too Many Requests: retry after {retry_after}",
+                                          "parameters": {"retry_after": retry_after}}, status=429)
+        stub["accepted"] += 1
+        await asyncio.sleep(0.03)
+        return web.json_response({"ok": True, "result": {
+            "message_id": stub["accepted"], "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": form.get("text", "")
+        }})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/sendMessage", send_message)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+
+def make_subscribers(count: int, blocked_share: float, seed: int = 1) -> list:
+    """Строки flight_subscriptions + users, как их выбирает flight-webhook"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        telegram_id = 10_000 + i
+        if rng.random() < blocked_share:
+            stub["blocked"].add(telegram_id)
+        language_code = rng.choice(["ru", "ru", "en", "uk", "de", "en-GB"])
+        rows.append({"user_id": f"u{i}", "users": {"telegram_id": telegram_id, "language_code": language_code}})
+    return rows
+
+
+def render_cost(service: NotificationService, subscribers: list) -> None:
+    renderer = service.renderer
+    started = time.perf_counter()
+    for row in subscribers:
+        renderer.render(FLIGHT, row["users"]["language_code"], with_details=True, changes=CHANGES)
+    per_recipient = time.perf_counter() - started
+
+    started = time.perf_counter()
+    fields = renderer.flight_fields(FLIGHT, with_changes=True)
+    texts = {}
+    for row in subscribers:
+        language = renderer.language(row["users"]["language_code"])
+        if language not in texts:
+            texts[language] = renderer.render_fields(fields, language, True, CHANGES)
+    once = time.perf_counter() - started
+    print(f"text rendering for {len(subscribers)} recipients: per recipient {per_recipient * 1000:.1f}ms, "
+          f"once per language {once * 1000:.1f}ms ({len(texts)} variants)")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=30, help="лимит заглушки и очереди, сообщений/с на бота")
+    parser.add_argument("--blocked", type=float, default=0.01, help="доля пользователей, заблокировавших бота")
+    parser.add_argument("--concurrency", type=int, default=50, help="отправок, одновременно ждущих очередь")
+    args = parser.parse_args()
+
+    await start_stub_server(args.rate)
+    subscribers = make_subscribers(args.subscribers, args.blocked)
+    queue = TelegramSendQueue(global_rate=args.rate)
+    queue.start()
+    bot = Bot(os.environ["BOT_TOKEN"], session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{PORT}")))
+    bot.session.middleware(SendQueueMiddleware(queue))
+    service = NotificationService(bot)
+
+    render_cost(service, subscribers)
+
+    quarters = {}
+
+    def on_progress(progress) -> None:
+        quarter = progress.processed * 4 // progress.total
+        if quarter not in quarters:
+            quarters[quarter] = progress.elapsed
+            print(f"   {progress.processed:5d}/{progress.total} processed at {progress.elapsed:6.1f}s "
+                  f"(queued {queue.queued})")
+
+    progress = await service.fan_out(FLIGHT, subscribers, changes=CHANGES, concurrency=args.concurrency,
+                                     on_progress=on_progress)
+    result = progress.as_dict()
+    print(f"fan-out: sent {result['sent']}, blocked {result['blocked']}, failed {result['failed']}, "
+          f"first delivery {result['time_to_first_delivery'] * 1000:.0f}ms, "
+          f"last delivery {result['elapsed']:.1f}s (ideal {args.subscribers / args.rate:.1f}s), "
+          f"429s {stub['rejected']}")
+    print(f"   queue: {queue.get_stats()}")
+    await queue.close()
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк обнаружения изменений рейса (FlightDiffEngine) на «шумной» ленте
+опросов: ответы AeroDataBox то теряют выход/ленту багажа, то сдвигают
+расчётное время на минуту-две, выход мигает между двумя значениями.
+Сравнивается прежнее сравнение «снимок целиком» (уведомление при любом
+отличии) и движок: сколько уведомлений ушло бы подписчикам (= вызовов Bot
+API), сколько строк пишется в flight_logs и сколько стоит один observe().
+
+Запуск:
+    python bench_flight_diff.py --flights 200 --polls 60 --subscribers 5
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:8765")
+os.environ.setdefault("SUPABASE_ANON_KEY", "bench-key")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bot.services.flight_diff import FlightDiffEngine, take_snapshot
+
+STATUSES = ["Expected", "Delayed", "CheckIn", "Boarding", "GateClosed", "Departed", "EnRoute", "Approaching", "Arrived"]
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.rows = 0
+        self.logged = {}
+
+    async def log_flight_change(self, flight_number: str, date: str, status_before: str, status_after: str,
+                                immediate: bool = False) -> None:
+        self.rows += 1
+        self.logged.setdefault((flight_number, date), []).insert(0, status_after)
+
+    async def get_flight_log_snapshots(self, flight_number: str, date: str, limit: int = 20) -> list:
+        return self.logged.get((flight_number, date), [])[:limit]
+
+    async def claim_flight_changes(self, flight_number: str, date: str, leg: str, changes: list,
+                                   lease: float, dedupe_ttl: float) -> dict:
+        # Единственный отправитель: все изменения его
+        return dict.fromkeys(changes, "claimed")
+
+    async def settle_flight_claims(self, flight_number: str, date: str, leg: str, changes: list,
+                                   delivered: bool) -> None:
+        pass
+
+
+def feed(flight_index: int, polls: int, rng: random.Random):
+    """Последовательность ответов для одного рейса"""
+    departure = datetime(2025, 7, 20, 6, tzinfo=timezone.utc) + timedelta(minutes=7 * flight_index)
+    gates = [f"D{rng.randint(1, 40)}", f"D{rng.randint(1, 40)}"]
+    for poll in range(polls):
+        stage = min(poll * len(STATUSES) // polls, len(STATUSES) - 1)
+        revised = departure + timedelta(minutes=rng.choice([0, 0, 1, 2, -1]) + (30 if stage >= 1 else 0))
+        flight = {
+            "number": f"QR {flight_index}",
+            "status": STATUSES[stage],
+            "departure": {"airport": {"iata": "EDI"}, "terminal": "1",
+                          "revisedTime": {"utc": revised.strftime("%Y-%m-%d %H:%MZ")}},
+            "arrival": {"airport": {"iata": "DOH"}},
+        }
+        if rng.random() > 0.3:
+            flight["departure"]["gate"] = gates[0] if rng.random() > 0.2 else gates[1]
+        if stage == len(STATUSES) - 1 and rng.random() > 0.3:
+            flight["arrival"]["baggageBelt"] = "5"
+        yield flight
+
+
+async def run(flights: int, polls: int, subscribers: int, seed: int) -> None:
+    db = FakeDatabase()
+    engine = FlightDiffEngine(db)
+    naive_notifications = engine_notifications = 0
+    observe_time = 0.0
+
+    for index in range(flights):
+        rng = random.Random(seed + index)
+        key = (f"QR{index}", "2025-07-20", "EDI", "DOH")
+        previous = None
+        for flight in feed(index, polls, rng):
+            fingerprint = take_snapshot(flight)
+            if previous is not None and fingerprint != previous:
+                naive_notifications += subscribers
+            previous = fingerprint
+
+            started = time.perf_counter()
+            changes = await engine.observe(key, flight)
+            observe_time += time.perf_counter() - started
+            if changes:
+                engine_notifications += subscribers
+                await engine.confirm(key)
+
+    observed = flights * polls
+    print(f"naive snapshot compare: {naive_notifications:6d} notifications (Bot API calls)")
+    print(f"FlightDiffEngine      : {engine_notifications:6d} notifications, "
+          f"{db.rows} flight_logs rows, observe {observe_time / observed * 1e6:.1f}µs")
+    print(f"   stats: {engine.get_stats()}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flights", type=int, default=200)
+    parser.add_argument("--polls", type=int, default=60, help="опросов одного рейса")
+    parser.add_argument("--subscribers", type=int, default=5, help="подписчиков на рейс")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    await run(args.flights, args.polls, args.subscribers, args.seed)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
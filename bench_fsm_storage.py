@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк FSM-хранилищ: тысячи параллельных сценариев дата → номер рейса
+(те же операции со state, что делают cmd_start, handle_simple_date_selection
+и handle_simple_flight_number_input).
+
+Запуск:
+    python bench_fsm_storage.py --flows 5000 --backends memory sqlite
+    REDIS_URL=redis://localhost:6379/0 python bench_fsm_storage.py --backends redis
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:8765")
+os.environ.setdefault("SUPABASE_ANON_KEY", "bench-key")
+os.environ.setdefault("FSM_SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "fsm_bench.sqlite3"))
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+
+from bot.handlers.fsm import SimpleFlightSearch
+from bot.services.fsm_storage import create_fsm_storage
+
+
+async def simulate_flow(storage, user_id: int) -> float:
+    """Один пользователь: /start → выбор даты → ввод номера → очистка"""
+    state = FSMContext(storage=storage, key=StorageKey(bot_id=1, chat_id=user_id, user_id=user_id))
+    started = time.perf_counter()
+
+    # cmd_start
+    await state.get_state()
+    await state.update_data(welcome_message_id=1, user_command_message_id=2)
+    await asyncio.sleep(0)
+
+    # handle_simple_date_selection
+    await state.update_data(selected_date="2025-07-20", selected_date_display="20.07.2025")
+    await state.set_state(SimpleFlightSearch.waiting_for_flight_number)
+    await state.update_data(instruction_message_id=3)
+    await asyncio.sleep(0)
+
+    # handle_text_message → handle_simple_flight_number_input
+    assert await state.get_state() == SimpleFlightSearch.waiting_for_flight_number.state
+    data = await state.get_data()
+    assert data["selected_date"] == "2025-07-20"
+    await state.clear()
+
+    return time.perf_counter() - started
+
+
+async def run_backend(backend: str, flows: int, concurrency: int) -> None:
+    try:
+        storage = create_fsm_storage(backend)
+    except Exception as e:
+        print(f"{backend:>8}: skipped ({e})")
+        return
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(user_id: int) -> None:
+        async with semaphore:
+            latencies.append(await simulate_flow(storage, user_id))
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(user_id) for user_id in range(flows)))
+        wall = time.perf_counter() - started
+    except Exception as e:
+        print(f"{backend:>8}: failed ({e})")
+        await storage.close()
+        return
+
+    latencies.sort()
+    print(f"{backend:>8}: {flows} flows in {wall:.2f}s -> {flows / wall:,.0f} flows/s, "
+          f"p50={statistics.median(latencies) * 1000:.2f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}ms")
+    await storage.close()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flows", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--backends", nargs="+", default=["memory", "sqlite", "redis"])
+    args = parser.parse_args()
+
+    for backend in args.backends:
+        await run_backend(backend, args.flows, args.concurrency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
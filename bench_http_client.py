@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк HTTP-клиента FlightService: новый httpx.AsyncClient на каждый запрос
+(как раньше) против общего пула соединений (bot.services.http_client).
+
+Поднимает локальную заглушку flight-api (по умолчанию с TLS на самоподписанном
+сертификате, чтобы учитывать стоимость рукопожатия).
+
+Запуск:
+    python bench_http_client.py --requests 200
+    python bench_http_client.py --no-tls
+"""
+
+import argparse
+import asyncio
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PORT = 8766
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("SUPABASE_ANON_KEY", "bench-key")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_certificate(directory: str) -> tuple:
+    """Самоподписанный сертификат для localhost через openssl"""
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-keyout", key, "-out", cert, "-subj", "/CN=localhost",
+         "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1"],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+async def start_stub_server(ssl_context) -> None:
+    from aiohttp import web
+
+    async def flight_api(request: web.Request) -> web.Response:
+        payload = await request.json()
+        return web.json_response({"success": True, "message": f"{payload.get('flight_number')} OK"})
+
+    app = web.Application()
+    app.router.add_post("/functions/v1/flight-api", flight_api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "localhost", PORT, ssl_context=ssl_context).start()
+
+
+def summarize(name: str, latencies: list, wall: float) -> None:
+    latencies.sort()
+    print(f"{name:>22}: mean={statistics.mean(latencies) * 1000:6.2f}ms "
+          f"p50={statistics.median(latencies) * 1000:6.2f}ms "
+          f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:6.2f}ms "
+          f"total={wall:.2f}s")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--no-tls", action="store_true")
+    args = parser.parse_args()
+
+    scheme = "http" if args.no_tls else "https"
+    os.environ["SUPABASE_URL"] = f"{scheme}://localhost:{PORT}"
+
+    ssl_context = None
+    if not args.no_tls:
+        cert, key = make_certificate(tempfile.mkdtemp())
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(cert, key)
+        # httpx доверяет сертификату через SSL_CERT_FILE (trust_env=True)
+        os.environ["SSL_CERT_FILE"] = cert
+
+    import httpx
+    from bot.config import FLIGHT_API_URL, SUPABASE_ANON_KEY
+    from bot.services.flight_service import FlightService
+    from bot.services.http_client import close_http_client
+
+    await start_stub_server(ssl_context)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def per_request_client() -> None:
+        async with httpx.AsyncClient(timeout=30) as client:
+            response = await client.post(
+                FLIGHT_API_URL,
+                json={"flight_number": "SU100", "date": "2025-07-20"},
+                headers={"Authorization": f"Bearer {SUPABASE_ANON_KEY}"}
+            )
+            response.raise_for_status()
+
+    flight_service = FlightService()
+
+    async def shared_client() -> None:
+        result = await flight_service.get_flight_data("SU100", "2025-07-20")
+        assert not result.get("error"), result
+
+    for name, call in (("before: client/request", per_request_client),
+                       ("after: shared client", shared_client)):
+        latencies = []
+
+        async def timed() -> None:
+            async with semaphore:
+                started = time.perf_counter()
+                await call()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(timed() for _ in range(args.requests)))
+        summarize(name, latencies, time.perf_counter() - started)
+
+    await close_http_client()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк стоимости одной отрисовки клавиатуры: прежнее построение
+pydantic-моделей на каждое сообщение против кэша bot.keyboards.inline_keyboards.
+
+Запуск:
+    python bench_keyboards.py --number 20000
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:8765")
+os.environ.setdefault("SUPABASE_ANON_KEY", "bench-key")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from bot.config import BUTTON_LABELS, CALLBACK_PREFIXES
+from bot.keyboards.inline_keyboards import (
+    get_flight_card_keyboard, get_simple_date_keyboard,
+    get_change_date_keyboard, get_default_keyboard
+)
+
+
+def legacy_simple_date_keyboard(lang="en"):
+    if lang == "ru":
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [
+                InlineKeyboardButton(text="Вчера", callback_data="simple_date:yesterday"),
+                InlineKeyboardButton(text="Сегодня", callback_data="simple_date:today"),
+                InlineKeyboardButton(text="Завтра", callback_data="simple_date:tomorrow"),
+            ]
+        ])
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="Yesterday", callback_data="simple_date:yesterday"),
+            InlineKeyboardButton(text="Today", callback_data="simple_date:today"),
+            InlineKeyboardButton(text="Tomorrow", callback_data="simple_date:tomorrow"),
+        ]
+    ])
+
+
+def legacy_change_date_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Change date", callback_data="change_date")]
+    ])
+
+
+def legacy_default_buttons():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="🔄 Refresh", callback_data="refresh"),
+            InlineKeyboardButton(text="🔍 New search", callback_data="new_search")
+        ]
+    ])
+
+
+def legacy_flight_card_keyboard(flight_id="", subscription_id="", is_subscribed=False, lang="en"):
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text=BUTTON_LABELS["refresh"][lang],
+                callback_data=f"{CALLBACK_PREFIXES['refresh']}{flight_id}"
+            ),
+            InlineKeyboardButton(
+                text=BUTTON_LABELS["unsubscribe" if is_subscribed else "subscribe"][lang],
+                callback_data=f"{CALLBACK_PREFIXES['unsubscribe' if is_subscribed else 'subscribe']}{subscription_id if is_subscribed else flight_id}"
+            )
+        ],
+        [
+            InlineKeyboardButton(text=BUTTON_LABELS["new_search"][lang], callback_data=CALLBACK_PREFIXES["new_search"]),
+            InlineKeyboardButton(text=BUTTON_LABELS["my_flights"][lang], callback_data=CALLBACK_PREFIXES["my_flights"])
+        ]
+    ])
+
+
+CASES = [
+    ("simple date", lambda: legacy_simple_date_keyboard("ru"), lambda: get_simple_date_keyboard("ru")),
+    ("change date", legacy_change_date_keyboard, get_change_date_keyboard),
+    ("default buttons", legacy_default_buttons, get_default_keyboard),
+    ("flight card",
+     lambda: legacy_flight_card_keyboard("6f1c2d3e-flight", "", False, "en"),
+     lambda: get_flight_card_keyboard("6f1c2d3e-flight", "", False, "en")),
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    for name, legacy, cached in CASES:
+        # Обе версии должны сериализоваться одинаково
+        assert legacy().model_dump(exclude_none=True) == cached().model_dump(exclude_none=True), name
+
+        before = min(timeit.repeat(legacy, number=args.number, repeat=3)) / args.number
+        after = min(timeit.repeat(cached, number=args.number, repeat=3)) / args.number
+        print(f"{name:>16}: {before * 1e6:7.2f}µs -> {after * 1e6:6.2f}µs per render "
+              f"({before / after:,.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
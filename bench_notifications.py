@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк форматирования уведомлений о рейсах: 100k уведомлений со смесью
+статусов. Сравниваются прежняя цепочка if/elif с split() и fromisoformat
+(воспроизведена ниже), NotificationService.format_notification_with_details
+на табличных шаблонах и рендер «поля один раз — текст на язык», как при
+рассылке одного рейса многим подписчикам.
+
+Запуск:
+    python bench_notifications.py --count 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:8765")
+os.environ.setdefault("SUPABASE_ANON_KEY", "bench-key")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bot.services.notification_renderer import STATUS_EMOJI
+from bot.services.notification_service import NotificationService
+
+STATUSES = ["Expected", "CheckIn", "Boarding", "Delayed", "GateClosed", "Departed", "EnRoute", "Approaching", "Arrived"]
+
+
+def make_flights(count: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    flights = []
+    for i in range(count):
+        hour, minute = rng.randint(0, 22), rng.randint(0, 59)
+        flights.append({
+            "number": f"QR {rng.randint(1, 999)}",
+            "status": rng.choice(STATUSES),
+            "departure": {
+                "gate": f"D{rng.randint(1, 40)}", "terminal": "1",
+                "scheduledTime": {"local": f"2025-07-20T{hour:02d}:{minute:02d}+03:00"},
+                "actualTime": {"local": f"2025-07-20T{hour + 1:02d}:{minute:02d}+03:00"}
+            },
+            "arrival": {
+                "scheduledTime": {"local": f"2025-07-20T{hour + 1:02d}:{minute:02d}+01:00"},
+                "actualTime": {"local": f"2025-07-20T{hour + 1:02d}:{minute:02d}+01:00"}
+            }
+        })
+    return flights
+
+
+def legacy_format(flight_data: dict) -> str:
+    """Прежняя реализация (только ветки, которые встречаются в смеси статусов)"""
+    flight_number = flight_data.get("number", "").replace(" ", "")
+    status = flight_data.get("status", "Unknown")
+    emoji = STATUS_EMOJI.get(status, "❓")
+    message = f"{flight_number}: "
+    if status == "Boarding":
+        gate = flight_data.get("departure", {}).get("gate")
+        message += f"Идет посадка, выход {gate} {emoji}" if gate else f"Идет посадка {emoji}"
+    elif status == "Departed":
+        actual_time = flight_data.get("departure", {}).get("actualTime", {}).get("local")
+        if actual_time:
+            time_str = actual_time.split("T")[1][:5] if "T" in actual_time else actual_time[:5]
+            message += f"Отправлен в {time_str} {emoji}"
+            arrival_time = flight_data.get("arrival", {}).get("scheduledTime", {}).get("local")
+            if arrival_time:
+                arrival_str = arrival_time.split("T")[1][:5] if "T" in arrival_time else arrival_time[:5]
+                message += f"\nПримерное время прибытия {arrival_str}"
+    elif status == "Arrived":
+        actual_time = flight_data.get("arrival", {}).get("actualTime", {}).get("local")
+        if actual_time:
+            time_str = actual_time.split("T")[1][:5] if "T" in actual_time else actual_time[:5]
+            message += f"Прибыл в {time_str} {emoji}"
+        else:
+            message += f"Прибыл {emoji}"
+    elif status == "Delayed":
+        notification_summary = flight_data.get("notificationSummary", "")
+        if "delay" in notification_summary.lower() or "задержка" in notification_summary.lower():
+            message += f"Задержка {emoji}"
+        else:
+            message += f"Задержка {emoji}"
+    elif status == "EnRoute":
+        message += f"В пути {emoji}"
+    elif status == "CheckIn":
+        message += f"Регистрация открыта {emoji}"
+    elif status == "GateClosed":
+        message += f"Выход закрыт {emoji}"
+    elif status == "Approaching":
+        message += f"Заходит на посадку {emoji}"
+    else:
+        notification_summary = flight_data.get("notificationSummary", "")
+        message += f"{notification_summary} {emoji}" if notification_summary else f"Статус: {status} {emoji}"
+
+    details = []
+    if flight_data.get("status") == "Delayed":
+        departure = flight_data.get("departure", {})
+        scheduled = departure.get("scheduledTime", {}).get("local")
+        actual = departure.get("actualTime", {}).get("local")
+        if scheduled and actual:
+            try:
+                scheduled_time = datetime.fromisoformat(scheduled.replace("Z", "+00:00"))
+                actual_time = datetime.fromisoformat(actual.replace("Z", "+00:00"))
+                delay_minutes = int((actual_time - scheduled_time).total_seconds() / 60)
+                if delay_minutes > 0:
+                    details.append(f"Задержка {delay_minutes} минут")
+            except:
+                pass
+    gate = flight_data.get("departure", {}).get("gate")
+    if gate and flight_data.get("status") in ["Boarding", "Departed"]:
+        details.append(f"Выход {gate}")
+    terminal = flight_data.get("departure", {}).get("terminal")
+    if terminal:
+        details.append(f"Терминал {terminal}")
+    if details:
+        message += f"\n{', '.join(details)}"
+    return message
+
+
+def measure(name: str, flights: list, render) -> None:
+    started = time.perf_counter()
+    for flight in flights:
+        render(flight)
+    elapsed = time.perf_counter() - started
+    print(f"{name:>28}: {elapsed:6.3f}s, {elapsed / len(flights) * 1e6:5.2f}µs per notification")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--recipients", type=int, default=100,
+                        help="получателей одного рейса при рендере «один раз на язык»")
+    args = parser.parse_args()
+
+    flights = make_flights(args.count)
+    service = NotificationService()
+    renderer = service.renderer
+
+    same = sum(legacy_format(flight) == service.format_notification_with_details(flight) for flight in flights[:1000])
+    print(f"identical output (ru) on first 1000: {same}/1000")
+
+    measure("if/elif (before)", flights, legacy_format)
+    measure("templates, ru", flights, service.format_notification_with_details)
+    measure("templates, en", flights, lambda flight: service.format_notification_with_details(flight, "en"))
+
+    # Рассылка: поля рейса считаются один раз, текст — по разу на язык, дальше копии
+    fanout_flights = flights[:args.count // args.recipients]
+    started = time.perf_counter()
+    for flight in fanout_flights:
+        fields = renderer.flight_fields(flight)
+        texts = {language: renderer.render_fields(fields, language, with_details=True) for language in renderer.languages}
+        for i in range(args.recipients):
+            texts[renderer.languages[i % len(renderer.languages)]]
+    elapsed = time.perf_counter() - started
+    sent = len(fanout_flights) * args.recipients
+    print(f"{'render once per language':>28}: {elapsed:6.3f}s, {elapsed / sent * 1e6:5.2f}µs per notification "
+          f"({len(fanout_flights)} flights x {args.recipients} recipients)")
+
+
+if __name__ == "__main__":
+    main()
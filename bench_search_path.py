@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пути поиска рейса (handle_simple_flight_number_input): время до
+ответа с карточкой рейса и полное время обработчика. Telegram и flight-api
+заменены заглушками с задержкой; прежний последовательный порядок вызовов
+(плейсхолдер → запрос рейса → ответ → пять удалений) воспроизведён для сравнения.
+Также считает вызовы Bot API на удаление сообщений за один поиск.
+
+Запуск:
+    python bench_search_path.py --searches 20 --telegram-latency 0.08 --api-latency 0.4
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:8765")
+os.environ.setdefault("SUPABASE_ANON_KEY", "bench-key")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bot.handlers.text import handle_simple_flight_number_input
+from bot.services.typing_service import TypingService
+
+FLIGHT = {
+    "success": True,
+    "message": "✈️ QR 30 EDI→DOH — Delayed",
+    "data": [{"number": "QR 30", "status": "Delayed",
+              "departure": {"airport": {"iata": "EDI"}}, "arrival": {"airport": {"iata": "DOH"}}}],
+    "buttons": [[{"text": "🔄 Refresh", "callback_data": "refresh"}]]
+}
+
+
+class FakeBot:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.delete_calls = 0
+
+    async def _call(self) -> bool:
+        await asyncio.sleep(self.latency)
+        return True
+
+    async def delete_message(self, chat_id: int, message_id: int) -> bool:
+        self.delete_calls += 1
+        return await self._call()
+
+    async def delete_messages(self, chat_id: int, message_ids: list) -> bool:
+        self.delete_calls += 1
+        return await self._call()
+
+    async def send_chat_action(self, chat_id: int, action: str) -> bool:
+        return await self._call()
+
+
+class FakeSentMessage:
+    def __init__(self, bot: FakeBot, message_id: int):
+        self.bot = bot
+        self.message_id = message_id
+
+    async def delete(self) -> bool:
+        return await self.bot.delete_message(1, self.message_id)
+
+
+class FakeMessage:
+    """Только то, что использует обработчик поиска"""
+
+    def __init__(self, bot: FakeBot, timeline: dict):
+        self.bot = bot
+        self.message_id = 10
+        self.bot_message_id = 100
+        self.chat = type("Chat", (), {"id": 1})()
+        self.from_user = type("User", (), {"id": 1})()
+        self.timeline = timeline
+
+    async def answer(self, text: str, **kwargs) -> FakeSentMessage:
+        await self.bot._call()
+        if not text.startswith("🔍"):
+            self.timeline.setdefault("first_answer", time.perf_counter())
+        self.bot_message_id += 1
+        return FakeSentMessage(self.bot, self.bot_message_id)
+
+    async def delete(self) -> bool:
+        return await self.bot.delete_message(self.chat.id, self.message_id)
+
+
+class FakeState:
+    async def get_data(self) -> dict:
+        return {"selected_date": "2025-07-20", "selected_date_display": "20.07.2025",
+                "instruction_message_id": 11, "welcome_message_id": 12, "user_command_message_id": 13}
+
+    async def clear(self) -> None:
+        pass
+
+
+class FakeFlightService:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def get_flight_data(self, flight_number: str, date: str, user_id=None) -> dict:
+        await asyncio.sleep(self.latency)
+        return FLIGHT
+
+
+async def legacy_search(message: FakeMessage, flight_service: FakeFlightService, state: FakeState) -> None:
+    """Порядок вызовов до изменения: всё последовательно"""
+    data = await state.get_data()
+    search_message = await message.answer("🔍 Searching for flight **QR30**...")
+    await flight_service.get_flight_data("QR30", data["selected_date"])
+    await message.answer(FLIGHT["message"])
+    await search_message.delete()
+    await message.delete()
+    for key in ("instruction_message_id", "welcome_message_id", "user_command_message_id"):
+        await message.bot.delete_message(message.chat.id, data[key])
+    await state.clear()
+
+
+async def run(name: str, searches: int, telegram_latency: float, api_latency: float) -> None:
+    first_answer, total, delete_calls = [], [], []
+    for _ in range(searches):
+        bot = FakeBot(telegram_latency)
+        timeline = {}
+        message = FakeMessage(bot, timeline)
+        flight_service = FakeFlightService(api_latency)
+        started = time.perf_counter()
+        if name == "sequential (before)":
+            await legacy_search(message, flight_service, FakeState())
+        else:
+            await handle_simple_flight_number_input(message, "QR30", {"id": "u1"}, None, flight_service,
+                                                    TypingService(bot), FakeState())
+        total.append(time.perf_counter() - started)
+        first_answer.append(timeline["first_answer"] - started)
+        # Удаление идёт фоновой задачей — ждём её, чтобы посчитать вызовы
+        await asyncio.sleep(telegram_latency * 2)
+        delete_calls.append(bot.delete_calls)
+    print(f"{name:>20}: first answer p50 {statistics.median(first_answer) * 1000:6.0f}ms, "
+          f"handler total p50 {statistics.median(total) * 1000:6.0f}ms, "
+          f"delete calls per search {statistics.mean(delete_calls):.0f}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--searches", type=int, default=20)
+    parser.add_argument("--telegram-latency", type=float, default=0.08, help="задержка одного вызова Bot API, сек")
+    parser.add_argument("--api-latency", type=float, default=0.4, help="задержка flight-api, сек")
+    args = parser.parse_args()
+
+    for name in ("sequential (before)", "current"):
+        await run(name, args.searches, args.telegram_latency, args.api_latency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк очереди исходящих сообщений (TelegramSendQueue) против локальной
+заглушки Bot API, которая, как Telegram, отвечает 429 с retry_after при
+превышении ~30 сообщений/с на бота и ~1 сообщения/с на чат.
+
+Сценарий: рассылка уведомлений по задержанному рейсу (часть подписчиков
+получает несколько сообщений подряд) и одновременно ответы пользователям.
+Сравнивается прямая отправка (как раньше) и отправка через очередь.
+
+Запуск:
+    python bench_send_queue.py --notifications 300 --chats 200 --replies 40
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import statistics
+import sys
+import time
+
+PORT = 8769
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:8765")
+os.environ.setdefault("SUPABASE_ANON_KEY", "bench-key")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from bot.middlewares.send_queue import SendQueueMiddleware
+from bot.services.rate_limiter import TokenBucket
+from bot.services.send_queue import PRIORITY_NOTIFICATION, TelegramSendQueue, send_with_priority
+
+stub = {"accepted": 0, "rejected": 0, "global": None, "chats": {}}
+
+
+def reset_stub() -> None:
+    stub.update(accepted=0, rejected=0, chats={}, **{"global": TokenBucket(30, period=1.0)})
+
+
+async def start_stub_server() -> None:
+    async def send_message(request: web.Request) -> web.Response:
+        form = await request.post()
+        chat_id = int(form["chat_id"])
+        chat = stub["chats"].setdefault(chat_id, TokenBucket(3, period=3.0))
+        for bucket in (stub["global"], chat):
+            if not bucket.consume():
+                stub["rejected"] += 1
+                retry_after = max(1, math.ceil(bucket.time_until_available()))
+                return web.json_response({"ok": False, "error_code": 429,
+                                          "description": f"Too Many Requests: retry after {retry_after}",
+                                          "parameters": {"retry_after": retry_after}})
+        stub["accepted"] += 1
+        await asyncio.sleep(0.03)
+        return web.json_response({"ok": True, "result": {
+            "message_id": stub["accepted"], "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": form.get("text", "")
+        }})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/sendMessage", send_message)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+
+async def scenario(bot: Bot, notifications: int, chats: int, replies: int) -> dict:
+    """Рассылка + ответы пользователям; возвращает задержки ответов и число потерь"""
+    reply_latency, lost = [], {"notifications": 0, "replies": 0}
+
+    async def notify(i: int) -> None:
+        try:
+            await send_with_priority(bot, 1000 + i % chats, f"QR30: Задержка ⏰ ({i})", PRIORITY_NOTIFICATION)
+        except Exception:
+            lost["notifications"] += 1
+
+    async def reply(i: int) -> None:
+        await asyncio.sleep(0.1 * i)
+        started = time.perf_counter()
+        try:
+            await bot.send_message(50 + i, "✈️ QR 30 EDI→DOH — Delayed")
+            reply_latency.append(time.perf_counter() - started)
+        except Exception:
+            lost["replies"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(notify(i) for i in range(notifications)), *(reply(i) for i in range(replies)))
+    return {"wall": time.perf_counter() - started, "reply_latency": reply_latency, **lost}
+
+
+def report(name: str, result: dict) -> None:
+    latency = sorted(result["reply_latency"]) or [0.0]
+    print(f"{name:>8}: {result['wall']:5.1f}s, 429s {stub['rejected']:4d}, "
+          f"lost notifications {result['notifications']:4d}, lost replies {result['replies']:3d}, "
+          f"reply latency p50 {statistics.median(latency) * 1000:5.0f}ms max {latency[-1] * 1000:5.0f}ms")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notifications", type=int, default=300)
+    parser.add_argument("--chats", type=int, default=200, help="подписчиков (чатов) в рассылке")
+    parser.add_argument("--replies", type=int, default=40, help="ответов пользователям во время рассылки")
+    args = parser.parse_args()
+
+    await start_stub_server()
+    server = TelegramAPIServer.from_base(f"http://127.0.0.1:{PORT}")
+
+    reset_stub()
+    bot = Bot(os.environ["BOT_TOKEN"], session=AiohttpSession(api=server))
+    report("direct", await scenario(bot, args.notifications, args.chats, args.replies))
+    await bot.session.close()
+
+    reset_stub()
+    await asyncio.sleep(1)
+    queue = TelegramSendQueue()
+    queue.start()
+    bot = Bot(os.environ["BOT_TOKEN"], session=AiohttpSession(api=server))
+    bot.session.middleware(SendQueueMiddleware(queue))
+    report("queue", await scenario(bot, args.notifications, args.chats, args.replies))
+    print(f"   stats: {queue.get_stats()}")
+    await queue.close()
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
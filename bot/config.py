@@ -39,6 +39,28 @@ LANGUAGE_MAPPING = {
     "pt": "en",  # Portuguese -> English
 }
 
+# FSM storage backend: "memory" (single process), "sqlite" (local file) or "redis"
+FSM_STORAGE = {
+    "backend": os.getenv('FSM_STORAGE', 'memory'),
+    "sqlite_path": os.getenv('FSM_SQLITE_PATH', 'fsm_storage.sqlite3'),
+    "redis_url": os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+    "state_ttl": 3600  # seconds an unfinished search is kept
+}
+
+# Update delivery: webhook when WEBHOOK_URL is set, long polling otherwise
+WEBHOOK = {
+    "url": os.getenv('WEBHOOK_URL'),  # public base URL, e.g. https://bot.example.com
+    "path": os.getenv('WEBHOOK_PATH', '/webhook'),
+    "secret": os.getenv('WEBHOOK_SECRET'),
+    "host": "0.0.0.0",
+    "port": int(os.getenv('PORT', '8080')),
+    # /health and /metrics in polling mode; off by default, so polling workers need no port
+    "polling_http": os.getenv('POLLING_HTTP', 'false').lower() == 'true',
+    "max_concurrent_updates": 100,  # updates processed at once per replica
+    "max_pending_updates": 1000,  # beyond this Telegram gets 503 and retries
+    "telegram_max_connections": 40
+}
+
 # Typing indicator settings
 TYPING_INDICATOR_ENABLED = True
 TYPING_DURATION = 3  # seconds
@@ -57,6 +79,66 @@ AERODATABOX_API_URL = 'https://aerodatabox.p.rapidapi.com'
 # Flight API settings
 FLIGHT_API_TIMEOUT = 30  # seconds
 
+# Shared HTTP client for Edge Functions (one pooled client per process)
+HTTP_CLIENT = {
+    "max_connections": int(os.getenv('HTTP_MAX_CONNECTIONS', '100')),
+    "max_keepalive_connections": int(os.getenv('HTTP_MAX_KEEPALIVE', '20')),
+    "keepalive_expiry": 60,  # seconds
+    "http2": True,
+    "timeout": FLIGHT_API_TIMEOUT
+}
+
+# Database (Supabase REST) connection pool settings
+DATABASE = {
+    "pool_max_connections": int(os.getenv('DB_POOL_MAX_CONNECTIONS', '20')),
+    "pool_max_keepalive": int(os.getenv('DB_POOL_MAX_KEEPALIVE', '10')),
+    "keepalive_expiry": 30,  # seconds
+    "http2": True,
+    "timeout": 10  # seconds
+}
+
+# Background cleanup of expired active_searches rows
+SEARCH_CLEANUP = {
+    "interval": 300,  # seconds between sweeps
+    "batch_size": 500,  # rows deleted per request
+    "cache_size": 5000  # recently written searches kept in memory
+}
+
+# In-process user cache (get_or_create_user) with write-behind of last_active
+USER_CACHE = {
+    "enabled": True,
+    "max_size": 10000,  # users
+    "ttl": 600,  # seconds
+    "flush_interval": 15,  # seconds between batched last_active upserts
+    "flush_batch_size": 500  # rows per upsert
+}
+
+# Asynchronous audit_logs writer: bounded queue, batched inserts, spill file on overload
+AUDIT_LOG = {
+    "enabled": True,
+    "queue_size": 10000,  # rows held in memory
+    "batch_size": 200,  # rows per insert
+    "flush_interval": 5,  # seconds
+    "overflow": "spill",  # spill | drop
+    "spill_path": os.getenv('AUDIT_SPILL_PATH', 'audit_spill.jsonl')
+}
+
+# flight_logs writer (one compact row per detected flight change), same batching as audit_logs
+FLIGHT_LOGS = {
+    "enabled": True,
+    "queue_size": 5000,  # rows held in memory
+    "batch_size": 100,  # rows per insert
+    "flush_interval": 10,  # seconds
+    "overflow": "drop"  # spill | drop
+}
+
+# In-process per-user index of flight_subscriptions (cards, My flights, limit check)
+SUBSCRIPTION_CACHE = {
+    "enabled": True,
+    "max_users": 10000,
+    "ttl": 300  # seconds; covers changes made by edge functions
+}
+
 # Message templates
 MESSAGE_TEMPLATES = {
     "welcome": {
@@ -162,6 +244,60 @@ BUTTON_LABELS = {
     "settings": {
         "en": "⚙️ Settings",
         "ru": "⚙️ Настройки"
+    },
+    "change_date": {
+        "en": "Change date",
+        "ru": "Изменить дату"
+    }
+}
+
+# Flight notification templates (NotificationRenderer). Per status, a list of
+# alternatives: the first one whose {placeholders} all have values is used.
+# Fields: flight, emoji, status, summary, gate, terminal, departure_actual,
+# arrival_actual, arrival_estimate, delay
+NOTIFICATION_TEMPLATES = {
+    "status": {
+        "Boarding": {
+            "en": ["Boarding, gate {gate} {emoji}", "Boarding {emoji}"],
+            "ru": ["Идет посадка, выход {gate} {emoji}", "Идет посадка {emoji}"]
+        },
+        "Departed": {
+            "en": ["Departed at {departure_actual} {emoji}\nEstimated arrival {arrival_estimate}",
+                   "Departed at {departure_actual} {emoji}", "Departed {emoji}"],
+            "ru": ["Отправлен в {departure_actual} {emoji}\nПримерное время прибытия {arrival_estimate}",
+                   "Отправлен в {departure_actual} {emoji}", "Отправлен {emoji}"]
+        },
+        "Arrived": {
+            "en": ["Arrived at {arrival_actual} {emoji}", "Arrived {emoji}"],
+            "ru": ["Прибыл в {arrival_actual} {emoji}", "Прибыл {emoji}"]
+        },
+        "Delayed": {"en": ["Delayed {emoji}"], "ru": ["Задержка {emoji}"]},
+        "Canceled": {"en": ["Canceled {emoji}"], "ru": ["Отменен {emoji}"]},
+        "EnRoute": {"en": ["En route {emoji}"], "ru": ["В пути {emoji}"]},
+        "CheckIn": {"en": ["Check-in open {emoji}"], "ru": ["Регистрация открыта {emoji}"]},
+        "GateClosed": {"en": ["Gate closed {emoji}"], "ru": ["Выход закрыт {emoji}"]},
+        "Approaching": {"en": ["Approaching {emoji}"], "ru": ["Заходит на посадку {emoji}"]},
+        # Any other status
+        "default": {
+            "en": ["{summary} {emoji}", "Status: {status} {emoji}"],
+            "ru": ["{summary} {emoji}", "Статус: {status} {emoji}"]
+        }
+    },
+    # Extra line of format_notification_with_details, joined with ", "
+    "details": {
+        "delay": {"en": "Delayed {delay} min", "ru": "Задержка {delay} минут"},
+        "gate": {"en": "Gate {gate}", "ru": "Выход {gate}"},
+        "terminal": {"en": "Terminal {terminal}", "ru": "Терминал {terminal}"}
+    },
+    # Labels of changed fields (flight_diff.DIFF_FIELDS); status is already in the first line
+    "changes": {
+        "dep_terminal": {"en": "Departure terminal", "ru": "Терминал вылета"},
+        "dep_gate": {"en": "Gate", "ru": "Выход"},
+        "dep_time": {"en": "New departure time", "ru": "Новое время вылета"},
+        "arr_terminal": {"en": "Arrival terminal", "ru": "Терминал прилета"},
+        "arr_gate": {"en": "Arrival gate", "ru": "Выход прилета"},
+        "arr_time": {"en": "New arrival time", "ru": "Новое время прибытия"},
+        "belt": {"en": "Baggage belt", "ru": "Лента выдачи багажа"}
     }
 }
 
@@ -187,21 +323,82 @@ ERROR_HANDLING = {
     "log_errors": True
 }
 
+# Logging settings
+LOGGING = {
+    "level": os.getenv('LOG_LEVEL', 'INFO'),
+    "flight_api_body_sample_rate": float(os.getenv('FLIGHT_API_BODY_SAMPLE_RATE', '0.01')),  # share of responses logged with body
+    "flight_api_body_max_chars": 1000,  # longer bodies are truncated in logs
+    # Values of these env vars are masked in every log record
+    "redact_env": ["BOT_TOKEN", "SUPABASE_ANON_KEY", "AERODATABOX_API_KEY", "AMPLITUDE_API_KEY",
+                   "AMPLITUDE_SECRET_KEY", "OPENAI_API_KEY", "WEBHOOK_SECRET"]
+}
+
 # Performance settings
 PERFORMANCE = {
     "cache_enabled": True,
-    "cache_ttl": 300,  # 5 minutes
+    "cache_ttl": 300,  # 5 minutes, for statuses not listed below
+    "cache_max_size": 1000,  # flight responses kept in memory
+    "cache_status_ttl": {  # seconds, by AeroDataBox flight status
+        "Arrived": 3600,
+        "Canceled": 3600,
+        "CanceledUncertain": 600,
+        "Diverted": 900,
+        "CheckIn": 120,
+        "Boarding": 60,
+        "GateClosed": 60,
+        "Departed": 120,
+        "EnRoute": 120,
+        "Approaching": 60,
+        "Delayed": 120
+    },
     "rate_limit_enabled": True,
     "rate_limit_per_user": 10,  # requests per minute
-    "rate_limit_per_global": 100  # requests per minute
+    "rate_limit_per_global": 100,  # requests per minute
+    "rate_limit_per_api": 60,  # upstream flight-api calls per minute
+    "rate_limit_api_max_wait": 5,  # seconds to wait for an upstream token
+    "rate_limit_idle_ttl": 300  # seconds before an idle user bucket is dropped
+}
+
+# Latency metrics (Prometheus text on WEBHOOK host/port + periodic log summary)
+METRICS = {
+    "enabled": True,
+    "path": "/metrics",
+    # Bearer token required by /metrics (Prometheus `authorization` / bearer_token); unset = not served
+    "token": os.getenv('METRICS_TOKEN'),
+    "log_interval": 60  # seconds between latency summaries in the log, 0 to disable
+}
+
+# Outgoing Bot API calls (interactive replies before notifications)
+TELEGRAM_SEND = {
+    "enabled": True,
+    "global_rate": 30,  # messages per second per bot
+    "per_chat_rate": 1,  # messages per second per chat
+    "per_chat_burst": 3,  # short bursts within a chat (search placeholder + answer)
+    "max_in_flight": 30,
+    "max_queue": 100000,
+    "max_retries": 3,  # re-sends after 429 retry_after
+    "max_retry_after": 60,  # seconds; longer waits fail the call
+    "congestion_threshold": 100  # queued calls above which typing indicators are skipped
 }
 
 # Notification settings
 NOTIFICATIONS = {
     "enabled": True,
     "subscription_limit": 10,  # max flights per user
-    "check_interval": 300,  # 5 minutes
-    "batch_size": 50  # notifications per batch
+    "check_interval": 300,  # 5 minutes: subscriptions reload and default poll interval
+    "batch_size": 50,  # flights polled / notifications sent per batch
+    "polling_enabled": True,  # poll subscribed flights in-bot, webhooks alone can be missed (deduped with flight-webhook via flight_notification_claims)
+    "min_check_interval": 60,  # boarding, gate closed, departure or landing within the hour
+    "max_check_interval": 6 * 3600,  # departure more than a day away
+    "tick": 15  # seconds between checks for due flights
+}
+
+# Change detection between flight snapshots (FlightDiffEngine)
+FLIGHT_DIFF = {
+    "min_time_shift": 300,  # seconds; smaller revised time moves are not reported
+    "dedupe_ttl": 6 * 3600,  # same change is notified once per flight within this window
+    "claim_lease": 15 * 60,  # seconds; a change claimed but never confirmed (sender died) can be claimed again
+    "max_flights": 5000  # snapshots kept in memory
 }
 
 # Analytics settings
@@ -215,10 +412,13 @@ ANALYTICS = {
         "api_key": os.getenv('AMPLITUDE_API_KEY'),
         "secret_key": os.getenv('AMPLITUDE_SECRET_KEY'),
         "project_id": os.getenv('AMPLITUDE_PROJECT_ID'),
+        "api_url": os.getenv('AMPLITUDE_API_URL', 'https://api2.amplitude.com/batch'),
         "batch_size": 100,
         "flush_interval": 10,  # seconds
         "max_retries": 3,
-        "timeout": 30
+        "timeout": 30,
+        "buffer_size": 10000,  # ring buffer, oldest events are overwritten when full
+        "gzip": True  # compress batch payloads
     },
     # Заблокированные пользователи (не отправлять аналитику)
     "blocked_users": [
@@ -2,22 +2,27 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 from datetime import datetime, timedelta
+from typing import Optional
 from bot.services.database import DatabaseService
 from bot.services.flight_service import FlightService
 from bot.services.language_service import LanguageService
 from bot.services.typing_service import TypingService
 from bot.services.search_service import SearchService
+from bot.services.analytics_service import AnalyticsService
 from bot.keyboards.inline_keyboards import (
     get_flight_card_keyboard, get_feature_request_keyboard, 
-    get_user_flights_keyboard, get_empty_keyboard
+    get_user_flights_keyboard, get_empty_keyboard,
+    get_simple_date_keyboard, get_change_date_keyboard, get_after_unsubscribe_keyboard
 )
-from bot.config import CALLBACK_PREFIXES, MESSAGE_TEMPLATES, DEFAULT_LANGUAGE, AERODATABOX_API_KEY, AERODATABOX_API_HOST, SUPABASE_URL
+from bot.config import CALLBACK_PREFIXES, MESSAGE_TEMPLATES, DEFAULT_LANGUAGE, AERODATABOX_API_KEY, AERODATABOX_API_HOST, SUPABASE_URL, NOTIFICATIONS
 import asyncio
 from aiogram.types import InlineKeyboardMarkup
 import logging
 import re
-import httpx
 from bot.handlers.fsm import SimpleFlightSearch
+from bot.services.http_client import get_http_client
+from bot.services.callback_codec import FlightRef, decode_flight_callback, flight_ref_from_data, token_filter
+from bot.services.message_cleanup import collect_tracked_message_ids, schedule_message_cleanup
 
 WEBHOOK_URL = "https://taanbgxivbqcuaxcspjx.supabase.co/functions/v1/flight-webhook"
 
@@ -39,34 +44,34 @@ async def create_subscription_via_supabase(user_id: str, flight_number: str, dat
         logger.info(f"[Supabase] Request URL: {url}")
         logger.info(f"[Supabase] Request payload: {payload}")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload)
-            
-            logger.info(f"[Supabase] Response status: {response.status_code}")
-            logger.info(f"[Supabase] Response body: {response.text}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('success'):
-                    return {
-                        "success": True,
-                        "subscription_id": data.get('subscription_id'),
-                        "message": "Subscription created successfully"
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": "supabase_error",
-                        "message": data.get('error', 'Unknown error from Supabase')
-                    }
+        client = get_http_client()
+        response = await client.post(url, json=payload)
+        
+        logger.info(f"[Supabase] Response status: {response.status_code}")
+        logger.info(f"[Supabase] Response body: {response.text}")
+        
+        if response.status_code == 200:
+            data = response.json()
+            if data.get('success'):
+                return {
+                    "success": True,
+                    "subscription_id": data.get('subscription_id'),
+                    "message": "Subscription created successfully"
+                }
             else:
-                logger.error(f"❌ Error creating subscription via Supabase: {response.status_code} {response.text}")
                 return {
                     "success": False,
-                    "error": f"HTTP {response.status_code}",
-                    "message": f"Failed to create subscription: {response.text}"
+                    "error": "supabase_error",
+                    "message": data.get('error', 'Unknown error from Supabase')
                 }
-                
+        else:
+            logger.error(f"❌ Error creating subscription via Supabase: {response.status_code} {response.text}")
+            return {
+                "success": False,
+                "error": f"HTTP {response.status_code}",
+                "message": f"Failed to create subscription: {response.text}"
+            }
+            
     except Exception as e:
         logger.error(f"❌ Exception creating subscription via Supabase: {e}")
         return {
@@ -78,7 +83,29 @@ async def create_subscription_via_supabase(user_id: str, flight_number: str, dat
 router = Router()
 logger = logging.getLogger(__name__)
 
-@router.callback_query(F.data == CALLBACK_PREFIXES["refresh"])
+def parse_flight_from_message(message_text: str) -> Optional[FlightRef]:
+    """Recover flight from card text (buttons sent before callback tokens were introduced)"""
+    # Ищем номер рейса в формате "QR 30 EDI→DOH" или "QR030 EDI→DOH"
+    flight_match = re.search(r'([A-Z0-9]{2,3}\s?\d{1,4})\s+([A-Z]{3})→([A-Z]{3})', message_text or '')
+    # Ищем дату в формате "(DD.MM.YYYY)"
+    date_match = re.search(r'\((\d{2}\.\d{2}\.\d{4})\)', message_text or '')
+    if not flight_match or not date_match:
+        return None
+    return FlightRef(
+        flight_number=flight_match.group(1).replace(' ', ''),
+        date=datetime.strptime(date_match.group(1), '%d.%m.%Y').strftime('%Y-%m-%d'),
+        dep_iata=flight_match.group(2),
+        arr_iata=flight_match.group(3)
+    )
+
+def resolve_flight_ref(callback: CallbackQuery, action: str) -> Optional[FlightRef]:
+    """Flight from callback token, falling back to parsing the message text"""
+    flight_ref = decode_flight_callback(action, callback.data)
+    if flight_ref:
+        return flight_ref
+    return parse_flight_from_message(getattr(callback.message, 'text', None))
+
+@router.callback_query((F.data == CALLBACK_PREFIXES["refresh"]) | F.data.regexp(token_filter("refresh")))
 async def handle_refresh_flight(callback: CallbackQuery, db: DatabaseService, 
                               flight_service: FlightService, typing_service: TypingService):
     """Handle refresh flight button"""
@@ -91,31 +118,11 @@ async def handle_refresh_flight(callback: CallbackQuery, db: DatabaseService,
             username=callback.from_user.username
         )
         
-        # Безопасно получаем текст сообщения
-        message_text = getattr(callback.message, 'text', None)
-        if not message_text:
-            await callback.answer("❌ No message text for flight update")
-            return
-        logger.info(f"🔍 DEBUG: Refreshing flight data from message: {message_text}")
-        
-        # Ищем номер рейса в формате "QR 30 EDI→DOH" или "QR030 EDI→DOH"
-        flight_match = re.search(r'([A-Z0-9]{2,3}\s?\d{1,4})\s+([A-Z]{3})→([A-Z]{3})', message_text)
-        if not flight_match:
+        flight_ref = resolve_flight_ref(callback, "refresh")
+        if not flight_ref:
             await callback.answer("❌ Could not parse flight information from message")
             return
-        flight_number = flight_match.group(1).replace(' ', '')
-        dep_iata = flight_match.group(2)
-        arr_iata = flight_match.group(3)
-        
-        # Ищем дату в формате "(DD.MM.YYYY)"
-        date_match = re.search(r'\((\d{2}\.\d{2}\.\d{4})\)', message_text)
-        if not date_match:
-            await callback.answer("❌ Could not parse date from message")
-            return
-        date_str = date_match.group(1)
-        # Конвертируем дату из DD.MM.YYYY в YYYY-MM-DD
-        date_obj = datetime.strptime(date_str, '%d.%m.%Y')
-        date = date_obj.strftime('%Y-%m-%d')
+        flight_number, date = flight_ref.flight_number, flight_ref.date
         
         logger.info(f"🔍 DEBUG: Parsed flight_number={flight_number}, date={date}")
         
@@ -135,10 +142,9 @@ async def handle_refresh_flight(callback: CallbackQuery, db: DatabaseService,
         
         if buttons:
             from bot.handlers.text import build_inline_keyboard
-            keyboard = build_inline_keyboard(buttons)
+            keyboard = build_inline_keyboard(buttons, flight_ref_from_data(flight_data.get('data'), flight_number, date) or flight_ref)
         else:
-            from aiogram.types import InlineKeyboardMarkup
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+            keyboard = get_empty_keyboard()
         
         # Безопасно вызываем edit_text или answer
         if hasattr(callback.message, 'edit_text') and callable(getattr(callback.message, 'edit_text', None)):
@@ -159,9 +165,10 @@ async def handle_refresh_flight(callback: CallbackQuery, db: DatabaseService,
             details={'error': str(e)}
         )
 
-@router.callback_query(F.data.startswith(CALLBACK_PREFIXES["subscribe"]))
+@router.callback_query(F.data.startswith(CALLBACK_PREFIXES["subscribe"]) | F.data.regexp(token_filter("subscribe")))
 async def handle_subscribe_flight(callback: CallbackQuery, db: DatabaseService, 
-                                flight_service: FlightService, typing_service: TypingService):
+                                flight_service: FlightService, typing_service: TypingService,
+                                analytics: AnalyticsService = None):
     """Handle subscribe to flight button"""
     logger.info(f"🔍 DEBUG: Subscribe callback triggered with data: {callback.data}")
     
@@ -172,34 +179,16 @@ async def handle_subscribe_flight(callback: CallbackQuery, db: DatabaseService,
             username=callback.from_user.username
         )
         
-        # Безопасно получаем текст сообщения
-        message_text = getattr(callback.message, 'text', None)
-        if not message_text:
-            await callback.answer("❌ No message text for flight parsing")
-            return
-        logger.info(f"🔍 DEBUG: Subscribing to flight from message: {message_text}")
-        
-        # Ищем номер рейса в формате "QR 1197 ELQ→DOH" или "QR1197 ELQ→DOH"
-        flight_match = re.search(r'([A-Z0-9]{2,3}\s?\d{1,4})\s+([A-Z]{3})→([A-Z]{3})', message_text)
-        if not flight_match:
+        flight_ref = resolve_flight_ref(callback, "subscribe")
+        if not flight_ref:
             await callback.answer("❌ Could not parse flight information from message")
             return
-        flight_number = flight_match.group(1).replace(' ', '')
-        dep_iata = flight_match.group(2)
-        arr_iata = flight_match.group(3)
-        
-        # Ищем дату в формате "(DD.MM.YYYY)"
-        date_match = re.search(r'\((\d{2}\.\d{2}\.\d{4})\)', message_text)
-        if not date_match:
-            await callback.answer("❌ Could not parse date from message")
-            return
-        date_str = date_match.group(1)
-        # Конвертируем дату из DD.MM.YYYY в YYYY-MM-DD
-        date_obj = datetime.strptime(date_str, '%d.%m.%Y')
-        date = date_obj.strftime('%Y-%m-%d')
+        flight_number, date = flight_ref.flight_number, flight_ref.date
+        dep_iata, arr_iata = flight_ref.dep_iata or None, flight_ref.arr_iata or None
+        date_str = datetime.strptime(date, '%Y-%m-%d').strftime('%d.%m.%Y')
         
-        # Ищем название авиакомпании
-        airline_match = re.search(r'Airline: ([^\n]+)', message_text)
+        # Название авиакомпании не входит в callback_data — берём из карточки, если есть
+        airline_match = re.search(r'Airline: ([^\n]+)', getattr(callback.message, 'text', None) or '')
         airline_name = airline_match.group(1) if airline_match else "Unknown"
         
         logger.info(f"🔍 DEBUG: Subscribing to flight_number={flight_number}, date={date}, airline={airline_name}")
@@ -216,6 +205,17 @@ async def handle_subscribe_flight(callback: CallbackQuery, db: DatabaseService,
             await callback.answer("❌ You are already subscribed to this flight!")
             return
         
+        if await db.subscription_limit_reached(user['id']):
+            if analytics:
+                await analytics.track_event(callback.from_user.id, "subscription_limit_reached", {
+                    "limit": NOTIFICATIONS['subscription_limit']
+                })
+            await callback.answer(
+                f"❌ You can follow up to {NOTIFICATIONS['subscription_limit']} flights. Unsubscribe from one to add another.",
+                show_alert=True
+            )
+            return
+        
         logger.info(f"🔍 DEBUG: Proceeding with subscription creation")
         
         # 1. Создаём подписку на рейс через AeroDataBox
@@ -258,6 +258,8 @@ async def handle_subscribe_flight(callback: CallbackQuery, db: DatabaseService,
         logger.info(f"🔍 DEBUG: Результат создания подписки: {db_subscription_id}")
         if db_subscription_id:
             await callback.answer("✅ Successfully subscribed to flight!")
+            if analytics:
+                await analytics.track_subscription(callback.from_user.id, "subscribe", flight_number, date)
             await db.log_audit(
                 user_id=user['id'],
                 action='flight_subscription_created',
@@ -271,10 +273,7 @@ async def handle_subscribe_flight(callback: CallbackQuery, db: DatabaseService,
             await callback.message.answer(f"✅ Subscription to flight {flight_number} {date_str} successfully created!")
             
             # Обновляем клавиатуру (кнопка должна стать 'Отписаться')
-            from bot.keyboards.inline_keyboards import get_flight_card_keyboard
-            flight = await db.get_or_create_flight(flight_number, date)
-            flight_id = flight.get('id', '')
-            keyboard = get_flight_card_keyboard(flight_id=flight_id, subscription_id=db_subscription_id, is_subscribed=True)
+            keyboard = get_flight_card_keyboard(subscription_id=db_subscription_id, is_subscribed=True, flight_ref=flight_ref)
             if hasattr(callback.message, 'edit_reply_markup') and callable(getattr(callback.message, 'edit_reply_markup', None)):
                 await callback.message.edit_reply_markup(reply_markup=keyboard)
         else:
@@ -318,7 +317,9 @@ async def handle_details(callback: CallbackQuery, db: DatabaseService, flight_se
         subscription = await db.get_flight_subscription(user['id'], flight_number, date)
         is_subscribed = subscription is not None
         subscription_id = subscription.get('id', '') if subscription else ''
-        keyboard = get_flight_card_keyboard(flight_id=flight_id, subscription_id=subscription_id, is_subscribed=is_subscribed)
+        flight_ref = flight_ref_from_data(flight_data.get('data'), flight_number, date)
+        keyboard = get_flight_card_keyboard(flight_id=flight_id, subscription_id=subscription_id, is_subscribed=is_subscribed,
+                                            flight_ref=flight_ref)
         await callback.message.answer(text, reply_markup=keyboard)
         await callback.answer()
     except Exception as e:
@@ -326,7 +327,7 @@ async def handle_details(callback: CallbackQuery, db: DatabaseService, flight_se
         await callback.answer("Error getting detailed information")
 
 @router.callback_query(F.data.startswith(CALLBACK_PREFIXES["unsubscribe"]))
-async def handle_unsubscribe_flight(callback: CallbackQuery, db: DatabaseService):
+async def handle_unsubscribe_flight(callback: CallbackQuery, db: DatabaseService, analytics: AnalyticsService = None):
     """Handle unsubscribe from flight button"""
     logger.info(f"🔍 DEBUG: Unsubscribe callback triggered with data: {callback.data}")
     try:
@@ -338,7 +339,7 @@ async def handle_unsubscribe_flight(callback: CallbackQuery, db: DatabaseService
         )
         
         # Получаем подписку из БД
-        subscription = await db.get_subscription_by_id(subscription_id)
+        subscription = await db.get_subscription_by_id(subscription_id, user['id'])
         if not subscription or subscription['user_id'] != user['id']:
             await callback.answer("❌ Subscription not found")
             return
@@ -349,14 +350,12 @@ async def handle_unsubscribe_flight(callback: CallbackQuery, db: DatabaseService
         # Unsubscribe from flight
         success = await db.unsubscribe_from_flight(user['id'], subscription_id)
         if success:
+            if analytics:
+                await analytics.track_subscription(callback.from_user.id, "unsubscribe", flight_number, flight_date)
             # Сообщение об успешной отписке
             await callback.message.answer(f"✅ You have successfully unsubscribed from flight {flight_number} {flight_date}")
             # Кнопки 'Найти новый рейс' и 'Мои рейсы'
-            from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🔍 New search", callback_data=CALLBACK_PREFIXES["new_search"])],
-                [InlineKeyboardButton(text="🗂 My flights", callback_data=CALLBACK_PREFIXES["my_flights"])]
-            ])
+            keyboard = get_after_unsubscribe_keyboard()
             await callback.message.answer("Choose an action:", reply_markup=keyboard)
         else:
             await callback.message.answer("❌ Error unsubscribing from flight")
@@ -451,7 +450,7 @@ async def handle_view_subscription(callback: CallbackQuery, db: DatabaseService,
         )
         
         # Get subscription details
-        subscription = await db.get_subscription_by_id(subscription_id)
+        subscription = await db.get_subscription_by_id(subscription_id, user['id'])
         if not subscription or subscription['user_id'] != user['id']:
             await callback.answer("❌ Subscription not found")
             return
@@ -467,7 +466,9 @@ async def handle_view_subscription(callback: CallbackQuery, db: DatabaseService,
             
             # Create keyboard with unsubscribe option
             from bot.keyboards.inline_keyboards import get_flight_card_keyboard
-            keyboard = get_flight_card_keyboard(subscription_id=subscription_id, is_subscribed=True)
+            flight_ref = FlightRef(flight_number, flight_date,
+                                   subscription.get('departure_airport') or '', subscription.get('arrival_airport') or '')
+            keyboard = get_flight_card_keyboard(subscription_id=subscription_id, is_subscribed=True, flight_ref=flight_ref)
             
             await callback.message.answer(text, reply_markup=keyboard)
             await callback.answer()
@@ -625,7 +626,8 @@ async def handle_select_flight(callback: CallbackQuery, db: DatabaseService,
         
         # Добавляем стандартные кнопки действий для одного рейса
         # Используем flight_detail.id как flight_id для кнопки Subscribe
-        keyboard = get_flight_card_keyboard(flight_id=uuid, subscription_id="", is_subscribed=False)
+        keyboard = get_flight_card_keyboard(flight_id=uuid, subscription_id="", is_subscribed=False,
+                                            flight_ref=flight_ref_from_data(flight_data))
         
         # Отправляем новое сообщение с одним рейсом
         try:
@@ -703,11 +705,8 @@ async def handle_simple_date_selection(callback: CallbackQuery, db: DatabaseServ
         # Send message asking for flight number
         text = f"✅ Date: **{date_text}** ({date_display})\n\n**Step 2 - enter flight number**\n\nExamples: SU100, QR123, 5J944, SU1323A"
         
-        # Create keyboard with change date button
-        from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Change date", callback_data="change_date")]
-        ])
+        # Keyboard with change date button
+        keyboard = get_change_date_keyboard()
         
         # Send new message and store its ID for later deletion
         sent_message = await callback.message.answer(text, reply_markup=keyboard, parse_mode="Markdown")
@@ -761,26 +760,28 @@ async def handle_change_date(callback: CallbackQuery, state: FSMContext):
     """Handle change date button - return to step 1"""
     try:
         # Clear current state and return to date selection
+        state_data = await state.get_data()
         await state.clear()
         
         # Get user language (default to Russian)
         lang = "ru"
         
         # Send new date selection message
-        from bot.handlers.start import get_simple_date_keyboard
         keyboard = get_simple_date_keyboard(lang)
         
         text = "**Step 1 - enter date or select below**"
         sent_message = await callback.message.answer(text, reply_markup=keyboard, parse_mode="Markdown")
         
-        # Store the new welcome message ID
-        await state.update_data(welcome_message_id=sent_message.message_id)
+        # Store the new welcome message ID; user's command is still removed when the search completes
+        await state.update_data(
+            welcome_message_id=sent_message.message_id,
+            user_command_message_id=state_data.get('user_command_message_id')
+        )
         
-        # Delete the current instruction message
-        try:
-            await callback.message.delete()
-        except Exception as e:
-            logger.warning(f"Could not delete instruction message: {e}")
+        # Delete the current instruction and the previous welcome message in background
+        schedule_message_cleanup(callback.bot, callback.message.chat.id, collect_tracked_message_ids(
+            state_data, callback.message.message_id, keys=('instruction_message_id', 'welcome_message_id')
+        ))
         
         await callback.answer("Select new date")
         
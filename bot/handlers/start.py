@@ -6,7 +6,9 @@ from aiogram.fsm.state import State, StatesGroup
 # from bot.services.database import DatabaseService
 from bot.services.language_service import LanguageService
 from bot.services.typing_service import TypingService
+from bot.services.analytics_service import AnalyticsService
 from bot.config import MESSAGE_TEMPLATES, DEFAULT_LANGUAGE, BUTTON_LABELS
+from bot.keyboards.inline_keyboards import get_simple_date_keyboard
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,29 +19,14 @@ class SimpleFlightSearch(StatesGroup):
     waiting_for_date = State()
     waiting_for_flight_number = State()
 
-def get_simple_date_keyboard(lang="en"):
-    """Get simple date selection keyboard"""
-    if lang == "ru":
-        return InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="Вчера", callback_data="simple_date:yesterday"),
-                InlineKeyboardButton(text="Сегодня", callback_data="simple_date:today"),
-                InlineKeyboardButton(text="Завтра", callback_data="simple_date:tomorrow"),
-            ]
-        ])
-    else:
-        return InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="Yesterday", callback_data="simple_date:yesterday"),
-                InlineKeyboardButton(text="Today", callback_data="simple_date:today"),
-                InlineKeyboardButton(text="Tomorrow", callback_data="simple_date:tomorrow"),
-            ]
-        ])
-
 @router.message(Command("start"))
-async def cmd_start(message: Message, language_service: LanguageService, typing_service: TypingService, state: FSMContext, db=None):
+async def cmd_start(message: Message, language_service: LanguageService, typing_service: TypingService, state: FSMContext, db=None,
+                    analytics: AnalyticsService = None):
     """Handle /start command with simplified flow"""
     try:
+        if analytics:
+            await analytics.track_command_usage(message.from_user.id, "/start", {"username": message.from_user.username})
+        
         # Check if we're already in a conversation
         current_state = await state.get_state()
         if current_state:
@@ -81,9 +68,13 @@ async def cmd_start(message: Message, language_service: LanguageService, typing_
         logger.error(f"❌ ERROR in cmd_start: {str(e)}")
 
 @router.message(Command("search"))
-async def cmd_search(message: Message, language_service: LanguageService, typing_service: TypingService, state: FSMContext, db=None):
+async def cmd_search(message: Message, language_service: LanguageService, typing_service: TypingService, state: FSMContext, db=None,
+                     analytics: AnalyticsService = None):
     """Handle /search command with simplified flow"""
     try:
+        if analytics:
+            await analytics.track_command_usage(message.from_user.id, "/search", {"username": message.from_user.username})
+        
         # Check if we're already in a conversation
         current_state = await state.get_state()
         if current_state:
@@ -3,24 +3,34 @@ from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from datetime import datetime, timedelta
+from typing import Optional
 from bot.services.database import DatabaseService
 from bot.services.flight_service import FlightService, extract_flight_number
 from bot.services.language_service import LanguageService
 from bot.services.typing_service import TypingService
 from bot.services.search_service import SearchService
-from bot.keyboards.inline_keyboards import get_date_selection_keyboard, get_flight_card_keyboard, get_feature_request_keyboard
+from bot.services.analytics_service import AnalyticsService
+from bot.services.callback_codec import FlightRef, flight_ref_from_data, tokenize_buttons
+from bot.services.message_cleanup import collect_tracked_message_ids, schedule_message_cleanup
+from bot.keyboards.inline_keyboards import (
+    get_date_selection_keyboard, get_flight_card_keyboard, get_feature_request_keyboard,
+    get_change_date_keyboard, get_default_keyboard
+)
 from bot.config import MESSAGE_TEMPLATES, DEFAULT_LANGUAGE
 from bot.handlers.fsm import SimpleFlightSearch, FlightSearchStates
 import asyncio
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 router = Router()
 
-def build_inline_keyboard(buttons_data):
+def build_inline_keyboard(buttons_data, flight_ref: Optional[FlightRef] = None):
     if not buttons_data:
         return None
+    # Кнопки refresh/subscribe несут рейс в callback_data, чтобы не парсить текст сообщения
+    buttons_data = tokenize_buttons(buttons_data, flight_ref)
     # Проверяем, что каждая строка — это массив кнопок
     keyboard = []
     for row in buttons_data:
@@ -32,7 +42,8 @@ def build_inline_keyboard(buttons_data):
 @router.message(F.text)
 async def handle_text_message(message: Message, state: FSMContext, db: DatabaseService, 
                             flight_service: FlightService, language_service: LanguageService,
-                            typing_service: TypingService, search_service: SearchService):
+                            typing_service: TypingService, search_service: SearchService,
+                            analytics: AnalyticsService = None):
     """Handle text messages for flight search with simplified flow"""
     try:
         # Get current state
@@ -58,7 +69,7 @@ async def handle_text_message(message: Message, state: FSMContext, db: DatabaseS
             # User is waiting to enter flight number
             flight_number = message.text.strip()
             if flight_number:
-                await handle_simple_flight_number_input(message, flight_number, user, db, flight_service, typing_service, state)
+                await handle_simple_flight_number_input(message, flight_number, user, db, flight_service, typing_service, state, analytics)
             else:
                 await message.answer("❌ Please enter flight number")
             return
@@ -73,7 +84,7 @@ async def handle_text_message(message: Message, state: FSMContext, db: DatabaseS
         # Check if this looks like a flight number
         flight_number = message.text.strip()
         if flight_number and not is_date_format(flight_number):
-            await handle_simple_flight_number_input(message, flight_number, user, db, flight_service, typing_service, state)
+            await handle_simple_flight_number_input(message, flight_number, user, db, flight_service, typing_service, state, analytics)
             return
         
         # If neither date nor flight number, show help
@@ -115,11 +126,8 @@ async def handle_simple_date_input(message: Message, date_input: str, user: dict
         
         text = f"✅ Date: **{date_display}**\n\n**Step 2 - enter flight number**\n\nExamples: SU100, QR123, 5J944, SU1323A"
         
-        # Create keyboard with change date button
-        from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Change date", callback_data="change_date")]
-        ])
+        # Keyboard with change date button
+        keyboard = get_change_date_keyboard()
         
         # Send message and store its ID for later deletion
         sent_message = await message.answer(text, reply_markup=keyboard, parse_mode="Markdown")
@@ -137,16 +145,15 @@ async def handle_simple_date_input(message: Message, date_input: str, user: dict
 
 async def handle_simple_flight_number_input(message: Message, flight_number: str, user: dict,
                                           db: DatabaseService, flight_service: FlightService,
-                                          typing_service: TypingService, state: FSMContext):
+                                          typing_service: TypingService, state: FSMContext,
+                                          analytics: AnalyticsService = None):
     """Handle flight number input in simplified flow"""
+    search_message = None
     try:
         # Get stored date from state, or use today's date as default
         state_data = await state.get_data()
         selected_date = state_data.get('selected_date')
         selected_date_display = state_data.get('selected_date_display')
-        instruction_message_id = state_data.get('instruction_message_id')
-        welcome_message_id = state_data.get('welcome_message_id')
-        user_command_message_id = state_data.get('user_command_message_id')
         
         if not selected_date:
             # Use today's date as default
@@ -155,20 +162,29 @@ async def handle_simple_flight_number_input(message: Message, flight_number: str
             selected_date = today_date
             selected_date_display = today_display
         
+        # Start upstream fetch first; independent Telegram calls run while it is in flight
+        search_started = time.monotonic()
+        fetch_task = asyncio.create_task(flight_service.get_flight_data(flight_number, selected_date, user['id']))
+        typing_task = asyncio.create_task(typing_service.show_typing_until(message.chat.id, fetch_task))
+        
         # Show that we're searching
         search_text = f"🔍 Searching for flight **{flight_number}** on **{selected_date_display}**..."
-        search_message = await message.answer(search_text, parse_mode="Markdown")
+        try:
+            search_message = await message.answer(search_text, parse_mode="Markdown")
+        except Exception as e:
+            logger.warning(f"Could not send search message: {e}")
         
         # Get flight data
-        flight_data = await flight_service.get_flight_data(flight_number, selected_date, user['id'])
+        flight_data = await fetch_task
+        await typing_task
+        if analytics:
+            await analytics.track_flight_search(
+                message.from_user.id, flight_number, selected_date,
+                success=bool(flight_data) and not (isinstance(flight_data, dict) and flight_data.get('error')),
+                response_time=round(time.monotonic() - search_started, 3)
+            )
         
         if not flight_data or (isinstance(flight_data, dict) and flight_data.get('error')):
-            # Delete search message first
-            try:
-                await search_message.delete()
-            except Exception as e:
-                logger.warning(f"Could not delete search message: {e}")
-            
             # Handle different types of errors
             if isinstance(flight_data, dict):
                 error_type = flight_data.get('data', {}).get('error') if flight_data.get('data') else flight_data.get('error')
@@ -182,6 +198,7 @@ async def handle_simple_flight_number_input(message: Message, flight_number: str
                 error_message = "❌ Flight not found or search error occurred."
             
             await message.answer(error_message)
+            schedule_message_cleanup(message.bot, message.chat.id, [search_message and search_message.message_id])
             await state.clear()
             return
         
@@ -192,7 +209,8 @@ async def handle_simple_flight_number_input(message: Message, flight_number: str
             buttons_data = flight_data.get('buttons', [])
             
             if buttons_data:
-                keyboard = build_inline_keyboard(buttons_data)
+                flight_ref = flight_ref_from_data(flight_data.get('data'), flight_number, selected_date)
+                keyboard = build_inline_keyboard(buttons_data, flight_ref)
                 await message.answer(result_text, reply_markup=keyboard, parse_mode="Markdown")
             else:
                 await message.answer(result_text, parse_mode="Markdown")
@@ -208,28 +226,10 @@ async def handle_simple_flight_number_input(message: Message, flight_number: str
                 buttons = get_default_buttons()
                 await message.answer(result_text, reply_markup=buttons, parse_mode="Markdown")
         
-        # NOW delete all previous messages
-        try:
-            # Delete search message
-            await search_message.delete()
-            
-            # Delete user's flight number input
-            await message.delete()
-            
-            # Delete instruction message
-            if instruction_message_id:
-                await message.bot.delete_message(message.chat.id, instruction_message_id)
-        
-            # Delete welcome message
-            if welcome_message_id:
-                await message.bot.delete_message(message.chat.id, welcome_message_id)
-            
-            # Delete user's command message (/start or /search)
-            if user_command_message_id:
-                await message.bot.delete_message(message.chat.id, user_command_message_id)
-                
-        except Exception as e:
-            logger.warning(f"Could not delete some messages: {e}")
+        # One deleteMessages call in background: placeholder, user's input, instruction, welcome and command messages
+        schedule_message_cleanup(message.bot, message.chat.id, collect_tracked_message_ids(
+            state_data, search_message and search_message.message_id, message.message_id
+        ))
         
         # Clear state after successful search
         await state.clear()
@@ -239,11 +239,7 @@ async def handle_simple_flight_number_input(message: Message, flight_number: str
     except Exception as e:
         logger.error(f"❌ ERROR in handle_number_input_with_search: {str(e)}")
         # Try to delete search message if it exists
-        try:
-            if 'search_message' in locals():
-                await search_message.delete()
-        except Exception as delete_error:
-            logger.warning(f"Could not delete search message: {delete_error}")
+        schedule_message_cleanup(message.bot, message.chat.id, [search_message and search_message.message_id])
         
         await message.answer("❌ Flight search error. Please try again.")
         # Clear state on error
@@ -328,16 +324,7 @@ def get_flight_selection_buttons(flights: list):
 
 def get_default_buttons():
     """Get default action buttons"""
-    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-    
-    keyboard = [
-        [
-            InlineKeyboardButton(text="🔄 Refresh", callback_data="refresh"),
-            InlineKeyboardButton(text="🔍 New search", callback_data="new_search")
-        ]
-    ]
-    
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+    return get_default_keyboard()
 
 def formatTelegramMessage(flight: dict) -> str:
     """Format flight data for Telegram message display"""
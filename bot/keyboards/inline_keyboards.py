@@ -1,33 +1,92 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from functools import lru_cache
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 from bot.config import BUTTON_LABELS, CALLBACK_PREFIXES
+from bot.services.callback_codec import FlightRef, encode_flight_callback
 
-def get_flight_card_keyboard(flight_id: str = "", subscription_id: str = "", is_subscribed: bool = False, lang: str = "en") -> InlineKeyboardMarkup:
-    """Create keyboard for flight card"""
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+# Keyboards returned by cached functions below are shared between messages:
+# treat them as read-only. The flight card is rendered by copying prebuilt
+# buttons with new callback_data (model_copy skips pydantic validation).
+
+def _button(text: str, callback_data: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=text, callback_data=callback_data)
+
+def _keyboard(rows: list) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+@lru_cache(maxsize=None)
+def _flight_card_template(is_subscribed: bool, lang: str) -> tuple:
+    """Prebuilt flight card: markup, refresh/action buttons with their prefixes, static second row"""
+    action = "unsubscribe" if is_subscribed else "subscribe"
+    refresh_button = _button(BUTTON_LABELS["refresh"][lang], CALLBACK_PREFIXES["refresh"])
+    action_button = _button(BUTTON_LABELS[action][lang], CALLBACK_PREFIXES[action])
+    static_row = [
+        _button(BUTTON_LABELS["new_search"][lang], CALLBACK_PREFIXES["new_search"]),
+        _button(BUTTON_LABELS["my_flights"][lang], CALLBACK_PREFIXES["my_flights"])
+    ]
+    markup = _keyboard([[refresh_button, action_button], static_row])
+    return markup, refresh_button, action_button, static_row
+
+def get_flight_card_keyboard(flight_id: str = "", subscription_id: str = "", is_subscribed: bool = False, lang: str = "en",
+                             flight_ref: Optional[FlightRef] = None) -> InlineKeyboardMarkup:
+    """Create keyboard for flight card (only callback_data is substituted per call).
+
+    With flight_ref, refresh/subscribe carry a compact token so handlers don't parse message text.
+    """
+    markup, refresh_button, action_button, static_row = _flight_card_template(is_subscribed, lang)
+    refresh_data = f"{refresh_button.callback_data}{flight_id}"
+    if is_subscribed:
+        action_data = f"{action_button.callback_data}{subscription_id}"
+    else:
+        action_data = f"{action_button.callback_data}{flight_id}"
+    if flight_ref:
+        refresh_data = encode_flight_callback("refresh", flight_ref) or refresh_data
+        if not is_subscribed:
+            action_data = encode_flight_callback("subscribe", flight_ref) or action_data
+    return markup.model_copy(update={"inline_keyboard": [
         [
-            InlineKeyboardButton(
-                text=BUTTON_LABELS["refresh"][lang],
-                callback_data=f"{CALLBACK_PREFIXES['refresh']}{flight_id}"
-            ),
-            InlineKeyboardButton(
-                text=BUTTON_LABELS["unsubscribe" if is_subscribed else "subscribe"][lang],
-                callback_data=f"{CALLBACK_PREFIXES['unsubscribe' if is_subscribed else 'subscribe']}{subscription_id if is_subscribed else flight_id}"
-            )
+            refresh_button.model_copy(update={"callback_data": refresh_data}),
+            action_button.model_copy(update={"callback_data": action_data})
         ],
+        static_row
+    ]})
+
+@lru_cache(maxsize=None)
+def get_simple_date_keyboard(lang: str = "en") -> InlineKeyboardMarkup:
+    """Get simple date selection keyboard"""
+    if lang not in BUTTON_LABELS["today"]:
+        lang = "en"
+    return _keyboard([
         [
-            InlineKeyboardButton(
-                text=BUTTON_LABELS["new_search"][lang],
-                callback_data=CALLBACK_PREFIXES["new_search"]
-            ),
-            InlineKeyboardButton(
-                text=BUTTON_LABELS["my_flights"][lang],
-                callback_data=CALLBACK_PREFIXES["my_flights"]
-            )
+            _button(BUTTON_LABELS["yesterday"][lang], "simple_date:yesterday"),
+            _button(BUTTON_LABELS["today"][lang], "simple_date:today"),
+            _button(BUTTON_LABELS["tomorrow"][lang], "simple_date:tomorrow")
         ]
     ])
-    return keyboard
+
+@lru_cache(maxsize=None)
+def get_change_date_keyboard(lang: str = "en") -> InlineKeyboardMarkup:
+    """Keyboard with 'Change date' button shown at step 2"""
+    return _keyboard([[_button(BUTTON_LABELS["change_date"][lang], "change_date")]])
+
+@lru_cache(maxsize=None)
+def get_default_keyboard(lang: str = "en") -> InlineKeyboardMarkup:
+    """Default actions under a flight result: refresh and new search"""
+    return _keyboard([
+        [
+            _button(BUTTON_LABELS["refresh"][lang], CALLBACK_PREFIXES["refresh"]),
+            _button(BUTTON_LABELS["new_search"][lang], CALLBACK_PREFIXES["new_search"])
+        ]
+    ])
+
+@lru_cache(maxsize=None)
+def get_after_unsubscribe_keyboard() -> InlineKeyboardMarkup:
+    """Actions offered after unsubscribing"""
+    return _keyboard([
+        [_button("🔍 New search", CALLBACK_PREFIXES["new_search"])],
+        [_button("🗂 My flights", CALLBACK_PREFIXES["my_flights"])]
+    ])
 
 def get_date_selection_keyboard(flight_number: str, lang: str = "en") -> InlineKeyboardMarkup:
     """Create keyboard for date selection"""
@@ -100,9 +159,10 @@ def get_user_flights_keyboard(subscriptions: List[Dict[str, Any]], lang: str = "
     
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@lru_cache(maxsize=None)
 def get_empty_keyboard() -> InlineKeyboardMarkup:
     """Create empty keyboard (for removing existing keyboard)"""
-    return InlineKeyboardMarkup(inline_keyboard=[]) 
+    return _keyboard([])
 
 def get_flight_action_keyboard(is_subscribed: bool, flight_id: str):
     if is_subscribed:
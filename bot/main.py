@@ -1,21 +1,31 @@
 import asyncio
 import logging
-import os
-print("ENV:", dict(os.environ))
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from bot.config import BOT_TOKEN, BOT_VERSION
+from bot.config import BOT_TOKEN, BOT_VERSION, LOGGING, METRICS, NOTIFICATIONS, PERFORMANCE, TELEGRAM_SEND, WEBHOOK
 from bot.services.database import DatabaseService
 from bot.services.flight_service import FlightService
 from bot.services.language_service import LanguageService
 from bot.services.typing_service import TypingService
+from bot.services.notification_service import NotificationService
+from bot.services.send_queue import TelegramSendQueue
 from bot.services.search_service import SearchService
+from bot.services.subscription_poller import SubscriptionPoller
+from bot.services.analytics_service import AnalyticsService
+from bot.services.http_client import close_http_client
+from bot.middlewares.rate_limit import RateLimitMiddleware
+from bot.middlewares.metrics import MetricsMiddleware
+from bot.middlewares.send_queue import SendQueueMiddleware
+from bot.services.metrics import log_metrics_periodically
+from bot.services.fsm_storage import create_fsm_storage
+from bot.services.log_filters import install_redaction
+from bot.webhook import run_webhook, run_polling
 
 # Configure logging
 logging.basicConfig(
-    level=logging.INFO,
+    level=LOGGING["level"],
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
+install_redaction(LOGGING["redact_env"])
 logger = logging.getLogger(__name__)
 
 async def main():
@@ -26,23 +36,62 @@ async def main():
             token=BOT_TOKEN
         )
         
-        # Use memory storage for FSM
-        storage = MemoryStorage()
+        # Outgoing sends and chat actions go through one rate-controlled queue
+        send_queue = None
+        if TELEGRAM_SEND["enabled"]:
+            send_queue = TelegramSendQueue()
+            send_queue.start()
+            bot.session.middleware(SendQueueMiddleware(send_queue))
+        
+        # FSM storage backend is selected by FSM_STORAGE config
+        storage = create_fsm_storage()
         dp = Dispatcher(storage=storage)
         
         # Initialize services
         db_service = DatabaseService()
+        db_service.start_user_flusher()
+        db_service.start_audit_writer()
         flight_service = FlightService()
         language_service = LanguageService()
-        typing_service = TypingService(bot)
+        typing_service = TypingService(bot, send_queue)
+        notification_service = NotificationService(bot)
         search_service = SearchService()
+        search_service.start_sweeper()
+        analytics_service = AnalyticsService()
+        analytics_service.start()
+        
+        # Missed webhooks are covered by polling subscribed flights
+        subscription_poller = None
+        if NOTIFICATIONS["enabled"] and NOTIFICATIONS["polling_enabled"]:
+            subscription_poller = SubscriptionPoller(db_service, flight_service, notification_service)
+            subscription_poller.start()
         
         # Register dependency injection
         dp["db"] = db_service
         dp["flight_service"] = flight_service
         dp["language_service"] = language_service
         dp["typing_service"] = typing_service
+        dp["notification_service"] = notification_service
+        dp["send_queue"] = send_queue
         dp["search_service"] = search_service
+        dp["analytics"] = analytics_service
+        dp["subscription_poller"] = subscription_poller
+        
+        # Rate limiting for incoming updates
+        if PERFORMANCE["rate_limit_enabled"]:
+            rate_limit = RateLimitMiddleware()
+            dp.message.outer_middleware(rate_limit)
+            dp.callback_query.outer_middleware(rate_limit)
+            dp["rate_limit"] = rate_limit
+        
+        # Handler latency (inner middleware: runs only for matched handlers)
+        metrics_summary_task = None
+        if METRICS["enabled"]:
+            metrics_middleware = MetricsMiddleware()
+            dp.message.middleware(metrics_middleware)
+            dp.callback_query.middleware(metrics_middleware)
+            if METRICS["log_interval"]:
+                metrics_summary_task = asyncio.create_task(log_metrics_periodically(METRICS["log_interval"]))
         
         # Include routers
         from bot.handlers import start, text, callbacks
@@ -54,8 +103,25 @@ async def main():
         logger.info(f"Starting Flight Status Bot v{BOT_VERSION}")
         logger.info("Bot is ready to handle messages")
         
-        # Start polling
-        await dp.start_polling(bot)
+        # Start receiving updates: webhook if configured, polling by default
+        try:
+            if WEBHOOK["url"]:
+                await run_webhook(bot, dp)
+            else:
+                await run_polling(bot, dp)
+        finally:
+            if metrics_summary_task:
+                metrics_summary_task.cancel()
+            if subscription_poller:
+                await subscription_poller.close()
+            # Let queued replies go out before the session is closed
+            if send_queue:
+                await send_queue.close()
+            # Release pooled connections on shutdown
+            await db_service.close()
+            await search_service.close()
+            await analytics_service.shutdown()
+            await close_http_client()
         
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
@@ -0,0 +1,26 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from bot.services.metrics import REGISTRY, MetricsRegistry
+
+class MetricsMiddleware(BaseMiddleware):
+    """Times every handler: bot_handler_duration_seconds{handler} and bot_handler_errors_total{handler}"""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        self.duration = registry.histogram("bot_handler_duration_seconds", "Duration of update handlers")
+        self.errors = registry.counter("bot_handler_errors_total", "Exceptions raised by update handlers")
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        # Registered as inner middleware, so the matched handler is already known
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else type(event).__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors.inc(handler=name)
+            raise
+        finally:
+            self.duration.observe(time.perf_counter() - started, handler=name)
@@ -0,0 +1,64 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Message, CallbackQuery
+from bot.config import PERFORMANCE
+from bot.services.rate_limiter import TokenBucket, KeyedRateLimiter
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_TEXT = "⏳ Too many requests, please wait a moment"
+
+class RateLimitMiddleware(BaseMiddleware):
+    """Per-user and global token-bucket limits for incoming messages and callbacks"""
+    
+    def __init__(self, per_user: int = PERFORMANCE["rate_limit_per_user"],
+                 per_global: int = PERFORMANCE["rate_limit_per_global"]):
+        self.user_limiter = KeyedRateLimiter(per_user, idle_ttl=PERFORMANCE["rate_limit_idle_ttl"])
+        self.global_bucket = TokenBucket(per_global)
+        # Users already warned during the current throttled streak
+        self._warned = set()
+        self.throttled_global = 0
+    
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        
+        if not self.user_limiter.allow(user.id):
+            logger.warning(f"🚦 User {user.id} throttled")
+            await self._notify_throttled(event, user.id)
+            return None
+        
+        if not self.global_bucket.consume():
+            # The update is not handled: the user's token goes back
+            self.user_limiter.refund(user.id)
+            self.throttled_global += 1
+            logger.warning(f"🚦 Global rate limit hit, dropping update from user {user.id}")
+            await self._notify_throttled(event, user.id)
+            return None
+        
+        self._warned.discard(user.id)
+        return await handler(event, data)
+    
+    async def _notify_throttled(self, event: TelegramObject, user_id: int) -> None:
+        """Tell the user once per throttled streak (callbacks are always answered)"""
+        try:
+            if isinstance(event, CallbackQuery):
+                await event.answer(THROTTLED_TEXT)
+            elif isinstance(event, Message) and user_id not in self._warned:
+                if len(self._warned) > len(self.user_limiter):
+                    # Forget users whose buckets already expired
+                    self._warned = {uid for uid in self._warned if uid in self.user_limiter}
+                self._warned.add(user_id)
+                await event.answer(THROTTLED_TEXT)
+        except Exception as e:
+            logger.warning(f"Could not send throttle notice: {e}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get throttling counters"""
+        return {
+            **self.user_limiter.get_stats(),
+            'throttled_global': self.throttled_global
+        }
@@ -0,0 +1,42 @@
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import (
+    CopyMessage, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup, EditMessageText,
+    ForwardMessage, Response, SendChatAction, SendDocument, SendMediaGroup, SendMessage, SendPhoto,
+    SendSticker, TelegramMethod
+)
+from aiogram.methods.base import TelegramType
+from bot.services.send_queue import TelegramSendQueue, send_priority
+
+# Calls that count against Telegram's per-chat message limits
+PACED_METHODS = (
+    SendMessage, SendPhoto, SendDocument, SendSticker, SendMediaGroup, CopyMessage, ForwardMessage,
+    EditMessageText, EditMessageReplyMarkup, EditMessageCaption, EditMessageMedia
+)
+
+class SendQueueMiddleware(BaseRequestMiddleware):
+    """Routes message sends and chat actions of this bot through TelegramSendQueue.
+
+    Priority comes from the `send_priority` context variable (interactive by
+    default). Other methods (getUpdates, answerCallbackQuery, deleteMessages...)
+    go straight to Telegram.
+    """
+
+    def __init__(self, queue: TelegramSendQueue):
+        self.queue = queue
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        if isinstance(method, PACED_METHODS):
+            paced = True
+        elif isinstance(method, SendChatAction):
+            paced = False
+        else:
+            return await make_request(bot, method)
+        return await self.queue.submit(
+            chat_id, lambda: make_request(bot, method),
+            priority=send_priority.get(), paced=paced, name=type(method).__name__
+        )
@@ -0,0 +1,257 @@
+import asyncio
+import gzip
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from typing import Optional, Dict, Any, List
+import httpx
+from bot.config import ANALYTICS, BOT_VERSION
+from bot.services.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+class AnalyticsService:
+    """Non-blocking Amplitude event pipeline.
+
+    track_* methods only append an event to a ring buffer (the oldest events are
+    overwritten when it is full). A background task sends gzip-compressed batches
+    of `batch_size` events, or whatever is buffered every `flush_interval` seconds,
+    retrying 429/5xx/network errors with exponential backoff. Events carry an
+    insert_id, so a retried batch is deduplicated by Amplitude.
+    """
+
+    def __init__(self, api_url: Optional[str] = None, client: Optional[httpx.AsyncClient] = None):
+        config = ANALYTICS.get("amplitude", {})
+        self.api_key = config.get("api_key")
+        self.api_url = api_url or config.get("api_url")
+        self.enabled = bool(ANALYTICS.get("enabled") and config.get("enabled") and self.api_key)
+        self.batch_size = config.get("batch_size", 100)
+        self.flush_interval = config.get("flush_interval", 10)
+        self.max_retries = config.get("max_retries", 3)
+        self.timeout = config.get("timeout", 30)
+        self.compress = config.get("gzip", True)
+        self.track_user_actions = ANALYTICS.get("track_user_actions", True)
+        self.track_api_calls = ANALYTICS.get("track_api_calls", True)
+        self.track_errors = ANALYTICS.get("track_errors", True)
+        # Set of str ids: membership check is O(1) whatever type the caller passes
+        self.blocked_users = frozenset(str(user_id) for user_id in ANALYTICS.get("blocked_users", []))
+
+        self._client = client
+        self._buffer: deque = deque(maxlen=config.get("buffer_size", 10000))
+        self._batch_ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+        # Metrics
+        self.tracked = 0
+        self.blocked = 0
+        self.overwritten = 0
+        self.sent = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed_events = 0
+
+        if self.enabled:
+            logger.info("Analytics service initialized")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client or get_http_client()
+
+    def start(self) -> None:
+        """Start background flushing"""
+        if self.enabled and not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    async def track_event(self, user_id: Any, event_type: str, event_properties: Optional[Dict[str, Any]] = None,
+                          user_properties: Optional[Dict[str, Any]] = None) -> None:
+        """Queue event for sending; never waits on the network"""
+        if not self.enabled:
+            return
+        if str(user_id) in self.blocked_users:
+            self.blocked += 1
+            return
+
+        event = {
+            "user_id": str(user_id),
+            "event_type": event_type,
+            "time": int(time.time() * 1000),
+            "insert_id": uuid.uuid4().hex,
+            "platform": "Telegram",
+            "app_version": BOT_VERSION,
+            "event_properties": event_properties or {}
+        }
+        if user_properties:
+            event["user_properties"] = user_properties
+
+        if len(self._buffer) == self._buffer.maxlen:
+            self.overwritten += 1
+        self._buffer.append(event)
+        self.tracked += 1
+        if len(self._buffer) >= self.batch_size:
+            self._batch_ready.set()
+
+    async def flush(self) -> int:
+        """Send everything buffered so far"""
+        if not self.enabled:
+            return 0
+        sent = 0
+        async with self._flush_lock:
+            while self._buffer:
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                try:
+                    delivered = await self._send_batch(batch)
+                except asyncio.CancelledError:
+                    # Shutdown mid-send: keep the batch for the final flush (insert_id dedupes)
+                    self._buffer.extendleft(reversed(batch))
+                    raise
+                if delivered:
+                    sent += len(batch)
+                else:
+                    self.failed_events += len(batch)
+        return sent
+
+    async def _send_batch(self, events: List[Dict[str, Any]]) -> bool:
+        body = json.dumps({"api_key": self.api_key, "events": events}, default=str).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.compress:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                await asyncio.sleep(min(2 ** (attempt - 1), 30))
+            try:
+                response = await self.client.post(self.api_url, content=body, headers=headers, timeout=self.timeout)
+            except httpx.HTTPError as e:
+                logger.warning(f"Analytics batch send failed (attempt {attempt + 1}): {e}")
+                continue
+
+            if response.status_code == 200:
+                self.sent += len(events)
+                self.batches += 1
+                logger.debug(f"Successfully sent {len(events)} events to Amplitude")
+                return True
+            if response.status_code != 429 and response.status_code < 500:
+                # Invalid payload won't get better on retry
+                logger.error(f"Failed to send events to Amplitude: {response.status_code} - {response.text}")
+                return False
+            logger.warning(f"Amplitude responded {response.status_code} (attempt {attempt + 1})")
+
+        logger.error(f"Dropping {len(events)} analytics events after {self.max_retries + 1} attempts")
+        return False
+
+    async def shutdown(self) -> None:
+        """Stop background task and send what is left"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pipeline metrics"""
+        return {
+            'buffered': len(self._buffer),
+            'tracked': self.tracked,
+            'blocked': self.blocked,
+            'overwritten': self.overwritten,
+            'sent': self.sent,
+            'batches': self.batches,
+            'retries': self.retries,
+            'failed_events': self.failed_events
+        }
+
+    # Event helpers (see docs/EVENTS_CATALOG.md)
+
+    async def track_user_action(self, user_id: Any, action: str, context: Optional[Dict[str, Any]] = None) -> None:
+        if self.track_user_actions:
+            await self.track_event(user_id, f"user_action_{action}", context)
+
+    async def track_api_call(self, user_id: Any, api_name: str, success: bool, response_time: float,
+                             context: Optional[Dict[str, Any]] = None) -> None:
+        if self.track_api_calls:
+            await self.track_event(user_id, "api_call", {
+                "api_name": api_name, "success": success, "response_time": response_time, **(context or {})
+            })
+
+    async def track_error(self, user_id: Any, error_type: str, error_message: str,
+                          context: Optional[Dict[str, Any]] = None) -> None:
+        if self.track_errors:
+            await self.track_event(user_id, "error", {
+                "error_type": error_type, "error_message": error_message, "context": context or {}
+            })
+
+    async def track_flight_search(self, user_id: Any, flight_number: str, date: str, success: bool,
+                                  response_time: Optional[float] = None) -> None:
+        await self.track_event(user_id, "flight_search", {
+            "flight_number": flight_number, "date": date, "success": success, "response_time": response_time
+        })
+
+    async def track_subscription(self, user_id: Any, action: str, flight_number: str, date: str) -> None:
+        await self.track_event(user_id, "subscription", {
+            "action": action, "flight_number": flight_number, "date": date
+        })
+
+    async def track_user_session(self, user_id: Any, username: Optional[str] = None, is_first_time: bool = False,
+                                 session_duration: Optional[float] = None) -> None:
+        properties = {"username": username, "is_first_time": is_first_time}
+        if session_duration is not None:
+            properties["session_duration"] = session_duration
+        await self.track_event(user_id, "user_first_visit" if is_first_time else "user_return_visit", properties,
+                               user_properties={"username": username} if username else None)
+
+    async def track_button_click(self, user_id: Any, button_name: str,
+                                 button_context: Optional[Dict[str, Any]] = None) -> None:
+        await self.track_event(user_id, "button_click", {
+            "button_name": button_name, "button_context": button_context or {}
+        })
+
+    async def track_command_usage(self, user_id: Any, command: str, context: Optional[Dict[str, Any]] = None) -> None:
+        await self.track_event(user_id, "command_used", {"command": command, **(context or {})})
+
+    async def track_message_received(self, user_id: Any, message_type: str, message_length: int,
+                                     context: Optional[Dict[str, Any]] = None) -> None:
+        await self.track_event(user_id, "message_received", {
+            "message_type": message_type, "message_length": message_length, **(context or {})
+        })
+
+    async def track_notification_sent(self, user_id: Any, notification_type: str, flight_number: str,
+                                      context: Optional[Dict[str, Any]] = None) -> None:
+        await self.track_event(user_id, "notification_sent", {
+            "notification_type": notification_type, "flight_number": flight_number, **(context or {})
+        })
+
+    async def track_user_engagement(self, user_id: Any, engagement_type: str, session_actions: int,
+                                    session_duration: float, context: Optional[Dict[str, Any]] = None) -> None:
+        await self.track_event(user_id, "user_engagement", {
+            "engagement_type": engagement_type, "session_actions": session_actions,
+            "session_duration": session_duration, **(context or {})
+        })
+
+    async def track_feature_usage(self, user_id: Any, feature_name: str,
+                                  feature_context: Optional[Dict[str, Any]] = None) -> None:
+        await self.track_event(user_id, "feature_used", {
+            "feature_name": feature_name, "feature_context": feature_context or {}
+        })
+
+    async def track_conversion(self, user_id: Any, conversion_type: str, conversion_value: float = 1.0,
+                               context: Optional[Dict[str, Any]] = None) -> None:
+        await self.track_event(user_id, "conversion", {
+            "conversion_type": conversion_type, "conversion_value": conversion_value, **(context or {})
+        })
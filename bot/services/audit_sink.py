@@ -0,0 +1,205 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List
+from postgrest.exceptions import APIError
+
+logger = logging.getLogger(__name__)
+
+# SQLSTATE classes where the rows themselves are at fault: data exception, integrity violation, syntax/undefined
+REJECTED_SQLSTATE_CLASSES = ("22", "23", "42")
+
+def is_rejected(error: Exception) -> bool:
+    """True if PostgREST refused the rows (4xx): retrying them unchanged cannot succeed"""
+    if not isinstance(error, APIError):
+        return False
+    code = str(error.code or "")
+    if code.startswith("PGRST"):
+        # PGRST1xx: bad request, PGRST2xx: unknown table/column
+        return code[5:6] in ("1", "2")
+    if code.isdigit() and len(code) == 3:
+        # HTTP status of a response without a JSON body
+        return code.startswith("4") and code not in ("408", "429")
+    return code[:2] in REJECTED_SQLSTATE_CLASSES
+
+class AuditSink:
+    """Asynchronous writer for audit_logs: bounded queue, batched multi-row inserts.
+
+    submit() never waits on the database. Rows are inserted in batches of
+    `batch_size` or every `flush_interval` seconds. When the queue is full (or an
+    insert fails) rows are appended to `spill_path` as JSON lines, or dropped when
+    overflow="drop"; spilled rows are replayed on the next start. A batch refused
+    for its content (FK, type error) is retried row by row and only the rejected
+    rows are dropped, so one bad row does not keep the batch spilling forever.
+    """
+
+    def __init__(self, client, max_queue: int = 10000, batch_size: int = 200,
+                 flush_interval: float = 5.0, overflow: str = "spill",
+                 spill_path: Optional[str] = None, table: str = "audit_logs"):
+        self.client = client
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.table = table
+        self._queue: deque = deque()
+        self._batch_ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.submitted = 0
+        self.written = 0
+        self.batches = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.rejected = 0
+        self.last_flush_duration = 0.0
+
+    def submit(self, row: Dict[str, Any]) -> bool:
+        """Queue row for writing; False if it had to be spilled or dropped"""
+        self.submitted += 1
+        if len(self._queue) >= self.max_queue:
+            self._overflow([row])
+            return False
+        self._queue.append(row)
+        if len(self._queue) >= self.batch_size:
+            self._batch_ready.set()
+        return True
+
+    def start(self) -> None:
+        """Start background writer (replays spilled rows first)"""
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        await self._replay_spill()
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Write everything queued so far in batches"""
+        written = 0
+        started = time.monotonic()
+        while self._queue:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            try:
+                if not await self._write(batch):
+                    break
+            except asyncio.CancelledError:
+                # Shutdown mid-insert: keep the batch for the final flush
+                self._queue.extendleft(reversed(batch))
+                raise
+            written += len(batch)
+        if written:
+            self.last_flush_duration = time.monotonic() - started
+        return written
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> bool:
+        """Insert batch; False if it failed and was spilled"""
+        try:
+            await self.client.table(self.table).insert(batch).execute()
+        except Exception as e:
+            if is_rejected(e):
+                logger.warning(f"{self.table} batch of {len(batch)} rejected ({e.code}), retrying row by row")
+                return await self._write_rows(batch)
+            self.failed_batches += 1
+            logger.error(f"Error writing {len(batch)} {self.table} rows: {e}")
+            self._overflow(batch)
+            return False
+        self.batches += 1
+        self.written += len(batch)
+        return True
+
+    async def _write_rows(self, batch: List[Dict[str, Any]]) -> bool:
+        """Insert rows one by one, dropping those the database refuses"""
+        for i, row in enumerate(batch):
+            try:
+                await self.client.table(self.table).insert(row).execute()
+            except Exception as e:
+                if not is_rejected(e):
+                    self.failed_batches += 1
+                    logger.error(f"Error writing {self.table} rows: {e}")
+                    self._overflow(batch[i:])
+                    return False
+                self.rejected += 1
+                logger.error(f"🗑 Dropped {self.table} row rejected by the database ({e.code}: {e.message}): "
+                             f"{json.dumps(row, default=str)[:300]}")
+                continue
+            self.written += 1
+        self.batches += 1
+        return True
+
+    def _overflow(self, rows: List[Dict[str, Any]]) -> None:
+        """Spill rows to local file, or drop them if spilling is off/unavailable"""
+        if not rows:
+            return
+        if self.overflow == "spill" and self.spill_path:
+            try:
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    for row in rows:
+                        f.write(json.dumps(row, default=str) + '\n')
+                self.spilled += len(rows)
+                return
+            except OSError as e:
+                logger.error(f"Error spilling {self.table} rows to {self.spill_path}: {e}")
+        self.dropped += len(rows)
+        logger.warning(f"🗑 Dropped {len(rows)} {self.table} rows ({self.dropped} total)")
+
+    async def _replay_spill(self) -> None:
+        """Insert rows spilled by a previous run"""
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        replay_path = f"{self.spill_path}.replay"
+        try:
+            os.replace(self.spill_path, replay_path)
+            with open(replay_path, 'r', encoding='utf-8') as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading spilled audit rows: {e}")
+            return
+
+        logger.info(f"📼 Replaying {len(rows)} spilled audit rows")
+        for i in range(0, len(rows), self.batch_size):
+            if not await self._write(rows[i:i + self.batch_size]):
+                # _write spilled the failed batch; keep the rest for the next start too
+                self._overflow(rows[i + self.batch_size:])
+                break
+        os.remove(replay_path)
+
+    async def close(self) -> None:
+        """Stop writer and flush what is left (spilling on failure)"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._queue:
+            self._overflow(list(self._queue))
+            self._queue.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue and writer metrics"""
+        return {
+            'queued': len(self._queue),
+            'submitted': self.submitted,
+            'written': self.written,
+            'batches': self.batches,
+            'spilled': self.spilled,
+            'dropped': self.dropped,
+            'failed_batches': self.failed_batches,
+            'rejected': self.rejected,
+            'last_flush_duration': self.last_flush_duration
+        }
@@ -0,0 +1,101 @@
+import re
+from datetime import date as date_cls, datetime, timedelta
+from typing import Any, NamedTuple, Optional
+
+# Compact callback_data for flight card buttons:
+#   <action><version>:<flight number>:<dep iata><arr iata>:<day>
+# e.g. "r1:QR30:EDIDOH:1k9" — day is a base36 offset from DAY_EPOCH.
+# Unknown versions decode to None, so handlers fall back to the legacy path.
+CALLBACK_VERSION = 1
+TOKEN_ACTIONS = {"refresh": "r", "subscribe": "s"}
+MAX_CALLBACK_BYTES = 64
+DAY_EPOCH = date_cls(2020, 1, 1)
+
+_TOKEN_RE = re.compile(r'^([a-z])(\d+):([A-Z0-9]{2,10}):((?:[A-Z0-9]{3}){0,2}):([0-9a-z]{1,4})$')
+_FLIGHT_RE = re.compile(r'[^A-Z0-9]')
+_BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+class FlightRef(NamedTuple):
+    """Flight identity carried in callback_data"""
+    flight_number: str
+    date: str
+    dep_iata: str = ''
+    arr_iata: str = ''
+
+def token_filter(action: str) -> str:
+    """Regex matching tokens of any version for action (for F.data.regexp)"""
+    return rf'^{TOKEN_ACTIONS[action]}\d+:'
+
+def _to_base36(value: int) -> str:
+    digits = ''
+    while True:
+        value, rem = divmod(value, 36)
+        digits = _BASE36[rem] + digits
+        if not value:
+            return digits
+
+def encode_flight_callback(action: str, ref: FlightRef) -> Optional[str]:
+    """Encode flight reference for button; None if it cannot be packed"""
+    flight_number = _FLIGHT_RE.sub('', (ref.flight_number or '').upper())
+    try:
+        day = (datetime.strptime(ref.date, '%Y-%m-%d').date() - DAY_EPOCH).days
+    except (TypeError, ValueError):
+        return None
+    if not 2 <= len(flight_number) <= 10 or day < 0:
+        return None
+
+    route = ''
+    if len(ref.dep_iata or '') == 3 and len(ref.arr_iata or '') == 3:
+        route = f"{ref.dep_iata}{ref.arr_iata}".upper()
+
+    data = f"{TOKEN_ACTIONS[action]}{CALLBACK_VERSION}:{flight_number}:{route}:{_to_base36(day)}"
+    if not _TOKEN_RE.match(data) or len(data.encode()) > MAX_CALLBACK_BYTES:
+        return None
+    return data
+
+def decode_flight_callback(action: str, data: str) -> Optional[FlightRef]:
+    """Decode token produced by encode_flight_callback; None for legacy/unknown data"""
+    match = _TOKEN_RE.match(data or '')
+    if not match:
+        return None
+    prefix, version, flight_number, route, day = match.groups()
+    if prefix != TOKEN_ACTIONS[action] or int(version) != CALLBACK_VERSION:
+        return None
+    flight_date = DAY_EPOCH + timedelta(days=int(day, 36))
+    return FlightRef(flight_number, flight_date.isoformat(), route[:3], route[3:])
+
+def flight_ref_from_data(flight: Any, flight_number: str = '', date: str = '') -> Optional[FlightRef]:
+    """Build FlightRef from a single AeroDataBox flight (or flight-api data with one flight)"""
+    if isinstance(flight, list):
+        if len(flight) != 1:
+            return None
+        flight = flight[0]
+    if not isinstance(flight, dict):
+        flight = {}
+
+    departure = flight.get('departure') or {}
+    arrival = flight.get('arrival') or {}
+    if not date:
+        scheduled = (departure.get('scheduledTime') or {}).get('local') or ''
+        date = scheduled[:10]
+    ref = FlightRef(
+        flight_number=flight.get('number') or flight_number,
+        date=date,
+        dep_iata=(departure.get('airport') or {}).get('iata') or '',
+        arr_iata=(arrival.get('airport') or {}).get('iata') or ''
+    )
+    return ref if ref.flight_number and ref.date else None
+
+def tokenize_buttons(buttons_data: list, ref: Optional[FlightRef]) -> list:
+    """Replace bare 'refresh'/'subscribe' callbacks from flight-api with tokens for ref"""
+    if not ref or not buttons_data:
+        return buttons_data
+    rows = []
+    for row in buttons_data:
+        new_row = []
+        for btn in row:
+            action = btn.get('callback_data')
+            token = encode_flight_callback(action, ref) if action in TOKEN_ACTIONS else None
+            new_row.append({**btn, 'callback_data': token} if token else btn)
+        rows.append(new_row)
+    return rows
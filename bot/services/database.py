@@ -1,31 +1,162 @@
-from supabase import create_client
-from typing import Optional, Dict, Any, List
+import asyncio
+import httpx
+from postgrest import AsyncPostgrestClient
+from typing import Optional, Dict, Any, List, Union
 import logging
 from datetime import datetime
-from bot.config import SUPABASE_URL, SUPABASE_ANON_KEY
+from bot.config import SUPABASE_URL, SUPABASE_ANON_KEY, DATABASE, USER_CACHE, SUBSCRIPTION_CACHE, NOTIFICATIONS, AUDIT_LOG, FLIGHT_LOGS
+from bot.services.audit_sink import AuditSink
+from bot.services.user_cache import UserCache
+from bot.services.subscription_cache import SubscriptionCache
+from bot.services.metrics import timed
 
 logger = logging.getLogger(__name__)
 
+class PooledPostgrestClient(AsyncPostgrestClient):
+    """Async PostgREST client backed by one pooled (optionally HTTP/2) httpx session"""
+    
+    def create_session(self, base_url: str, headers: Dict[str, str],
+                       timeout: Union[int, float, httpx.Timeout]) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=DATABASE["pool_max_connections"],
+            max_keepalive_connections=DATABASE["pool_max_keepalive"],
+            keepalive_expiry=DATABASE["keepalive_expiry"]
+        )
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            limits=limits,
+            http2=DATABASE["http2"]
+        )
+
+def create_async_client(url: str = SUPABASE_URL, key: str = SUPABASE_ANON_KEY) -> PooledPostgrestClient:
+    """Create async PostgREST client for Supabase REST API"""
+    return PooledPostgrestClient(
+        f"{url}/rest/v1",
+        headers={
+            "apiKey": key,
+            "Authorization": f"Bearer {key}",
+            "Accept": "application/json",
+            "Content-Type": "application/json"
+        },
+        timeout=DATABASE["timeout"]
+    )
+
+def _quote(value: str) -> str:
+    """Value for a PostgREST in.(...) list, which splits on commas outside double quotes"""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
 class DatabaseService:
-    def __init__(self):
+    def __init__(self, client: Optional[AsyncPostgrestClient] = None):
         if not SUPABASE_URL or not SUPABASE_ANON_KEY:
             raise ValueError("SUPABASE_URL and SUPABASE_ANON_KEY must be set and not None")
-        self.supabase = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+        self.supabase = client or create_async_client()
+        self.user_cache = UserCache(USER_CACHE["max_size"], USER_CACHE["ttl"]) if USER_CACHE["enabled"] else None
+        self._user_flush_task: Optional[asyncio.Task] = None
+        self.subscription_cache = SubscriptionCache(
+            SUBSCRIPTION_CACHE["max_users"], SUBSCRIPTION_CACHE["ttl"]
+        ) if SUBSCRIPTION_CACHE["enabled"] else None
+        self.audit_sink = AuditSink(
+            self.supabase,
+            max_queue=AUDIT_LOG["queue_size"],
+            batch_size=AUDIT_LOG["batch_size"],
+            flush_interval=AUDIT_LOG["flush_interval"],
+            overflow=AUDIT_LOG["overflow"],
+            spill_path=AUDIT_LOG["spill_path"]
+        ) if AUDIT_LOG["enabled"] else None
+        self.flight_log_sink = AuditSink(
+            self.supabase,
+            max_queue=FLIGHT_LOGS["queue_size"],
+            batch_size=FLIGHT_LOGS["batch_size"],
+            flush_interval=FLIGHT_LOGS["flush_interval"],
+            overflow=FLIGHT_LOGS["overflow"],
+            table='flight_logs'
+        ) if FLIGHT_LOGS["enabled"] else None
+        # (flight_number, date) -> flights.id, for flight_logs rows
+        self._flight_ids: Dict[tuple, str] = {}
+    
+    def start_user_flusher(self) -> None:
+        """Start periodic write-behind of cached user activity"""
+        if self.user_cache and not self._user_flush_task:
+            self._user_flush_task = asyncio.create_task(self._user_flush_loop())
+    
+    async def _user_flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(USER_CACHE["flush_interval"])
+            await self.flush_user_activity()
+    
+    @timed("database")
+    async def flush_user_activity(self) -> int:
+        """Write coalesced last_active/username changes in batched upserts"""
+        if not self.user_cache:
+            return 0
+        
+        flushed = 0
+        while True:
+            rows = self.user_cache.drain_pending(USER_CACHE["flush_batch_size"])
+            if not rows:
+                break
+            try:
+                await self.supabase.table('users').upsert(rows, on_conflict='id').execute()
+            except Exception as e:
+                logger.error(f"Error flushing user activity: {e}")
+                self.user_cache.restore_pending(rows)
+                break
+            self.user_cache.record_flush(len(rows))
+            flushed += len(rows)
+        
+        if flushed:
+            stats = self.user_cache.get_stats()
+            logger.info(f"👤 Flushed {flushed} user activity updates "
+                        f"(lag {stats['last_flush_lag']:.1f}s, hit rate {stats['hit_rate']:.0%})")
+        return flushed
+    
+    def start_audit_writer(self) -> None:
+        """Start background batched writers of audit_logs and flight_logs"""
+        if self.audit_sink:
+            self.audit_sink.start()
+        if self.flight_log_sink:
+            self.flight_log_sink.start()
+    
+    async def close(self) -> None:
+        """Flush pending user activity and audit rows, close pooled HTTP connections"""
+        if self._user_flush_task:
+            self._user_flush_task.cancel()
+            self._user_flush_task = None
+        await self.flush_user_activity()
+        if self.audit_sink:
+            await self.audit_sink.close()
+        if self.flight_log_sink:
+            await self.flight_log_sink.close()
+        await self.supabase.aclose()
     
+    @timed("database")
     async def get_or_create_user(self, telegram_id: int, username: Optional[str] = None, 
                                 language_code: str = "en", platform: str = "telegram") -> Dict[str, Any]:
         """Get existing user or create new one"""
         try:
+            # Hot users are served from cache, activity is written behind
+            if self.user_cache:
+                user = self.user_cache.get(telegram_id)
+                if user:
+                    self.user_cache.touch(user, username)
+                    return user
+            
             # Try to get existing user
-            response = self.supabase.table('users').select('*').eq('telegram_id', telegram_id).execute()
+            response = await self.supabase.table('users').select('*').eq('telegram_id', telegram_id).execute()
             
             if response.data:
                 user = response.data[0]
-                # Update last_active
-                self.supabase.table('users').update({
-                    'last_active': datetime.utcnow().isoformat(),
-                    'username': username or user.get('username')
-                }).eq('id', user['id']).execute()
+                if self.user_cache:
+                    self.user_cache.put(user)
+                    self.user_cache.touch(user, username)
+                else:
+                    # Update last_active
+                    await self.supabase.table('users').update({
+                        'last_active': datetime.utcnow().isoformat(),
+                        'username': username or user.get('username')
+                    }).eq('id', user['id']).execute()
                 return user
             
             # Create new user
@@ -39,13 +170,16 @@ class DatabaseService:
                 'last_active': datetime.utcnow().isoformat()
             }
             
-            response = self.supabase.table('users').insert(new_user).execute()
+            response = await self.supabase.table('users').insert(new_user).execute()
+            if self.user_cache:
+                self.user_cache.put(response.data[0])
             return response.data[0]
             
         except Exception as e:
             logger.error(f"Error in get_or_create_user: {e}")
             raise
     
+    @timed("database")
     async def save_message(self, user_id: str, message_id: int, content: str, 
                           parsed_json: Optional[Dict] = None) -> Dict[str, Any]:
         """Save user message to database"""
@@ -57,18 +191,19 @@ class DatabaseService:
                 'parsed_json': parsed_json
             }
             
-            response = self.supabase.table('messages').insert(message_data).execute()
+            response = await self.supabase.table('messages').insert(message_data).execute()
             return response.data[0]
             
         except Exception as e:
             logger.error(f"Error in save_message: {e}")
             raise
     
+    @timed("database")
     async def get_or_create_flight(self, flight_number: str, date: str) -> Dict[str, Any]:
         """Get existing flight or create new one"""
         try:
             # Try to get existing flight
-            response = self.supabase.table('flights').select('*').eq('flight_number', flight_number).eq('date', date).execute()
+            response = await self.supabase.table('flights').select('*').eq('flight_number', flight_number).eq('date', date).execute()
             
             if response.data:
                 return response.data[0]
@@ -79,17 +214,18 @@ class DatabaseService:
                 'date': date
             }
             
-            response = self.supabase.table('flights').insert(flight_data).execute()
+            response = await self.supabase.table('flights').insert(flight_data).execute()
             return response.data[0]
             
         except Exception as e:
             logger.error(f"Error in get_or_create_flight: {e}")
             raise
 
+    @timed("database")
     async def get_flight_by_id(self, flight_id: str) -> Dict[str, Any] | None:
         """Get flight by ID from flights table"""
         try:
-            response = self.supabase.table('flights').select('*').eq('id', flight_id).single().execute()
+            response = await self.supabase.table('flights').select('*').eq('id', flight_id).single().execute()
             if response.data:
                 return response.data
             return None
@@ -97,6 +233,7 @@ class DatabaseService:
             logger.error(f"Error in get_flight_by_id: {e}")
             return None
     
+    @timed("database")
     async def save_flight_request(self, user_id: str, flight_id: str) -> Dict[str, Any]:
         """Save flight request"""
         try:
@@ -105,13 +242,14 @@ class DatabaseService:
                 'flight_id': flight_id
             }
             
-            response = self.supabase.table('flight_requests').insert(request_data).execute()
+            response = await self.supabase.table('flight_requests').insert(request_data).execute()
             return response.data[0]
             
         except Exception as e:
             logger.error(f"Error in save_flight_request: {e}")
             raise
     
+    @timed("database")
     async def update_flight_details(self, flight_id: str, data_source: str, 
                                    raw_data: Dict, normalized_data: Dict) -> Dict[str, Any]:
         """Update flight details"""
@@ -124,13 +262,14 @@ class DatabaseService:
                 'last_checked_at': datetime.utcnow().isoformat()
             }
             
-            response = self.supabase.table('flight_details').upsert(details_data).execute()
+            response = await self.supabase.table('flight_details').upsert(details_data).execute()
             return response.data[0]
             
         except Exception as e:
             logger.error(f"Error in update_flight_details: {e}")
             raise
     
+    @timed("database")
     async def save_feature_request(self, user_id: str, feature_code: str, 
                                   flight_id: Optional[str] = None, comment: Optional[str] = None) -> Dict[str, Any]:
         """Save feature request"""
@@ -142,17 +281,18 @@ class DatabaseService:
                 'comment': comment
             }
             
-            response = self.supabase.table('feature_requests').insert(request_data).execute()
+            response = await self.supabase.table('feature_requests').insert(request_data).execute()
             return response.data[0]
             
         except Exception as e:
             logger.error(f"Error in save_feature_request: {e}")
             raise
     
+    @timed("database")
     async def get_translation(self, key: str, lang: str = "en") -> Optional[str]:
         """Get translation for key and language"""
         try:
-            response = self.supabase.table('translations').select('value').eq('key', key).eq('lang', lang).execute()
+            response = await self.supabase.table('translations').select('value').eq('key', key).eq('lang', lang).execute()
             if response.data:
                 return response.data[0]['value']
             return None
@@ -162,58 +302,134 @@ class DatabaseService:
             return None
     
     async def log_audit(self, user_id: str, action: str, details: Optional[Dict] = None) -> Dict[str, Any]:
-        """Log audit event"""
+        """Log audit event (queued for a batched insert when the audit writer is enabled)"""
         try:
             audit_data = {
                 'user_id': user_id,
                 'action': action,
-                'details': details
+                'details': details,
+                'created_at': datetime.utcnow().isoformat()
             }
             
-            response = self.supabase.table('audit_logs').insert(audit_data).execute()
+            if self.audit_sink:
+                self.audit_sink.submit(audit_data)
+                return audit_data
+            
+            response = await self.supabase.table('audit_logs').insert(audit_data).execute()
             return response.data[0]
             
         except Exception as e:
             logger.error(f"Error in log_audit: {e}")
             raise
     
+    async def _get_flight_id(self, flight_number: str, date: str) -> str:
+        key = (flight_number, date)
+        flight_id = self._flight_ids.get(key)
+        if flight_id is None:
+            flight_id = (await self.get_or_create_flight(flight_number, date))['id']
+            if len(self._flight_ids) >= 10000:
+                self._flight_ids.clear()
+            self._flight_ids[key] = flight_id
+        return flight_id
+    
+    @timed("database")
+    async def log_flight_change(self, flight_number: str, date: str, status_before: str, status_after: str,
+                                immediate: bool = False) -> None:
+        """Queue a flight_logs row for a detected change (written in batches unless immediate)"""
+        log_data = {
+            'flight_id': await self._get_flight_id(flight_number, date),
+            'status_before': status_before,
+            'status_after': status_after,
+            'event_time': datetime.utcnow().isoformat()
+        }
+        if self.flight_log_sink and not immediate:
+            self.flight_log_sink.submit(log_data)
+        else:
+            await self.supabase.table('flight_logs').insert(log_data).execute()
+    
+    @timed("database")
+    async def get_flight_log_snapshots(self, flight_number: str, date: str, limit: int = 20) -> List[str]:
+        """status_after of the flight's latest flight_logs rows, newest first"""
+        response = await self.supabase.table('flight_logs')\
+            .select('status_after')\
+            .eq('flight_id', await self._get_flight_id(flight_number, date))\
+            .order('event_time', desc=True)\
+            .limit(limit)\
+            .execute()
+        return [row['status_after'] for row in response.data or []]
+    
+    @timed("database")
+    async def claim_flight_changes(self, flight_number: str, date: str, leg: str, changes: List[str],
+                                   lease: float, dedupe_ttl: float) -> Dict[str, str]:
+        """Claim changes ('field=value') of a leg for notification: change -> claimed / pending / delivered"""
+        response = await self.supabase.rpc('claim_flight_changes', {
+            'p_flight_id': await self._get_flight_id(flight_number, date),
+            'p_leg': leg,
+            'p_changes': changes,
+            'p_lease': int(lease),
+            'p_dedupe_ttl': int(dedupe_ttl)
+        }).execute()
+        return {row['change']: row['outcome'] for row in response.data or []}
+    
+    @timed("database")
+    async def settle_flight_claims(self, flight_number: str, date: str, leg: str, changes: List[str],
+                                   delivered: bool) -> None:
+        """Mark claimed changes delivered, or give the claims back (delete them) when they were not"""
+        claims = self.supabase.table('flight_notification_claims')
+        if delivered:
+            query = claims.update({'delivered_at': datetime.utcnow().isoformat()})
+        else:
+            query = claims.delete().is_('delivered_at', 'null')
+        await query\
+            .eq('flight_id', await self._get_flight_id(flight_number, date))\
+            .eq('leg', leg)\
+            .in_('change', [_quote(change) for change in changes])\
+            .execute()
+    
+    async def _get_subscription_index(self, user_id: str) -> List[Dict[str, Any]]:
+        """All user's flight_subscriptions rows, newest first, loaded once per TTL"""
+        rows = self.subscription_cache.get(user_id)
+        if rows is None:
+            response = await self.supabase.table('flight_subscriptions')\
+                .select('*')\
+                .eq('user_id', user_id)\
+                .order('created_at', desc=True)\
+                .execute()
+            rows = response.data or []
+            self.subscription_cache.put(user_id, rows)
+        return rows
+
+    @timed("database")
     async def create_flight_subscription(self, subscription_data: dict) -> str | None:
         """Create or update a flight subscription in flight_subscriptions table"""
         try:
-            # Check if subscription already exists
-            existing = await self.get_flight_subscription(
-                subscription_data['user_id'], 
-                subscription_data['flight_number'], 
-                subscription_data['flight_date']
-            )
-            
-            if existing:
-                # Update existing subscription
-                logger.info(f"Updating existing subscription for flight {subscription_data['flight_number']}")
-                response = self.supabase.table('flight_subscriptions')\
-                    .update(subscription_data)\
-                    .eq('user_id', subscription_data['user_id'])\
-                    .eq('flight_number', subscription_data['flight_number'])\
-                    .eq('flight_date', subscription_data['flight_date'])\
-                    .execute()
-                if response.data and len(response.data) > 0:
-                    return response.data[0]['id']
-            else:
-                # Create new subscription
-                logger.info(f"Creating new subscription for flight {subscription_data['flight_number']}")
-                response = self.supabase.table('flight_subscriptions').insert(subscription_data).execute()
-                if response.data and len(response.data) > 0:
-                    return response.data[0]['id']
+            # create-subscription edge function may have inserted the row already,
+            # so insert-or-update in one request on UNIQUE(user_id, flight_number, flight_date)
+            logger.info(f"Saving subscription for flight {subscription_data['flight_number']}")
+            response = await self.supabase.table('flight_subscriptions')\
+                .upsert(subscription_data, on_conflict='user_id,flight_number,flight_date')\
+                .execute()
+            if response.data and len(response.data) > 0:
+                if self.subscription_cache:
+                    self.subscription_cache.add(subscription_data['user_id'], response.data[0])
+                return response.data[0]['id']
             
             return None
         except Exception as e:
             logger.error(f"Error in create_flight_subscription: {e}")
             return None
 
+    @timed("database")
     async def get_flight_subscription(self, user_id: str, flight_number: str, flight_date: str) -> dict | None:
         """Get a flight subscription by user, flight_number and date from flight_subscriptions table"""
         try:
-            response = self.supabase.table('flight_subscriptions').select('*')\
+            if self.subscription_cache:
+                for row in await self._get_subscription_index(user_id):
+                    if row.get('flight_number') == flight_number and row.get('flight_date') == flight_date:
+                        return row
+                return None
+            
+            response = await self.supabase.table('flight_subscriptions').select('*')\
                 .eq('user_id', user_id)\
                 .eq('flight_number', flight_number)\
                 .eq('flight_date', flight_date)\
@@ -225,31 +441,44 @@ class DatabaseService:
             logger.error(f"Error in get_flight_subscription: {e}")
             return None
 
+    @timed("database")
     async def unsubscribe_from_flight(self, user_id: str, flight_id: str) -> bool:
         """Unsubscribe user from flight in flight_subscriptions table by id"""
         try:
-            response = self.supabase.table('flight_subscriptions')\
+            response = await self.supabase.table('flight_subscriptions')\
                 .delete()\
                 .eq('user_id', user_id)\
                 .eq('id', flight_id)\
                 .execute()
+            if self.subscription_cache:
+                self.subscription_cache.remove(user_id, flight_id)
             return response.data is not None
         except Exception as e:
             logger.error(f"Error in unsubscribe_from_flight: {e}")
             return False
 
+    @timed("database")
+    async def subscription_limit_reached(self, user_id: str) -> bool:
+        """Whether user already has NOTIFICATIONS['subscription_limit'] active subscriptions"""
+        limit = NOTIFICATIONS.get("subscription_limit")
+        if not limit:
+            return False
+        return len(await self.get_user_subscriptions(user_id)) >= limit
+
+    @timed("database")
     async def is_subscribed(self, user_id: str, subscription_id: str) -> bool:
         """Check if user is subscribed to flight in flight_subscriptions table by subscription id"""
         try:
-            response = self.supabase.table('flight_subscriptions').select('id').eq('user_id', user_id).eq('id', subscription_id).execute()
+            response = await self.supabase.table('flight_subscriptions').select('id').eq('user_id', user_id).eq('id', subscription_id).execute()
             return len(response.data) > 0
         except Exception as e:
             logger.error(f"Error in is_subscribed: {e}")
             return False
 
+    @timed("database")
     async def get_flight_detail_by_uuid(self, uuid: str) -> dict | None:
         try:
-            response = self.supabase.table('flight_details').select('*').eq('id', uuid).single().execute()
+            response = await self.supabase.table('flight_details').select('*').eq('id', uuid).single().execute()
             if response.data:
                 return response.data
             return None
@@ -257,10 +486,15 @@ class DatabaseService:
             logger.error(f"Error in get_flight_detail_by_uuid: {e}")
             return None
 
+    @timed("database")
     async def get_user_subscriptions(self, user_id: str) -> List[Dict[str, Any]]:
         """Get all active flight subscriptions for a user"""
         try:
-            response = self.supabase.table('flight_subscriptions')\
+            if self.subscription_cache:
+                rows = await self._get_subscription_index(user_id)
+                return [row for row in rows if row.get('status') == 'active']
+            
+            response = await self.supabase.table('flight_subscriptions')\
                 .select('*')\
                 .eq('user_id', user_id)\
                 .eq('status', 'active')\
@@ -274,10 +508,39 @@ class DatabaseService:
             logger.error(f"Error in get_user_subscriptions: {e}")
             return []
 
-    async def get_subscription_by_id(self, subscription_id: str) -> Dict[str, Any] | None:
-        """Get subscription by ID"""
+    @timed("database")
+    async def get_active_subscriptions_for_polling(self, since_date: str, page_size: int = 1000) -> List[Dict[str, Any]]:
+        """All active subscriptions for flights on or after since_date, with subscriber's telegram_id"""
+        rows: List[Dict[str, Any]] = []
+        try:
+            while True:
+                response = await self.supabase.table('flight_subscriptions')\
+                    .select('id, user_id, flight_number, flight_date, departure_airport, arrival_airport, '
+                            'users!inner(telegram_id, language_code)')\
+                    .eq('status', 'active')\
+                    .gte('flight_date', since_date)\
+                    .order('id')\
+                    .range(len(rows), len(rows) + page_size - 1)\
+                    .execute()
+                page = response.data or []
+                rows.extend(page)
+                if len(page) < page_size:
+                    return rows
+        except Exception as e:
+            logger.error(f"Error in get_active_subscriptions_for_polling: {e}")
+            raise
+
+    @timed("database")
+    async def get_subscription_by_id(self, subscription_id: str, user_id: Optional[str] = None) -> Dict[str, Any] | None:
+        """Get subscription by ID (served from the user's index when user_id is known)"""
         try:
-            response = self.supabase.table('flight_subscriptions')\
+            if self.subscription_cache and user_id:
+                for row in await self._get_subscription_index(user_id):
+                    if row['id'] == subscription_id:
+                        return row
+                return None
+            
+            response = await self.supabase.table('flight_subscriptions')\
                 .select('*')\
                 .eq('id', subscription_id)\
                 .single()\
@@ -0,0 +1,103 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+CacheKey = Tuple[str, str, Optional[str]]
+
+def make_cache_key(flight_number: str, date: str, date_local_role: Optional[str] = None) -> CacheKey:
+    """Normalize (flight_number, date, date_local_role) into cache key"""
+    return (flight_number.replace(' ', '').upper(), date, date_local_role)
+
+def get_flight_statuses(result: Dict[str, Any]) -> list:
+    """Extract flight statuses from flight-api response"""
+    data = result.get('data')
+    if isinstance(data, list):
+        return [flight.get('status') for flight in data if isinstance(flight, dict)]
+    if isinstance(data, dict):
+        return [data.get('status')]
+    return []
+
+class FlightCache:
+    """Size-bounded LRU cache of flight-api responses with status-dependent TTL"""
+
+    def __init__(self, max_size: int = 1000, default_ttl: int = 300,
+                 status_ttl: Optional[Dict[str, int]] = None):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.status_ttl = status_ttl or {}
+        self._entries: "OrderedDict[CacheKey, tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_ttl(self, result: Dict[str, Any]) -> int:
+        """TTL for response: the shortest one among returned flights"""
+        statuses = get_flight_statuses(result)
+        if not statuses:
+            return self.default_ttl
+        return min(self.status_ttl.get(status, self.default_ttl) for status in statuses)
+
+    def is_cacheable(self, result: Dict[str, Any]) -> bool:
+        """Only successful responses with flight data are cached"""
+        if not isinstance(result, dict) or result.get('error') or not result.get('success'):
+            return False
+        data = result.get('data')
+        if isinstance(data, dict) and data.get('error'):
+            return False
+        return bool(data)
+
+    def get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        """Get cached response or None if missing/expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, result = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key: CacheKey, result: Dict[str, Any]) -> None:
+        """Store response if cacheable, evicting least recently used entries"""
+        if not self.is_cacheable(result):
+            return
+
+        ttl = self.get_ttl(result)
+        if ttl <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + ttl, result)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: CacheKey) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache metrics"""
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'evictions': self.evictions
+        }
@@ -0,0 +1,342 @@
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, Tuple
+from bot.config import FLIGHT_DIFF
+from bot.services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Compared fields: short name (used in flight_logs rows) -> path in an AeroDataBox flight
+DIFF_FIELDS = {
+    "status": ("status",),
+    "dep_terminal": ("departure", "terminal"),
+    "dep_gate": ("departure", "gate"),
+    "dep_time": ("departure", "revisedTime", "utc"),
+    "arr_terminal": ("arrival", "terminal"),
+    "arr_gate": ("arrival", "gate"),
+    "arr_time": ("arrival", "revisedTime", "utc"),
+    "belt": ("arrival", "baggageBelt"),
+}
+TIME_FIELDS = frozenset({"dep_time", "arr_time"})
+
+changes_total = REGISTRY.counter("flight_changes_total", "Flight field changes detected, by field and outcome")
+
+class FieldChange(NamedTuple):
+    field: str
+    before: Any
+    after: Any
+
+def _field(flight: Dict[str, Any], path: Tuple[str, ...]) -> Any:
+    value: Any = flight
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+def take_snapshot(flight: Dict[str, Any]) -> Dict[str, Any]:
+    """DIFF_FIELDS values of a flight as strings; blank values become None"""
+    snapshot = {}
+    for name, path in DIFF_FIELDS.items():
+        value = _field(flight, path)
+        if value is not None:
+            value = str(value).strip() or None
+        snapshot[name] = value
+    return snapshot
+
+def _parse_time(value: Any) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+def diff_snapshots(before: Dict[str, Any], after: Dict[str, Any], min_time_shift: float = 0) -> List[FieldChange]:
+    """Fields that changed between two snapshots.
+
+    A field missing from the newer snapshot is not a change: AeroDataBox drops
+    gates and belts from some responses. Revised times moving by less than
+    `min_time_shift` seconds are ignored.
+    """
+    changes = []
+    for name in DIFF_FIELDS:
+        old, new = before.get(name), after.get(name)
+        if new is None or new == old:
+            continue
+        if name in TIME_FIELDS and old is not None and min_time_shift:
+            old_time, new_time = _parse_time(old), _parse_time(new)
+            if old_time and new_time and abs((new_time - old_time).total_seconds()) < min_time_shift:
+                continue
+        changes.append(FieldChange(name, old, new))
+    return changes
+
+def format_log_value(changes: List[FieldChange], side: str) -> str:
+    """Compact 'field=value;...' text of changed fields for flight_logs (side: before/after)"""
+    return ";".join(f"{change.field}={getattr(change, side) or ''}" for change in changes)
+
+def _claim_key(change: FieldChange) -> str:
+    """'field=value' of a change in flight_notification_claims"""
+    return f"{change.field}={change.after}"
+
+def format_snapshot(snapshot: Dict[str, Any], leg: Tuple[str, str]) -> str:
+    """Whole snapshot as 'leg=DEP-ARR;field=value;...' (flight_logs.status_after), empty fields left out"""
+    values = ";".join(f"{name}={snapshot[name]}" for name in DIFF_FIELDS if snapshot.get(name) is not None)
+    return f"leg={leg[0]}-{leg[1]};{values}"
+
+def parse_snapshot(text: Optional[str]) -> Tuple[Optional[Tuple[str, str]], Dict[str, Any]]:
+    """(leg, snapshot) from format_snapshot() text; leg is None for rows without one"""
+    leg = None
+    snapshot = dict.fromkeys(DIFF_FIELDS)
+    for item in (text or "").split(";"):
+        name, _, value = item.partition("=")
+        if name == "leg":
+            dep, _, arr = value.partition("-")
+            leg = (dep, arr)
+        elif name in snapshot and value:
+            snapshot[name] = value
+    return leg, snapshot
+
+class FlightDiffEngine:
+    """Change detection for flight updates.
+
+    Keeps the last reported snapshot per key (flight number, date and route).
+    observe() compares a new flight with it field by field, records the changes
+    in flight_logs (one compact row per update) and returns the ones worth a
+    notification. Every row carries the whole snapshot after the update, so a
+    key unknown in memory (after a restart) starts from its latest flight_logs
+    row and changes made while the bot was down are still reported. Only a key
+    with no row at all gets a silent baseline (logged too).
+    A change already notified for the key within `dedupe_ttl` (a gate flapping
+    between two values, the same update seen twice) is logged but not returned.
+    The rest is claimed in flight_notification_claims, shared with flight-webhook
+    and other bot replicas: only a change claimed here is returned. One another
+    sender has delivered is dropped; one it is still delivering keeps its old
+    value here, so it is compared (and claimed) again next time and not lost if
+    that sender fails. A change counts as notified once the caller confirm()s
+    its delivery; a release()d one is rolled back and reported again.
+    """
+
+    def __init__(self, db: Any = None, min_time_shift: float = FLIGHT_DIFF["min_time_shift"],
+                 dedupe_ttl: float = FLIGHT_DIFF["dedupe_ttl"], max_flights: int = FLIGHT_DIFF["max_flights"],
+                 claim_lease: float = FLIGHT_DIFF["claim_lease"]):
+        self.db = db
+        self.min_time_shift = min_time_shift
+        self.dedupe_ttl = dedupe_ttl
+        self.claim_lease = claim_lease
+        self.max_flights = max_flights
+        self._snapshots: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        # (key, field, value) -> monotonic time the change was notified
+        self._notified: Dict[Tuple[Hashable, str, Any], float] = {}
+        # key -> (snapshot before, changes) while their delivery is in progress
+        self._pending: Dict[Hashable, Tuple[Dict[str, Any], List[FieldChange]]] = {}
+        self._last_sweep = time.monotonic()
+
+        # Metrics
+        self.observed = 0
+        self.baselines = 0
+        self.restored = 0
+        self.changed = 0
+        self.suppressed = 0
+        self.delivered_elsewhere = 0
+        self.deferred = 0
+        self.released = 0
+        self.log_errors = 0
+        self.claim_errors = 0
+
+    async def observe(self, key: Tuple[str, str, str, str], flight: Dict[str, Any]) -> List[FieldChange]:
+        """Changes of flight since the last call for key that subscribers have not been told about.
+
+        key is (flight_number, flight_date, departure_iata, arrival_iata). When
+        changes are returned, the caller reports the delivery outcome with
+        confirm() or release(); until then the key is not compared again.
+        """
+        self.observed += 1
+        if key in self._pending:
+            return []
+        snapshot = take_snapshot(flight)
+        previous = self._snapshots.get(key)
+        if previous is None:
+            previous = await self._load(key)
+            if previous is None:
+                self.baselines += 1
+                self._remember(key, snapshot)
+                await self._log(key, [], snapshot)
+                return []
+            self.restored += 1
+            self._remember(key, previous)
+
+        self._snapshots.move_to_end(key)
+        changes = diff_snapshots(previous, snapshot, self.min_time_shift)
+        if not changes:
+            return []
+        self.changed += 1
+        # Unchanged and missing fields keep the last reported value
+        current = {**previous, **{change.field: change.after for change in changes}}
+
+        now = time.monotonic()
+        self._sweep_notified(now)
+        fresh = []
+        for change in changes:
+            notified_at = self._notified.get((key, change.field, change.after))
+            if notified_at is not None and now - notified_at < self.dedupe_ttl:
+                self.suppressed += 1
+                changes_total.inc(field=change.field, outcome="suppressed")
+                continue
+            fresh.append(change)
+        deferred: List[FieldChange] = []
+        if fresh:
+            fresh, deferred = await self._claim(key, fresh)
+        if deferred:
+            # Still being sent by someone else: compare them again next time
+            changes = [change for change in changes if change not in deferred]
+            current = {**previous, **{change.field: change.after for change in changes}}
+
+        self._snapshots[key] = current
+        if changes:
+            # A row announcing a notification is written at once: a restart restores from it
+            await self._log(key, changes, current, immediate=bool(fresh))
+        if fresh:
+            self._pending[key] = (previous, fresh)
+        return fresh
+
+    async def _claim(self, key: Tuple[str, str, str, str],
+                     changes: List[FieldChange]) -> Tuple[List[FieldChange], List[FieldChange]]:
+        """(claimed, deferred): changes this engine may notify, and ones another sender is delivering.
+
+        Changes another sender (flight-webhook, another bot replica) has already
+        delivered are dropped. If the claim fails, all changes are returned as
+        claimed: a possible duplicate is better than a lost notification.
+        """
+        if not self.db:
+            return changes, []
+        try:
+            outcomes = await self.db.claim_flight_changes(key[0], key[1], f"{key[2]}-{key[3]}",
+                                                          [_claim_key(change) for change in changes],
+                                                          self.claim_lease, self.dedupe_ttl)
+        except Exception as e:
+            self.claim_errors += 1
+            logger.error(f"Error claiming changes of {key[0]} {key[1]}: {e}")
+            return changes, []
+        claimed, deferred = [], []
+        for change in changes:
+            outcome = outcomes.get(_claim_key(change), "claimed")
+            if outcome == "delivered":
+                self.delivered_elsewhere += 1
+                changes_total.inc(field=change.field, outcome="delivered_elsewhere")
+            elif outcome == "pending":
+                self.deferred += 1
+                changes_total.inc(field=change.field, outcome="deferred")
+                deferred.append(change)
+            else:
+                claimed.append(change)
+        return claimed, deferred
+
+    async def _settle(self, key: Tuple[str, str, str, str], changes: List[FieldChange], delivered: bool) -> None:
+        if not self.db:
+            return
+        try:
+            await self.db.settle_flight_claims(key[0], key[1], f"{key[2]}-{key[3]}",
+                                               [_claim_key(change) for change in changes], delivered)
+        except Exception as e:
+            # Left pending: another sender takes the claim over after claim_lease
+            self.claim_errors += 1
+            logger.error(f"Error settling claimed changes of {key[0]} {key[1]}: {e}")
+
+    async def confirm(self, key: Tuple[str, str, str, str]) -> None:
+        """Changes returned by observe() were delivered: suppress them for dedupe_ttl"""
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        now = time.monotonic()
+        for change in pending[1]:
+            self._notified[(key, change.field, change.after)] = now
+            changes_total.inc(field=change.field, outcome="notified")
+        await self._settle(key, pending[1], delivered=True)
+
+    async def release(self, key: Tuple[str, str, str, str]) -> None:
+        """Changes returned by observe() were not delivered (fan-out failed or cancelled).
+
+        The key goes back to its previous snapshot, in memory and in flight_logs,
+        and the claims are given back, so the next observe() here (also after a
+        restart) or another sender reports the changes again.
+        """
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        previous, changes = pending
+        self.released += 1
+        for change in changes:
+            changes_total.inc(field=change.field, outcome="undelivered")
+        if key in self._snapshots:
+            self._snapshots[key] = previous
+        await self._settle(key, changes, delivered=False)
+        # Written at once like the announcing row: if it were batched (or dropped on
+        # overflow) a restart would restore the announced state and lose the changes
+        await self._log(key, changes, previous, side="after", note="undelivered:", immediate=True)
+
+    async def release_all(self) -> None:
+        """Release every delivery still pending (shutdown)"""
+        for key in list(self._pending):
+            await self.release(key)
+
+    def forget(self, key: Hashable) -> None:
+        """Drop state of a key nobody follows any more"""
+        self._snapshots.pop(key, None)
+        self._pending.pop(key, None)
+
+    def _remember(self, key: Hashable, snapshot: Dict[str, Any]) -> None:
+        self._snapshots[key] = snapshot
+        while len(self._snapshots) > self.max_flights:
+            self._snapshots.popitem(last=False)
+
+    def _sweep_notified(self, now: float) -> None:
+        if now - self._last_sweep < 60:
+            return
+        cutoff = now - self.dedupe_ttl
+        self._notified = {marker: at for marker, at in self._notified.items() if at >= cutoff}
+        self._last_sweep = now
+
+    async def _load(self, key: Tuple[str, str, str, str]) -> Optional[Dict[str, Any]]:
+        """Snapshot of the key's latest flight_logs row, None if there is none"""
+        if not self.db:
+            return None
+        try:
+            rows = await self.db.get_flight_log_snapshots(key[0], key[1])
+        except Exception as e:
+            self.log_errors += 1
+            logger.error(f"Error loading logged state of {key[0]} {key[1]}: {e}")
+            return None
+        for text in rows:
+            leg, snapshot = parse_snapshot(text)
+            if leg == (key[2], key[3]):
+                return snapshot
+        return None
+
+    async def _log(self, key: Tuple[str, str, str, str], changes: List[FieldChange],
+                   snapshot: Dict[str, Any], side: str = "before", note: str = "", immediate: bool = False) -> None:
+        if not self.db:
+            return
+        try:
+            await self.db.log_flight_change(key[0], key[1], note + format_log_value(changes, side),
+                                            format_snapshot(snapshot, (key[2], key[3])), immediate=immediate)
+        except Exception as e:
+            self.log_errors += 1
+            logger.error(f"Error logging change of {key[0]} {key[1]}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get change detection metrics"""
+        return {
+            'flights': len(self._snapshots),
+            'observed': self.observed,
+            'baselines': self.baselines,
+            'restored': self.restored,
+            'changed': self.changed,
+            'suppressed': self.suppressed,
+            'delivered_elsewhere': self.delivered_elsewhere,
+            'deferred': self.deferred,
+            'released': self.released,
+            'pending': len(self._pending),
+            'log_errors': self.log_errors,
+            'claim_errors': self.claim_errors
+        }
@@ -1,7 +1,15 @@
+import asyncio
 import httpx
 import logging
+import random
+import time
 from typing import Optional, Dict, Any
-from bot.config import PARSE_FLIGHT_URL, FLIGHT_API_URL, FLIGHT_API_TIMEOUT, MAX_RETRIES, SUPABASE_ANON_KEY
+from bot.config import PARSE_FLIGHT_URL, FLIGHT_API_URL, MAX_RETRIES, SUPABASE_ANON_KEY, PERFORMANCE, LOGGING
+from bot.services.http_client import get_http_client
+from bot.services.flight_cache import FlightCache, make_cache_key
+from bot.services.rate_limiter import TokenBucket
+from bot.services.metrics import timed
+from bot.services.log_filters import truncate
 import re
 
 FLIGHT_NUMBER_REGEX = re.compile(r'([A-Z0-9]{2,3})\s?(\d{1,4}[A-Z]?)', re.IGNORECASE)
@@ -21,128 +29,127 @@ class FlightService:
     def __init__(self):
         self.parse_url = PARSE_FLIGHT_URL
         self.api_url = FLIGHT_API_URL
-        self.timeout = FLIGHT_API_TIMEOUT
+        self.cache = FlightCache(
+            max_size=PERFORMANCE["cache_max_size"],
+            default_ttl=PERFORMANCE["cache_ttl"],
+            status_ttl=PERFORMANCE["cache_status_ttl"]
+        ) if PERFORMANCE["cache_enabled"] else None
+        # In-flight upstream requests shared by identical concurrent lookups
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self.upstream_requests = 0
+        self.coalesced_requests = 0
+        # Dedicated bucket protecting AeroDataBox quota behind flight-api
+        self.api_bucket = TokenBucket(PERFORMANCE["rate_limit_per_api"]) if PERFORMANCE["rate_limit_enabled"] else None
+        self.throttled_requests = 0
+        self.body_sample_rate = LOGGING["flight_api_body_sample_rate"]
+        self.body_max_chars = LOGGING["flight_api_body_max_chars"]
     
+    async def _post(self, call: str, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST to Edge Function and return JSON; raises httpx errors"""
+        logger.debug("flight_api request call=%s payload=%s", call, payload)
+        started = time.perf_counter()
+        response = await get_http_client().post(url, json=payload, headers={"Authorization": f"Bearer {SUPABASE_ANON_KEY}"})
+        self._log_response(call, response, time.perf_counter() - started)
+        response.raise_for_status()
+        return response.json()
+    
+    def _log_response(self, call: str, response: httpx.Response, elapsed: float) -> None:
+        """One summary line per call; body only for a sampled share of responses, truncated"""
+        logger.info("flight_api response call=%s status=%s elapsed_ms=%.0f bytes=%d",
+                    call, response.status_code, elapsed * 1000, len(response.content))
+        if self.body_sample_rate and random.random() < self.body_sample_rate:
+            logger.info("flight_api sampled body call=%s body=%s", call, truncate(response.text, self.body_max_chars))
+    
+    def _log_http_error(self, call: str, error: httpx.HTTPStatusError) -> None:
+        logger.error("❌ flight_api HTTP error call=%s status=%s body=%s",
+                     call, error.response.status_code, truncate(error.response.text, self.body_max_chars))
+    
+    @timed("flight_service")
     async def parse_flight_request(self, text: str, user_id: Optional[str] = None) -> Dict[str, Any]:
         """Parse flight request using Edge Function"""
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                payload = {
-                    "text": text,
-                    "user_id": user_id
-                }
-                
-                headers = {
-                    "Authorization": f"Bearer {SUPABASE_ANON_KEY}"
-                }
-                
-                # Логируем запрос
-                logger.info(f"🔍 PARSE REQUEST to {self.parse_url}")
-                logger.info(f"📤 Payload: {payload}")
-                logger.info(f"📋 Headers: {headers}")
-                
-                response = await client.post(self.parse_url, json=payload, headers=headers)
-                
-                # Логируем ответ
-                logger.info(f"📥 PARSE RESPONSE Status: {response.status_code}")
-                logger.info(f"📥 Response Headers: {dict(response.headers)}")
-                logger.info(f"📥 Response Body: {response.text}")
-                
-                response.raise_for_status()
-                
-                result = response.json()
-                logger.info(f"✅ PARSE SUCCESS: {result}")
-                return result
-                
+            payload = {
+                "text": text,
+                "user_id": user_id
+            }
+            return await self._post("parse", self.parse_url, payload)
+            
         except httpx.HTTPStatusError as e:
-            logger.error(f"❌ HTTP error in parse_flight_request: {e}")
-            logger.error(f"❌ Response status: {e.response.status_code}")
-            logger.error(f"❌ Response body: {e.response.text}")
+            self._log_http_error("parse", e)
             return {"error": f"HTTP error: {e.response.status_code}"}
         except Exception as e:
             logger.error(f"❌ Error in parse_flight_request: {e}")
             return {"error": str(e)}
     
+    @timed("flight_service")
     async def get_flight_data(self, flight_number: str, date: str, user_id: Optional[str] = None, date_local_role: Optional[str] = None) -> Dict[str, Any]:
+        """Get flight data, served from cache while fresh; concurrent identical lookups share one request"""
+        key = make_cache_key(flight_number, date, date_local_role)
+        if self.cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.debug("⚡ FLIGHT CACHE HIT: %s", key)
+                return cached
+        
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced_requests += 1
+            logger.debug("🔗 FLIGHT REQUEST COALESCED: %s", key)
+            return await asyncio.shield(pending)
+        
+        self.upstream_requests += 1
+        task = asyncio.ensure_future(self._fetch_flight_data(flight_number, date, user_id, date_local_role))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._on_fetch_done(key, done))
+        # Shield so a cancelled caller does not cancel the request shared with others
+        return await asyncio.shield(task)
+    
+    def _on_fetch_done(self, key: tuple, task: asyncio.Future) -> None:
+        """Release in-flight slot and cache the shared result"""
+        self._inflight.pop(key, None)
+        if self.cache and not task.cancelled() and task.exception() is None:
+            self.cache.put(key, task.result())
+    
+    @timed("flight_service")
+    async def _fetch_flight_data(self, flight_number: str, date: str, user_id: Optional[str] = None, date_local_role: Optional[str] = None) -> Dict[str, Any]:
         """Get flight data using Edge Function"""
+        if self.api_bucket and not await self.api_bucket.acquire(PERFORMANCE["rate_limit_api_max_wait"]):
+            self.throttled_requests += 1
+            logger.warning(f"🚦 Flight API rate limit hit for {flight_number} {date}")
+            return {"error": "api_error", "message": "Flight API rate limit exceeded"}
+        
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                payload = {
-                    "flight_number": flight_number,
-                    "date": date,
-                    "user_id": user_id
-                }
-                
-                # Добавляем date_local_role в payload если он передан
-                if date_local_role:
-                    payload["date_local_role"] = date_local_role
-                
-                headers = {
-                    "Authorization": f"Bearer {SUPABASE_ANON_KEY}"
-                }
-                
-                # Логируем запрос
-                logger.info(f"🔍 FLIGHT API REQUEST to {self.api_url}")
-                logger.info(f"📤 Payload: {payload}")
-                logger.info(f"📋 Headers: {headers}")
-                
-                response = await client.post(self.api_url, json=payload, headers=headers)
-                
-                # Логируем ответ
-                logger.info(f"📥 FLIGHT API RESPONSE Status: {response.status_code}")
-                logger.info(f"📥 Response Headers: {dict(response.headers)}")
-                logger.info(f"📥 Response Body: {response.text}")
-                
-                response.raise_for_status()
-                
-                result = response.json()
-                logger.info(f"✅ FLIGHT API SUCCESS: {result}")
-                return result
-                
+            payload = {
+                "flight_number": flight_number,
+                "date": date,
+                "user_id": user_id
+            }
+            
+            # Добавляем date_local_role в payload если он передан
+            if date_local_role:
+                payload["date_local_role"] = date_local_role
+            
+            return await self._post("flight", self.api_url, payload)
+            
         except httpx.HTTPStatusError as e:
-            logger.error(f"❌ HTTP error in get_flight_data: {e}")
-            logger.error(f"❌ Response status: {e.response.status_code}")
-            logger.error(f"❌ Response body: {e.response.text}")
+            self._log_http_error("flight", e)
             return {"error": f"HTTP error: {e.response.status_code}"}
         except Exception as e:
             logger.error(f"❌ Error in get_flight_data: {e}")
             return {"error": str(e)}
     
+    @timed("flight_service")
     async def get_flight_data_from_text(self, text: str, user_id: Optional[str] = None) -> Dict[str, Any]:
         """Get flight data from text using Edge Function (backend handles parsing)"""
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                payload = {
-                    "text": text,
-                    "user_id": user_id
-                }
-                
-                headers = {
-                    "Authorization": f"Bearer {SUPABASE_ANON_KEY}"
-                }
-                
-                # Логируем запрос
-                logger.info(f"🔍 FLIGHT API FROM TEXT REQUEST to {self.api_url}")
-                logger.info(f"📤 Payload: {payload}")
-                logger.info(f"📋 Headers: {headers}")
-                
-                response = await client.post(self.api_url, json=payload, headers=headers)
-                
-                # Логируем ответ
-                logger.info(f"📥 FLIGHT API FROM TEXT RESPONSE Status: {response.status_code}")
-                logger.info(f"📥 Response Headers: {dict(response.headers)}")
-                logger.info(f"📥 Response Body: {response.text}")
-                
-                response.raise_for_status()
-                
-                result = response.json()
-                logger.info(f"✅ FLIGHT API FROM TEXT SUCCESS: {result}")
-                return result
-                
+            payload = {
+                "text": text,
+                "user_id": user_id
+            }
+            return await self._post("flight_from_text", self.api_url, payload)
+            
         except httpx.HTTPStatusError as e:
-            logger.error(f"❌ HTTP error in get_flight_data_from_text: {e}")
-            logger.error(f"❌ Response status: {e.response.status_code}")
-            logger.error(f"❌ Response body: {e.response.text}")
+            self._log_http_error("flight_from_text", e)
             return {"error": f"HTTP error: {e.response.status_code}"}
         except Exception as e:
             logger.error(f"❌ Error in get_flight_data_from_text: {e}")
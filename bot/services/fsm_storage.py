@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Callable, Dict, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
+from bot.config import FSM_STORAGE
+
+logger = logging.getLogger(__name__)
+
+def build_key(key: StorageKey) -> str:
+    """Serialize StorageKey into a flat string"""
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage in a local SQLite file: survives restarts, shareable by workers on one host.
+
+    Uses WAL journal with synchronous=NORMAL, so a write is a page update in the
+    WAL without fsync; statements are short enough to run inline on the event loop.
+    SQLite waits for a lock held by another worker only busy_timeout ms (blocking);
+    after that the statement is retried with asyncio.sleep until lock_timeout.
+    Records untouched for state_ttl are invisible to reads and purged at most
+    once per state_ttl.
+    """
+
+    def __init__(self, path: str, state_ttl: Optional[int] = None, busy_timeout: int = 5,
+                 lock_timeout: float = 5.0):
+        self.path = path
+        self.state_ttl = state_ttl
+        self.lock_timeout = lock_timeout
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT, updated_at REAL NOT NULL)"
+        )
+        self._purged_at = 0.0
+        self.purge_expired()
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.005
+        while True:
+            try:
+                return func(*args)
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or time.monotonic() + delay > deadline:
+                    raise
+            # Another worker holds the write lock: let the loop run meanwhile
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def _cutoff(self) -> float:
+        return time.time() - self.state_ttl if self.state_ttl else 0.0
+
+    def purge_expired(self) -> int:
+        """Delete conversations untouched for longer than state_ttl (blocking)"""
+        if not self.state_ttl:
+            return 0
+        self._purged_at = time.time()
+        try:
+            cursor = self._conn.execute("DELETE FROM fsm WHERE updated_at < ?", (self._cutoff(),))
+        except sqlite3.OperationalError as e:
+            # Another worker holds the lock; expired rows stay invisible until the next purge
+            logger.debug(f"FSM purge skipped: {e}")
+            return 0
+        if cursor.rowcount:
+            logger.info(f"🧹 Purged {cursor.rowcount} expired FSM records")
+        return cursor.rowcount
+
+    def _write(self, sql: str, params: tuple) -> None:
+        # An expired record's other column is reset by the upsert itself, not resurrected
+        self._conn.execute(sql, params)
+        if self.state_ttl and time.time() - self._purged_at >= self.state_ttl:
+            self.purge_expired()
+
+    def _read(self, column: str, key: str) -> Any:
+        row = self._conn.execute(
+            f"SELECT {column} FROM fsm WHERE key = ? AND updated_at >= ?", (key, self._cutoff())
+        ).fetchone()
+        return row[0] if row else None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._run(
+            self._write,
+            "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, NULL, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+            "data = CASE WHEN fsm.updated_at < ? THEN NULL ELSE fsm.data END, updated_at = excluded.updated_at",
+            (build_key(key), state, time.time(), self._cutoff())
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._run(self._read, "state", build_key(key))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._run(
+            self._write,
+            "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, NULL, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = excluded.data, "
+            "state = CASE WHEN fsm.updated_at < ? THEN NULL ELSE fsm.state END, updated_at = excluded.updated_at",
+            (build_key(key), json.dumps(data) if data else None, time.time(), self._cutoff())
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = await self._run(self._read, "data", build_key(key))
+        return json.loads(data) if data else {}
+
+    async def close(self) -> None:
+        self._conn.close()
+
+def create_fsm_storage(backend: Optional[str] = None) -> BaseStorage:
+    """Create FSM storage selected by FSM_STORAGE["backend"]: memory, sqlite or redis"""
+    backend = (backend or FSM_STORAGE["backend"]).lower()
+
+    if backend == "sqlite":
+        logger.info(f"FSM storage: SQLite ({FSM_STORAGE['sqlite_path']})")
+        return SQLiteStorage(FSM_STORAGE["sqlite_path"], state_ttl=FSM_STORAGE["state_ttl"])
+
+    if backend == "redis":
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise ValueError("FSM_STORAGE=redis requires the 'redis' package") from e
+        logger.info("FSM storage: Redis")
+        return RedisStorage.from_url(
+            FSM_STORAGE["redis_url"],
+            state_ttl=FSM_STORAGE["state_ttl"],
+            data_ttl=FSM_STORAGE["state_ttl"]
+        )
+
+    if backend != "memory":
+        raise ValueError(f"Unknown FSM_STORAGE backend: {backend}")
+
+    logger.info("FSM storage: memory")
+    return MemoryStorage()
@@ -0,0 +1,36 @@
+import httpx
+import logging
+from typing import Optional
+from bot.config import HTTP_CLIENT
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create pooled keep-alive HTTP client for Supabase Edge Functions"""
+    limits = httpx.Limits(
+        max_connections=HTTP_CLIENT["max_connections"],
+        max_keepalive_connections=HTTP_CLIENT["max_keepalive_connections"],
+        keepalive_expiry=HTTP_CLIENT["keepalive_expiry"]
+    )
+    return httpx.AsyncClient(
+        timeout=HTTP_CLIENT["timeout"],
+        limits=limits,
+        http2=HTTP_CLIENT["http2"]
+    )
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get process-wide shared HTTP client"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+    return _client
+
+async def close_http_client() -> None:
+    """Close shared HTTP client (shutdown hook)"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        logger.info("Shared HTTP client closed")
+    _client = None
@@ -0,0 +1,59 @@
+import logging
+import os
+import re
+from typing import Iterable, Optional
+
+REDACTED = "***"
+
+# Credentials that may show up in logged URLs, headers or upstream error bodies
+SECRET_PATTERNS = [
+    re.compile(r'(Bearer\s+)[A-Za-z0-9._~+/=-]+', re.IGNORECASE),
+    re.compile(r'eyJ[A-Za-z0-9_-]{8,}\.[A-Za-z0-9_-]{8,}\.[A-Za-z0-9_-]+'),  # JWT (Supabase keys)
+    re.compile(r'\d{6,12}:[A-Za-z0-9_-]{30,}'),  # Telegram bot token
+    re.compile(r'((?:api[_-]?key|apikey|secret|token)["\']?\s*[:=]\s*["\']?)[^\s"\'&,}]+', re.IGNORECASE)
+]
+
+def truncate(text: Optional[str], max_chars: int) -> str:
+    """Cut text for logging, keeping the original length visible"""
+    if text is None:
+        return ''
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}…(+{len(text) - max_chars} chars)"
+
+def redact(text: str, secrets: Iterable[str] = ()) -> str:
+    for secret in secrets:
+        if secret in text:
+            text = text.replace(secret, REDACTED)
+    for pattern in SECRET_PATTERNS:
+        if pattern.groups:
+            text = pattern.sub(lambda m: m.group(1) + REDACTED, text)
+        else:
+            text = pattern.sub(REDACTED, text)
+    return text
+
+class RedactingFilter(logging.Filter):
+    """Masks configured secret values and token-like strings in emitted records.
+
+    Attach to handlers, not loggers: it then runs only for records that pass
+    the level check, so disabled DEBUG calls stay free.
+    """
+
+    def __init__(self, env_names: Iterable[str] = ()):
+        super().__init__()
+        # Short values would mask unrelated text
+        self.secrets = [value for value in (os.getenv(name) for name in env_names) if value and len(value) >= 8]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        cleaned = redact(message, self.secrets)
+        if cleaned != message:
+            record.msg = cleaned
+            record.args = None
+        return True
+
+def install_redaction(env_names: Iterable[str], logger: Optional[logging.Logger] = None) -> None:
+    """Add RedactingFilter to every handler of logger (root by default)"""
+    redacting = RedactingFilter(env_names)
+    for handler in (logger or logging.getLogger()).handlers:
+        handler.addFilter(redacting)
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set
+from aiogram import Bot
+
+logger = logging.getLogger(__name__)
+
+# FSM state keys holding ids of bot/user messages removed when a search completes
+TRACKED_MESSAGE_KEYS = ('instruction_message_id', 'welcome_message_id', 'user_command_message_id')
+
+# deleteMessages accepts 1-100 ids per call
+DELETE_MESSAGES_LIMIT = 100
+
+# Strong refs so running cleanups are not garbage-collected
+_pending: Set[asyncio.Task] = set()
+
+def collect_tracked_message_ids(state_data: Dict[str, Any], *extra_ids: Optional[int],
+                                keys: Iterable[str] = TRACKED_MESSAGE_KEYS) -> List[int]:
+    """Message ids stored in FSM state plus extra ids, without empties and duplicates"""
+    ids = [state_data.get(key) for key in keys] + list(extra_ids)
+    return list(dict.fromkeys(message_id for message_id in ids if message_id))
+
+async def delete_messages(bot: Bot, chat_id: int, message_ids: Iterable[Optional[int]]) -> bool:
+    """Delete messages with one deleteMessages call per 100 ids; never raises"""
+    message_ids = list(dict.fromkeys(message_id for message_id in message_ids if message_id))
+    deleted = True
+    for i in range(0, len(message_ids), DELETE_MESSAGES_LIMIT):
+        chunk = message_ids[i:i + DELETE_MESSAGES_LIMIT]
+        try:
+            if len(chunk) == 1:
+                await bot.delete_message(chat_id, chunk[0])
+            else:
+                # Ids that are already gone are skipped by Telegram
+                await bot.delete_messages(chat_id, chunk)
+        except Exception as e:
+            deleted = False
+            logger.warning(f"Could not delete messages {chunk} in chat {chat_id}: {e}")
+    return deleted
+
+def schedule_message_cleanup(bot: Bot, chat_id: int, message_ids: Iterable[Optional[int]]) -> Optional[asyncio.Task]:
+    """Delete messages in background so the handler does not wait for Telegram"""
+    message_ids = [message_id for message_id in message_ids if message_id]
+    if not message_ids:
+        return None
+    task = asyncio.create_task(delete_messages(bot, chat_id, message_ids))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+    return task
@@ -0,0 +1,199 @@
+import asyncio
+import functools
+import logging
+import math
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str = ''):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: Any) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(key)} {value:g}" for key, value in self._values.items()]
+
+class HistogramData:
+    """HDR-style log-bucketed recorder: constant relative error, O(1) record.
+
+    Values are bucketed by floor(log(value) / log(1 + precision)), so quantiles
+    are accurate to `precision` (2% by default) whatever the range.
+    """
+
+    __slots__ = ('precision', '_log_base', 'buckets', 'count', 'total', 'min', 'max')
+
+    def __init__(self, precision: float = 0.02):
+        self.precision = precision
+        self._log_base = math.log(1 + precision)
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        index = math.floor(math.log(value) / self._log_base) if value > 0 else -10 ** 6
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Upper edge of the bucket, clamped to the observed range
+                return min(max((1 + self.precision) ** (index + 1), self.min), self.max)
+        return self.max
+
+class Histogram:
+    """Latency histogram with labels, exported as a Prometheus summary.
+
+    Besides the cumulative series served on /metrics, observations go to a
+    window that take_window() hands over and resets, so the periodic log
+    summary shows the latest interval and not the whole process lifetime.
+    """
+
+    kind = "summary"
+    quantiles = (0.5, 0.9, 0.99)
+
+    def __init__(self, name: str, help_text: str = '', precision: float = 0.02):
+        self.name = name
+        self.help = help_text
+        self.precision = precision
+        self._series: Dict[LabelKey, HistogramData] = {}
+        self._window: Dict[LabelKey, HistogramData] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _label_key(labels)
+        data = self._series.get(key)
+        if data is None:
+            data = self._series[key] = HistogramData(self.precision)
+        data.record(value)
+        window = self._window.get(key)
+        if window is None:
+            window = self._window[key] = HistogramData(self.precision)
+        window.record(value)
+
+    def series(self) -> Dict[LabelKey, HistogramData]:
+        return self._series
+
+    def take_window(self) -> Dict[LabelKey, HistogramData]:
+        """Series observed since the previous call; starts a new window"""
+        window, self._window = self._window, {}
+        return window
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, data in self._series.items():
+            for q in self.quantiles:
+                lines.append(f"{self.name}{_format_labels(key, ('quantile', str(q)))} {data.quantile(q):.6g}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {data.total:.6g}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {data.count}")
+        return lines
+
+class MetricsRegistry:
+    """Process-wide set of named counters and histograms"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def counter(self, name: str, help_text: str = '') -> Counter:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = Counter(name, help_text)
+        return metric
+
+    def histogram(self, name: str, help_text: str = '') -> Histogram:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = Histogram(name, help_text)
+        return metric
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (0.0.4)"""
+        lines = []
+        for metric in self._metrics.values():
+            if metric.help:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary_lines(self) -> List[str]:
+        """Human-readable p50/p99 per histogram series since the previous call"""
+        lines = []
+        for metric in self._metrics.values():
+            if not isinstance(metric, Histogram):
+                continue
+            for key, data in sorted(metric.take_window().items()):
+                labels = ','.join(value for _, value in key) or '-'
+                lines.append(
+                    f"{metric.name}[{labels}] n={data.count} "
+                    f"p50={data.quantile(0.5) * 1000:.2f}ms p99={data.quantile(0.99) * 1000:.2f}ms "
+                    f"max={data.max * 1000:.2f}ms"
+                )
+        return lines
+
+REGISTRY = MetricsRegistry()
+
+def timed(component: str, registry: MetricsRegistry = REGISTRY) -> Callable:
+    """Decorator for async methods: <component>_duration_seconds{method} and <component>_errors_total{method}"""
+    def decorator(func: Callable) -> Callable:
+        histogram = registry.histogram(f"{component}_duration_seconds", f"Duration of {component} calls")
+        errors = registry.counter(f"{component}_errors_total", f"Exceptions raised by {component} calls")
+        method = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc(method=method)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, method=method)
+        return wrapper
+    return decorator
+
+async def log_metrics_periodically(interval: float, registry: MetricsRegistry = REGISTRY) -> None:
+    """Log latency summary of the last `interval` seconds, every `interval` seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        lines = registry.summary_lines()
+        if lines:
+            logger.info("📈 Latency summary:\n" + '\n'.join(lines))
@@ -0,0 +1,228 @@
+"""
+Табличный рендер уведомлений о рейсах: шаблоны из NOTIFICATION_TEMPLATES
+компилируются один раз на статус и язык, время AeroDataBox разбирается за один проход
+"""
+
+import string
+from datetime import date
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+from bot.config import FALLBACK_LANGUAGE, LANGUAGE_MAPPING, NOTIFICATION_TEMPLATES, SUPPORTED_LANGUAGES
+
+# Статусы рейсов с эмодзи
+STATUS_EMOJI = {
+    "Unknown": "❓",
+    "Expected": "⏳",
+    "EnRoute": "✈️",
+    "CheckIn": "📋",
+    "Boarding": "🛂",
+    "GateClosed": "🔒",
+    "Departed": "✈️",
+    "Delayed": "⏰",
+    "Approaching": "🛬",
+    "Arrived": "✅",
+    "Canceled": "❌",
+    "Diverted": "🔄",
+    "CanceledUncertain": "❓"
+}
+
+# Выход показываем в деталях только для этих статусов
+GATE_DETAIL_STATUSES = frozenset({"Boarding", "Departed"})
+
+_FORMATTER = string.Formatter()
+
+# (поля шаблона, str.format_map шаблона)
+CompiledTemplate = Tuple[FrozenSet[str], Callable[[Dict[str, Any]], str]]
+
+class Timestamp(NamedTuple):
+    clock: str  # HH:MM как в строке (местное время аэропорта)
+    minutes: int  # минуты от начала эры по UTC, для разницы между временами
+
+def parse_timestamp(value: Any) -> Optional[Timestamp]:
+    """Разбирает '2025-07-20 14:43+03:00', '2025-07-20T14:43Z', '2025-07-20T14:43:00.000' без regex и fromisoformat"""
+    if not isinstance(value, str) or len(value) < 16 or value[10] not in "T " or value[13] != ":":
+        return None
+    try:
+        day = date(int(value[0:4]), int(value[5:7]), int(value[8:10])).toordinal()
+        minutes = day * 1440 + int(value[11:13]) * 60 + int(value[14:16])
+        # Секунды и доли секунды не нужны
+        tail = value[16:].lstrip(":.0123456789")
+        if len(tail) >= 6 and tail[0] in "+-":
+            offset = int(tail[1:3]) * 60 + int(tail[4:6])
+            minutes += -offset if tail[0] == "+" else offset
+    except ValueError:
+        return None
+    return Timestamp(value[11:16], minutes)
+
+def compile_template(template: str) -> CompiledTemplate:
+    fields = frozenset(name for _, name, _, _ in _FORMATTER.parse(template) if name)
+    return fields, template.format_map
+
+def parse_clock(value: Any) -> Optional[str]:
+    """HH:MM из того же формата без разбора даты и смещения"""
+    if isinstance(value, str) and len(value) >= 16 and value[10] in "T " and value[13] == ":":
+        return value[11:16]
+    return None
+
+def _local(side: Dict[str, Any], key: str) -> Any:
+    return (side.get(key) or {}).get("local")
+
+def _delay_minutes(flight: Dict[str, Any], departure: Dict[str, Any], arrival: Dict[str, Any]) -> Optional[int]:
+    # Полный разбор (с датой и смещением) нужен только здесь
+    scheduled = parse_timestamp(_local(departure, "scheduledTime"))
+    expected = parse_timestamp(_local(departure, "actualTime") or _local(departure, "revisedTime"))
+    if scheduled and expected and expected.minutes > scheduled.minutes:
+        return expected.minutes - scheduled.minutes
+    return None
+
+# Поле шаблона -> как получить его из рейса (flight, departure, arrival)
+FIELD_GETTERS: Dict[str, Callable[[Dict[str, Any], Dict[str, Any], Dict[str, Any]], Any]] = {
+    "summary": lambda flight, departure, arrival: flight.get("notificationSummary"),
+    "gate": lambda flight, departure, arrival: departure.get("gate"),
+    "terminal": lambda flight, departure, arrival: departure.get("terminal"),
+    "departure_actual": lambda flight, departure, arrival: parse_clock(_local(departure, "actualTime")),
+    "arrival_actual": lambda flight, departure, arrival: parse_clock(_local(arrival, "actualTime")),
+    "arrival_estimate": lambda flight, departure, arrival: parse_clock(
+        _local(arrival, "revisedTime") or _local(arrival, "scheduledTime")),
+    "departure_revised": lambda flight, departure, arrival: parse_clock(_local(departure, "revisedTime")),
+    "arrival_revised": lambda flight, departure, arrival: parse_clock(_local(arrival, "revisedTime")),
+    "delay": _delay_minutes
+}
+# Есть в любом наборе полей
+BASE_FIELDS = frozenset({"flight", "status", "emoji"})
+# Нужны только строкам об изменениях (местное время для dep_time/arr_time)
+CHANGE_FIELDS = ("departure_revised", "arrival_revised")
+
+class NotificationRenderer:
+    """Рендер уведомлений по скомпилированным шаблонам.
+
+    flight_fields() один раз извлекает из рейса только те поля, что нужны
+    шаблонам его статуса; render_fields() подставляет их в шаблоны языка. Для
+    рассылки одного рейса многим получателям поля считаются один раз, текст —
+    один раз на язык.
+    """
+
+    def __init__(self, templates: Dict[str, Any] = NOTIFICATION_TEMPLATES,
+                 languages: Iterable[str] = SUPPORTED_LANGUAGES, fallback_language: str = FALLBACK_LANGUAGE):
+        self.languages = tuple(languages)
+        self.fallback_language = fallback_language
+
+        def localized(entry: Dict[str, Any], language: str) -> Any:
+            return entry.get(language) or entry[fallback_language]
+
+        # статус -> язык -> варианты шаблона по убыванию полноты
+        self.status_templates: Dict[str, Dict[str, List[CompiledTemplate]]] = {
+            status: {language: [compile_template(f"{{flight}}: {t}") for t in localized(entry, language)]
+                     for language in self.languages}
+            for status, entry in templates["status"].items()
+        }
+        self.default_templates = self.status_templates.pop("default")
+        # язык -> деталь -> шаблон
+        self.detail_templates: Dict[str, Dict[str, CompiledTemplate]] = {
+            language: {name: compile_template(localized(entry, language)) for name, entry in templates["details"].items()}
+            for language in self.languages
+        }
+        # язык -> поле -> подпись
+        self.change_labels: Dict[str, Dict[str, str]] = {
+            language: {name: localized(entry, language) for name, entry in templates["changes"].items()}
+            for language in self.languages
+        }
+        # статус -> ((поле, getter), ...): что извлекать из рейса этого статуса
+        self._getters = {status: self._compile_getters(status, alternatives)
+                         for status, alternatives in self.status_templates.items()}
+        self._default_getters = self._compile_getters(None, self.default_templates)
+
+    def _compile_getters(self, status: Optional[str], alternatives: Dict[str, List[CompiledTemplate]]) -> tuple:
+        needed = {name for templates in alternatives.values() for fields, _ in templates for name in fields}
+        needed |= {"gate", "terminal"} if status in GATE_DETAIL_STATUSES else {"terminal"}
+        if status == "Delayed":
+            needed.add("delay")
+        unknown = needed - BASE_FIELDS - FIELD_GETTERS.keys()
+        if unknown:
+            raise ValueError(f"Unknown notification template fields: {', '.join(sorted(unknown))}")
+        return tuple((name, FIELD_GETTERS[name]) for name in sorted(needed - BASE_FIELDS))
+
+    def language(self, language_code: Optional[str]) -> str:
+        """Поддерживаемый язык для кода пользователя ('ru', 'uk', 'en-GB'...)"""
+        if language_code in self.languages:
+            return language_code
+        code = (language_code or "").split("-")[0].lower()
+        code = LANGUAGE_MAPPING.get(code, code)
+        return code if code in self.languages else self.fallback_language
+
+    def flight_fields(self, flight: Dict[str, Any], with_changes: bool = False) -> Dict[str, Any]:
+        """Значения для шаблонов статуса рейса; пустые значения не включаются"""
+        departure = flight.get("departure") or {}
+        arrival = flight.get("arrival") or {}
+        status = flight.get("status") or "Unknown"
+
+        values = {
+            "flight": (flight.get("number") or "").replace(" ", ""),
+            "status": status,
+            "emoji": STATUS_EMOJI.get(status, "❓")
+        }
+        getters = self._getters.get(status, self._default_getters)
+        if with_changes:
+            getters += tuple((name, FIELD_GETTERS[name]) for name in CHANGE_FIELDS)
+        for name, getter in getters:
+            value = getter(flight, departure, arrival)
+            if value:
+                values[name] = value
+        return values
+
+    @staticmethod
+    def _pick(alternatives: List[CompiledTemplate], values: Dict[str, Any]) -> str:
+        for fields, render in alternatives:
+            if values.keys() >= fields:
+                return render(values)
+        return values["flight"] + ": "
+
+    def render_fields(self, values: Dict[str, Any], language: str, with_details: bool = False,
+                      changes: Optional[List[Any]] = None) -> str:
+        """Текст уведомления из flight_fields() на языке language"""
+        if language not in self.detail_templates:
+            language = self.language(language)
+        status = values["status"]
+        alternatives = self.status_templates.get(status)
+        text = self._pick(alternatives[language] if alternatives else self.default_templates[language], values)
+
+        if with_details:
+            templates = self.detail_templates[language]
+            details = []
+            if "delay" in values:
+                details.append(templates["delay"][1](values))
+            if "gate" in values and status in GATE_DETAIL_STATUSES:
+                details.append(templates["gate"][1](values))
+            if "terminal" in values:
+                details.append(templates["terminal"][1](values))
+            if details:
+                text += "\n" + ", ".join(details)
+
+        if changes:
+            lines = self.change_lines(values, changes, language)
+            if lines:
+                text += "\n" + "\n".join(lines)
+        return text
+
+    def change_lines(self, values: Dict[str, Any], changes: List[Any], language: str) -> List[str]:
+        """Строки об изменившихся полях: «Выход D7 → D9»"""
+        labels = self.change_labels[language]
+        lines = []
+        for change in changes:
+            label = labels.get(change.field)
+            if not label:
+                continue
+            if change.field in ("dep_time", "arr_time"):
+                # Сравниваются UTC-времена, пользователю показываем местное
+                clock = values.get("departure_revised" if change.field == "dep_time" else "arrival_revised")
+                if clock:
+                    lines.append(f"{label} {clock}")
+            elif change.before:
+                lines.append(f"{label} {change.before} → {change.after}")
+            else:
+                lines.append(f"{label} {change.after}")
+        return lines
+
+    def render(self, flight: Dict[str, Any], language: str, with_details: bool = False,
+               changes: Optional[List[Any]] = None) -> str:
+        """Текст уведомления о рейсе на языке language"""
+        return self.render_fields(self.flight_fields(flight, with_changes=bool(changes)), language, with_details, changes)
@@ -1,148 +1,162 @@
 #!/usr/bin/env python3
 """
-Сервис для форматирования уведомлений о рейсах
+Сервис для форматирования и отправки уведомлений о рейсах
 """
 
+import asyncio
 import logging
-from typing import Dict, Any, Optional
-from datetime import datetime
+import time
+from typing import Dict, Any, Callable, Iterable, List, Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from bot.config import NOTIFICATIONS, TELEGRAM_SEND
+from bot.services.notification_renderer import STATUS_EMOJI, NotificationRenderer
+from bot.services.send_queue import PRIORITY_NOTIFICATION, send_with_priority
 
 logger = logging.getLogger(__name__)
 
-class NotificationService:
-    """Сервис для создания уведомлений о рейсах"""
+# Язык уведомлений, если язык получателя не передан (исторически — русский)
+DEFAULT_NOTIFICATION_LANGUAGE = "ru"
+
+class FanOutProgress:
+    """Ход рассылки одного уведомления подписчикам рейса"""
+    
+    def __init__(self, flight: str, total: int, languages: int):
+        self.flight = flight
+        self.total = total
+        self.languages = languages
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+        self.first_delivery_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+    
+    @property
+    def processed(self) -> int:
+        return self.sent + self.blocked + self.failed
+    
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
     
-    def __init__(self):
-        # Статусы рейсов с эмодзи
-        self.status_emoji = {
-            "Unknown": "❓",
-            "Expected": "⏳",
-            "EnRoute": "✈️",
-            "CheckIn": "📋",
-            "Boarding": "🛂",
-            "GateClosed": "🔒",
-            "Departed": "✈️",
-            "Delayed": "⏰",
-            "Approaching": "🛬",
-            "Arrived": "✅",
-            "Canceled": "❌",
-            "Diverted": "🔄",
-            "CanceledUncertain": "❓"
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'flight': self.flight,
+            'total': self.total,
+            'languages': self.languages,
+            'sent': self.sent,
+            'blocked': self.blocked,
+            'failed': self.failed,
+            'elapsed': self.elapsed,
+            'time_to_first_delivery': self.first_delivery_at - self.started_at if self.first_delivery_at else None
         }
+
+class NotificationService:
+    """Сервис для создания и отправки уведомлений о рейсах"""
+    
+    def __init__(self, bot: Optional[Bot] = None, renderer: Optional[NotificationRenderer] = None):
+        # Отправка идёт через общую очередь с низким приоритетом (см. TelegramSendQueue)
+        self.bot = bot
+        # Шаблоны NOTIFICATION_TEMPLATES скомпилированы один раз на статус и язык
+        self.renderer = renderer or NotificationRenderer()
+        self.status_emoji = STATUS_EMOJI
     
-    def format_flight_notification(self, flight_data: Dict[str, Any]) -> str:
+    def format_flight_notification(self, flight_data: Dict[str, Any],
+                                   language: str = DEFAULT_NOTIFICATION_LANGUAGE) -> str:
         """Форматирует уведомление о рейсе в коротком формате"""
-        
-        flight_number = flight_data.get("number", "").replace(" ", "")
-        status = flight_data.get("status", "Unknown")
-        emoji = self.status_emoji.get(status, "❓")
-        
-        # Базовое сообщение
-        message = f"{flight_number}: "
-        
-        # Форматируем в зависимости от статуса
-        if status == "Boarding":
-            gate = flight_data.get("departure", {}).get("gate")
-            if gate:
-                message += f"Идет посадка, выход {gate} {emoji}"
-            else:
-                message += f"Идет посадка {emoji}"
-                
-        elif status == "Departed":
-            actual_time = flight_data.get("departure", {}).get("actualTime", {}).get("local")
-            if actual_time:
-                # Извлекаем только время (HH:MM)
-                time_str = actual_time.split("T")[1][:5] if "T" in actual_time else actual_time[:5]
-                message += f"Отправлен в {time_str} {emoji}"
-                
-                # Добавляем время прибытия на новой строке
-                arrival_time = flight_data.get("arrival", {}).get("scheduledTime", {}).get("local")
-                if arrival_time:
-                    arrival_str = arrival_time.split("T")[1][:5] if "T" in arrival_time else arrival_time[:5]
-                    message += f"\nПримерное время прибытия {arrival_str}"
-                    
-        elif status == "Arrived":
-            actual_time = flight_data.get("arrival", {}).get("actualTime", {}).get("local")
-            if actual_time:
-                time_str = actual_time.split("T")[1][:5] if "T" in actual_time else actual_time[:5]
-                message += f"Прибыл в {time_str} {emoji}"
-            else:
-                message += f"Прибыл {emoji}"
-                
-        elif status == "Delayed":
-            # Пытаемся найти информацию о задержке
-            notification_summary = flight_data.get("notificationSummary", "")
-            if "delay" in notification_summary.lower() or "задержка" in notification_summary.lower():
-                message += f"Задержка {emoji}"
-            else:
-                message += f"Задержка {emoji}"
-                
-        elif status == "Canceled":
-            message += f"Отменен {emoji}"
-            
-        elif status == "EnRoute":
-            message += f"В пути {emoji}"
-            
-        elif status == "CheckIn":
-            message += f"Регистрация открыта {emoji}"
-            
-        elif status == "GateClosed":
-            message += f"Выход закрыт {emoji}"
-            
-        elif status == "Approaching":
-            message += f"Заходит на посадку {emoji}"
-            
-        else:
-            # Для неизвестных статусов используем notificationSummary
-            notification_summary = flight_data.get("notificationSummary", "")
-            if notification_summary:
-                message += f"{notification_summary} {emoji}"
-            else:
-                message += f"Статус: {status} {emoji}"
-        
-        return message
+        return self.renderer.render(flight_data, language)
     
-    def format_notification_with_details(self, flight_data: Dict[str, Any]) -> str:
-        """Форматирует уведомление с дополнительными деталями"""
-        
-        base_message = self.format_flight_notification(flight_data)
-        
-        # Добавляем детали если есть
-        details = []
-        
-        # Информация о задержке
-        if flight_data.get("status") == "Delayed":
-            departure = flight_data.get("departure", {})
-            scheduled = departure.get("scheduledTime", {}).get("local")
-            actual = departure.get("actualTime", {}).get("local")
-            
-            if scheduled and actual:
-                # Вычисляем задержку
-                try:
-                    scheduled_time = datetime.fromisoformat(scheduled.replace("Z", "+00:00"))
-                    actual_time = datetime.fromisoformat(actual.replace("Z", "+00:00"))
-                    delay_minutes = int((actual_time - scheduled_time).total_seconds() / 60)
-                    
-                    if delay_minutes > 0:
-                        details.append(f"Задержка {delay_minutes} минут")
-                except:
-                    pass
+    def format_notification_with_details(self, flight_data: Dict[str, Any],
+                                         language: str = DEFAULT_NOTIFICATION_LANGUAGE) -> str:
+        """Форматирует уведомление с дополнительными деталями (задержка, выход, терминал)"""
+        return self.renderer.render(flight_data, language, with_details=True)
+    
+    def format_changes(self, flight_data: Dict[str, Any], changes: List[Any],
+                       language: str = DEFAULT_NOTIFICATION_LANGUAGE) -> str:
+        """Строки об изменившихся полях: «Выход D7 → D9»"""
+        return "\n".join(self.renderer.change_lines(self.renderer.flight_fields(flight_data, with_changes=True), changes,
+                                                    self.renderer.language(language)))
+
+    async def send_flight_notification(self, chat_id: int, flight_data: Dict[str, Any],
+                                       with_details: bool = True, changes: Optional[List[Any]] = None,
+                                       language: str = DEFAULT_NOTIFICATION_LANGUAGE, **kwargs):
+        """Отправляет уведомление о рейсе; ответы пользователям в очереди идут раньше"""
+        text = self.renderer.render(flight_data, language, with_details=with_details, changes=changes)
+        return await send_with_priority(self.bot, chat_id, text, PRIORITY_NOTIFICATION, **kwargs)
+
+    async def fan_out(self, flight_data: Dict[str, Any], subscribers: Iterable[Dict[str, Any]],
+                      with_details: bool = True, changes: Optional[List[Any]] = None,
+                      concurrency: int = NOTIFICATIONS["batch_size"],
+                      on_progress: Optional[Callable[[FanOutProgress], None]] = None) -> FanOutProgress:
+        """Рассылает уведомление о рейсе всем подписчикам.
         
-        # Информация о гейте
-        gate = flight_data.get("departure", {}).get("gate")
-        if gate and flight_data.get("status") in ["Boarding", "Departed"]:
-            details.append(f"Выход {gate}")
+        subscribers — строки flight_subscriptions с users(telegram_id, language_code),
+        как их выбирает flight-webhook (или сами строки users). Поля рейса
+        извлекаются один раз, текст рендерится один раз на язык. Отправка идёт
+        потоком: не больше `concurrency` сообщений одновременно ждут очередь
+        отправки, так что одна большая рассылка не переполняет её. on_progress
+        вызывается после каждой доставки.
+        """
+        fields = self.renderer.flight_fields(flight_data, with_changes=bool(changes))
+        texts: Dict[str, str] = {}
+        # chat_id -> текст; повторная подписка того же пользователя не дублирует сообщение
+        recipients: Dict[int, str] = {}
+        for row in subscribers:
+            user = row.get('users') or row
+            chat_id = user.get('telegram_id')
+            if not chat_id:
+                continue
+            language = self.renderer.language(user.get('language_code'))
+            text = texts.get(language)
+            if text is None:
+                text = texts[language] = self.renderer.render_fields(fields, language, with_details, changes)
+            recipients[chat_id] = text
         
-        # Информация о терминале
-        terminal = flight_data.get("departure", {}).get("terminal")
-        if terminal:
-            details.append(f"Терминал {terminal}")
+        progress = FanOutProgress(fields['flight'], len(recipients), len(texts))
+        pending = iter(recipients.items())
         
-        # Добавляем детали к сообщению
-        if details:
-            base_message += f"\n{', '.join(details)}"
+        async def worker() -> None:
+            # Воркеры разбирают общий итератор: следующая отправка начинается, как только закончилась предыдущая
+            for chat_id, text in pending:
+                await self._deliver(chat_id, text, progress)
+                if on_progress:
+                    on_progress(progress)
         
-        return base_message
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(recipients)))))
+        progress.finished_at = time.monotonic()
+        if recipients:
+            logger.info(f"📣 {progress.flight}: notified {progress.sent}/{progress.total} subscribers "
+                        f"({progress.languages} languages, blocked {progress.blocked}, failed {progress.failed}) "
+                        f"in {progress.elapsed:.1f}s")
+        return progress
+
+    async def _deliver(self, chat_id: int, text: str, progress: FanOutProgress, attempts: int = 3,
+                       max_retry_after: float = TELEGRAM_SEND["max_retry_after"]) -> None:
+        for attempt in range(1, attempts + 1):
+            try:
+                await send_with_priority(self.bot, chat_id, text, PRIORITY_NOTIFICATION)
+            except TelegramRetryAfter as e:
+                # Без очереди отправки (или когда она исчерпала повторы) ждём сами,
+                # но не дольше max_retry_after и не после последней попытки
+                if attempt < attempts and e.retry_after <= max_retry_after:
+                    await asyncio.sleep(e.retry_after)
+                    continue
+                logger.warning(f"Could not notify {chat_id} about {progress.flight}: retry_after={e.retry_after}s")
+                break
+            except TelegramForbiddenError:
+                # Пользователь заблокировал бота
+                progress.blocked += 1
+                return
+            except Exception as e:
+                logger.warning(f"Could not notify {chat_id} about {progress.flight}: {e}")
+                progress.failed += 1
+                return
+            progress.sent += 1
+            if progress.first_delivery_at is None:
+                progress.first_delivery_at = time.monotonic()
+            return
+        progress.failed += 1
 
 # Пример использования
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+import asyncio
+import time
+from typing import Optional, Dict, Any, Hashable
+
+class TokenBucket:
+    """Token bucket: `capacity` tokens, refilled at `capacity` per `period` seconds"""
+
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated_at')
+
+    def __init__(self, capacity: float, period: float = 60.0, now: Optional[float] = None):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated_at = time.monotonic() if now is None else now
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def consume(self, amount: float = 1, now: Optional[float] = None) -> bool:
+        """Take tokens if available"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def refund(self, amount: float = 1) -> None:
+        """Give back tokens taken for a request that was not served"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def time_until_available(self, amount: float = 1, now: Optional[float] = None) -> float:
+        """Seconds until `amount` tokens are available"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def pause(self, seconds: float, now: Optional[float] = None) -> None:
+        """Drain the bucket so the next token is available in `seconds`"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    async def acquire(self, max_wait: float = 0.0) -> bool:
+        """Wait up to `max_wait` seconds for a token"""
+        deadline = time.monotonic() + max_wait
+        while not self.consume():
+            delay = self.time_until_available()
+            if time.monotonic() + delay > deadline:
+                return False
+            await asyncio.sleep(delay)
+        return True
+
+class KeyedRateLimiter:
+    """Per-key token buckets (one small object per active key), idle buckets expire"""
+
+    def __init__(self, per_minute: float, idle_ttl: float = 300.0, sweep_interval: float = 60.0):
+        self.per_minute = per_minute
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        self._last_sweep = time.monotonic()
+
+        # Metrics
+        self.allowed = 0
+        self.throttled = 0
+        self.expired = 0
+
+    def allow(self, key: Hashable) -> bool:
+        """Consume a token for key"""
+        now = time.monotonic()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._expire_idle(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.per_minute, now=now)
+
+        if bucket.consume(now=now):
+            self.allowed += 1
+            return True
+
+        self.throttled += 1
+        return False
+
+    def refund(self, key: Hashable) -> None:
+        """Return the token allow() took for key"""
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.refund()
+            self.allowed -= 1
+
+    def _expire_idle(self, now: float) -> None:
+        """Drop buckets untouched for idle_ttl (they would be full again anyway)"""
+        cutoff = now - self.idle_ttl
+        idle = [key for key, bucket in self._buckets.items() if bucket.updated_at < cutoff]
+        for key in idle:
+            del self._buckets[key]
+        self.expired += len(idle)
+        self._last_sweep = now
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._buckets
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'active_keys': len(self._buckets),
+            'allowed': self.allowed,
+            'throttled': self.throttled,
+            'expired': self.expired
+        }
@@ -1,18 +1,55 @@
 import asyncio
 import logging
 import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
-from supabase import create_client, Client
-from bot.config import SUPABASE_URL, SUPABASE_ANON_KEY
+from postgrest import AsyncPostgrestClient
+from bot.config import SEARCH_CLEANUP
+from bot.services.database import create_async_client
+from bot.services.metrics import REGISTRY, timed
 
 logger = logging.getLogger(__name__)
 
+upsert_duration = REGISTRY.histogram("search_upsert_duration_seconds", "active_searches upsert time by outcome")
+
 class SearchService:
     """Service for managing active searches in Supabase"""
     
-    def __init__(self):
-        self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+    def __init__(self, client: Optional[AsyncPostgrestClient] = None):
+        self.supabase = client or create_async_client()
+        # Searches we wrote recently, so get_active_search needs no round-trip
+        self._cache: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._sweeper_task: Optional[asyncio.Task] = None
+    
+    def start_sweeper(self) -> None:
+        """Start periodic cleanup of expired searches"""
+        if not self._sweeper_task:
+            self._sweeper_task = asyncio.create_task(self._sweep_loop())
+    
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(SEARCH_CLEANUP["interval"])
+            await self._cleanup_expired_searches()
+    
+    async def close(self) -> None:
+        """Stop sweeper and close connections"""
+        if self._sweeper_task:
+            self._sweeper_task.cancel()
+            self._sweeper_task = None
+        await self.supabase.aclose()
+    
+    def _cache_search(self, search: Dict[str, Any]) -> None:
+        telegram_id = search['telegram_id']
+        self._cache[telegram_id] = search
+        self._cache.move_to_end(telegram_id)
+        while len(self._cache) > SEARCH_CLEANUP["cache_size"]:
+            self._cache.popitem(last=False)
+    
+    @staticmethod
+    def _is_expired(search: Dict[str, Any]) -> bool:
+        expires_at = datetime.fromisoformat(search['expires_at'].replace('Z', '+00:00'))
+        return datetime.utcnow().replace(tzinfo=expires_at.tzinfo) > expires_at
     
     async def create_or_update_search(
         self, 
@@ -26,9 +63,6 @@ class SearchService:
         """Create or update active search for user"""
         start_time = time.time()
         try:
-            # Clean up expired searches first
-            await self._cleanup_expired_searches()
-            
             # Prepare data
             data = {
                 'telegram_id': telegram_id,
@@ -46,7 +80,7 @@ class SearchService:
                 data['parsed_data'] = parsed_data
             
             # Upsert (insert or update)
-            result = self.supabase.table('active_searches').upsert(
+            result = await self.supabase.table('active_searches').upsert(
                 data,
                 on_conflict='telegram_id'
             ).execute()
@@ -54,32 +88,41 @@ class SearchService:
             response_time = time.time() - start_time
             
             if result.data:
+                upsert_duration.observe(response_time, outcome='ok')
                 logger.info(f"✅ Search state updated for user {telegram_id}: {search_state}")
+                self._cache_search(result.data[0])
                 return result.data[0]
             else:
+                upsert_duration.observe(response_time, outcome='empty')
                 logger.error(f"❌ Failed to update search state for user {telegram_id}")
                 return {}
         except Exception as e:
             response_time = time.time() - start_time
+            upsert_duration.observe(response_time, outcome='error')
             logger.error(f"❌ Error updating search state: {e}")
             return {}
     
+    @timed("search_service")
     async def get_active_search(self, telegram_id: int) -> Optional[Dict[str, Any]]:
         """Get active search for user"""
         try:
-            result = self.supabase.table('active_searches').select('*').eq(
+            search = self._cache.get(telegram_id)
+            if search and not self._is_expired(search):
+                return search
+            
+            result = await self.supabase.table('active_searches').select('*').eq(
                 'telegram_id', telegram_id
             ).execute()
             
             if result.data:
                 search = result.data[0]
                 # Check if search is expired
-                expires_at = datetime.fromisoformat(search['expires_at'].replace('Z', '+00:00'))
-                if datetime.utcnow().replace(tzinfo=expires_at.tzinfo) > expires_at:
+                if self._is_expired(search):
                     # Search expired, delete it
                     await self.delete_active_search(telegram_id)
                     return None
                 
+                self._cache_search(search)
                 logger.info(f"📋 Found active search for user {telegram_id}: {search['search_state']}")
                 return search
             else:
@@ -90,10 +133,12 @@ class SearchService:
             logger.error(f"❌ Error getting active search: {e}")
             return None
     
+    @timed("search_service")
     async def delete_active_search(self, telegram_id: int) -> bool:
         """Delete active search for user"""
+        self._cache.pop(telegram_id, None)
         try:
-            result = self.supabase.table('active_searches').delete().eq(
+            result = await self.supabase.table('active_searches').delete().eq(
                 'telegram_id', telegram_id
             ).execute()
             
@@ -108,21 +153,40 @@ class SearchService:
             logger.error(f"❌ Error deleting active search: {e}")
             return False
     
-    async def _cleanup_expired_searches(self):
-        """Clean up expired searches"""
+    @timed("search_service")
+    async def _cleanup_expired_searches(self) -> int:
+        """Clean up expired searches in batches (run by the background sweeper)"""
+        batch_size = SEARCH_CLEANUP["batch_size"]
+        removed = 0
         try:
+            # Drop expired entries from local cache
+            for telegram_id in [tid for tid, search in self._cache.items() if self._is_expired(search)]:
+                del self._cache[telegram_id]
+            
             # Delete searches that expired more than 1 hour ago
             cutoff_time = (datetime.utcnow() - timedelta(hours=1)).isoformat()
             
-            result = self.supabase.table('active_searches').delete().lt(
-                'expires_at', cutoff_time
-            ).execute()
+            while True:
+                expired = await self.supabase.table('active_searches').select('id').lt(
+                    'expires_at', cutoff_time
+                ).limit(batch_size).execute()
+                
+                ids = [row['id'] for row in expired.data or []]
+                if not ids:
+                    break
+                
+                await self.supabase.table('active_searches').delete().in_('id', ids).execute()
+                removed += len(ids)
+                
+                if len(ids) < batch_size:
+                    break
             
-            if result.data:
-                logger.info(f"🧹 Cleaned up {len(result.data)} expired searches")
+            if removed:
+                logger.info(f"🧹 Cleaned up {removed} expired searches")
                 
         except Exception as e:
             logger.error(f"❌ Error cleaning up expired searches: {e}")
+        return removed
     
     async def update_search_with_flight_number(
         self, 
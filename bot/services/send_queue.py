@@ -0,0 +1,309 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from bot.config import TELEGRAM_SEND
+from bot.services.metrics import REGISTRY
+from bot.services.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Lower value is sent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NOTIFICATION = 10
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_NOTIFICATION: "notification"}
+
+# Priority of Bot API calls made in the current context (see SendQueueMiddleware)
+send_priority: ContextVar[int] = ContextVar('send_priority', default=PRIORITY_INTERACTIVE)
+
+sent_total = REGISTRY.counter("telegram_send_total", "Bot API calls dispatched by the send queue")
+retry_after_total = REGISTRY.counter("telegram_retry_after_total", "429 retry_after responses from Telegram")
+queue_wait = REGISTRY.histogram("telegram_send_queue_wait_seconds", "Time from submit to dispatch")
+
+async def send_with_priority(bot: Bot, chat_id: int, text: str, priority: int, **kwargs: Any):
+    """bot.send_message queued with given priority (plain send when the queue is off)"""
+    token = send_priority.set(priority)
+    try:
+        return await bot.send_message(chat_id, text, **kwargs)
+    finally:
+        send_priority.reset(token)
+
+class _Item:
+    __slots__ = ('priority', 'seq', 'chat_id', 'call', 'paced', 'future', 'attempts', 'enqueued_at', 'name')
+
+    def __init__(self, priority: int, seq: int, chat_id: Hashable, call: Callable[[], Awaitable[Any]],
+                 paced: bool, future: asyncio.Future, name: str):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.call = call
+        self.paced = paced
+        self.future = future
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+        self.name = name
+
+    def __lt__(self, other: "_Item") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class TelegramSendQueue:
+    """Central scheduler for outgoing Bot API calls.
+
+    Calls are dispatched by priority (interactive replies before notifications),
+    within a global rate (Telegram allows ~30 messages/s per bot) and a per-chat
+    token bucket (~1 message/s with a small burst). A 429 pauses all dispatching
+    for `retry_after` seconds and puts the call back with its chat paused as well.
+    Chats waiting for their bucket do not hold back other chats.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_SEND["global_rate"],
+                 per_chat_rate: float = TELEGRAM_SEND["per_chat_rate"],
+                 per_chat_burst: float = TELEGRAM_SEND["per_chat_burst"],
+                 max_in_flight: int = TELEGRAM_SEND["max_in_flight"],
+                 max_queue: int = TELEGRAM_SEND["max_queue"],
+                 max_retries: int = TELEGRAM_SEND["max_retries"],
+                 max_retry_after: float = TELEGRAM_SEND["max_retry_after"],
+                 congestion_threshold: int = TELEGRAM_SEND["congestion_threshold"],
+                 chat_idle_ttl: float = 300):
+        self.global_bucket = TokenBucket(global_rate, period=1.0)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.congestion_threshold = congestion_threshold
+        self.chat_idle_ttl = chat_idle_ttl
+
+        self._ready: List[_Item] = []
+        # chat_id -> items waiting for the chat's bucket; every key has at least one timer pending
+        self._waiting: Dict[Hashable, List[_Item]] = {}
+        self._timers: List[Tuple[float, int, Hashable]] = []
+        self._chat_buckets: Dict[Hashable, TokenBucket] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._in_flight: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._last_sweep = time.monotonic()
+        self._queued = 0
+
+        # Metrics
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.cancelled = 0
+        self._sent_at: deque = deque(maxlen=1000)
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def congested(self) -> bool:
+        """Backlog is large enough that best-effort calls (typing) are not worth sending"""
+        return self.queued >= self.congestion_threshold
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, chat_id: Hashable, call: Callable[[], Awaitable[Any]], priority: int = PRIORITY_INTERACTIVE,
+               paced: bool = True, name: str = "call") -> asyncio.Future:
+        """Queue a call; the returned future gets its result or exception"""
+        if self.queued >= self.max_queue:
+            raise asyncio.QueueFull(f"Telegram send queue is full ({self.max_queue} calls)")
+        future = asyncio.get_running_loop().create_future()
+        self.submitted += 1
+        self._push(_Item(priority, next(self._seq), chat_id, call, paced, future, name))
+        return future
+
+    def _push(self, item: _Item) -> None:
+        self._queued += 1
+        if item.paced:
+            waiting = self._waiting.get(item.chat_id)
+            if waiting is not None:
+                heapq.heappush(waiting, item)
+                return
+            now = time.monotonic()
+            delay = self._chat_delay(item.chat_id, now)
+            if delay > 0:
+                self._defer(item, now + delay)
+                return
+        heapq.heappush(self._ready, item)
+        self._wakeup.set()
+
+    def _defer(self, item: _Item, ready_at: float) -> None:
+        heapq.heappush(self._waiting.setdefault(item.chat_id, []), item)
+        # Extra timers for a chat are harmless: _release_due_chats re-checks the bucket
+        heapq.heappush(self._timers, (ready_at, next(self._seq), item.chat_id))
+        self._wakeup.set()
+
+    def _chat_delay(self, chat_id: Hashable, now: float) -> float:
+        bucket = self._chat_buckets.get(chat_id)
+        return bucket.time_until_available(now=now) if bucket else 0.0
+
+    def _chat_bucket(self, chat_id: Hashable, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(
+                self.per_chat_burst, period=self.per_chat_burst / self.per_chat_rate, now=now
+            )
+        return bucket
+
+    def _release_due_chats(self, now: float) -> None:
+        """Move the next item of every chat whose bucket has refilled to the ready heap"""
+        while self._timers and self._timers[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._timers)
+            waiting = self._waiting.get(chat_id)
+            if not waiting:
+                self._waiting.pop(chat_id, None)
+                continue
+            delay = self._chat_delay(chat_id, now)
+            if delay > 0:
+                # Paused again by retry_after meanwhile
+                heapq.heappush(self._timers, (now + delay, next(self._seq), chat_id))
+                continue
+            heapq.heappush(self._ready, heapq.heappop(waiting))
+            if waiting:
+                heapq.heappush(self._timers, (now + 1 / self.per_chat_rate, next(self._seq), chat_id))
+            else:
+                del self._waiting[chat_id]
+
+    def _sweep_idle_chats(self, now: float) -> None:
+        cutoff = now - self.chat_idle_ttl
+        idle = [chat_id for chat_id, bucket in self._chat_buckets.items()
+                if bucket.updated_at < cutoff and chat_id not in self._waiting]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+        self._last_sweep = now
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._release_due_chats(now)
+            if now - self._last_sweep >= 60:
+                self._sweep_idle_chats(now)
+
+            if not self._ready:
+                timeout = max(self._timers[0][0] - now, 0) if self._timers else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self.global_bucket.time_until_available(now=now)
+            if delay > 0:
+                # Re-check afterwards: a higher-priority call may arrive meanwhile
+                await asyncio.sleep(delay)
+                continue
+
+            await self._slots.acquire()
+            if not self._ready:
+                self._slots.release()
+                continue
+            now = time.monotonic()
+            item = heapq.heappop(self._ready)
+            if item.future.done():
+                # Caller gave up (cancelled) before the call was made
+                self._slots.release()
+                self._queued -= 1
+                self.cancelled += 1
+                continue
+            if item.paced:
+                delay = self._chat_delay(item.chat_id, now)
+                if delay > 0:
+                    self._slots.release()
+                    self._defer(item, now + delay)
+                    continue
+                self._chat_bucket(item.chat_id, now).consume(now=now)
+            self.global_bucket.consume(now=now)
+            self._queued -= 1
+
+            task = asyncio.create_task(self._dispatch(item))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, item: _Item) -> None:
+        priority = PRIORITY_NAMES.get(item.priority, str(item.priority))
+        if not item.attempts:
+            queue_wait.observe(time.monotonic() - item.enqueued_at, priority=priority)
+        try:
+            result = await item.call()
+        except TelegramRetryAfter as e:
+            retry_after_total.inc(method=item.name)
+            item.attempts += 1
+            # Flood control applies to the whole bot: other chats would only collect more 429s
+            self.global_bucket.pause(min(e.retry_after, self.max_retry_after))
+            # Best-effort (unpaced) calls such as chat actions are not retried
+            if (item.paced and item.attempts <= self.max_retries and e.retry_after <= self.max_retry_after
+                    and not item.future.done()):
+                self.retried += 1
+                logger.warning(f"🚦 Telegram retry_after={e.retry_after}s for {item.name} in chat {item.chat_id}, requeued")
+                self._chat_bucket(item.chat_id, time.monotonic()).pause(e.retry_after)
+                self._push(item)
+                return
+            self._fail(item, e)
+        except Exception as e:
+            self._fail(item, e)
+        else:
+            self.sent += 1
+            self._sent_at.append(time.monotonic())
+            sent_total.inc(method=item.name, priority=priority, outcome="ok")
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def _fail(self, item: _Item, error: BaseException) -> None:
+        self.failed += 1
+        sent_total.inc(method=item.name, priority=PRIORITY_NAMES.get(item.priority, str(item.priority)), outcome="error")
+        if not item.future.done():
+            item.future.set_exception(error)
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """Give queued calls up to `timeout` seconds, then cancel the rest"""
+        deadline = time.monotonic() + timeout
+        while (self.queued or self._in_flight) and time.monotonic() < deadline and self._task:
+            await asyncio.sleep(0.05)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        left = self._ready + [item for items in self._waiting.values() for item in items]
+        for item in left:
+            if not item.future.done():
+                item.future.cancel()
+        if left:
+            logger.warning(f"🗑 Dropped {len(left)} queued Telegram calls on shutdown")
+        self._ready.clear()
+        self._waiting.clear()
+        self._timers.clear()
+        self._queued = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue and throughput metrics"""
+        now = time.monotonic()
+        recent = sum(1 for sent_at in self._sent_at if now - sent_at <= 10)
+        return {
+            'queued': self.queued,
+            'waiting_chats': len(self._waiting),
+            'in_flight': len(self._in_flight),
+            'submitted': self.submitted,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'cancelled': self.cancelled,
+            'sent_per_second': recent / 10
+        }
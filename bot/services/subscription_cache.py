@@ -0,0 +1,85 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+class SubscriptionCache:
+    """LRU/TTL index of flight_subscriptions rows per user_id.
+
+    A user's rows are loaded in one query and then kept in sync by
+    subscribe/unsubscribe; TTL covers changes made outside this process
+    (edge functions, other workers).
+    """
+
+    def __init__(self, max_users: int = 10000, ttl: int = 300):
+        self.max_users = max_users
+        self.ttl = ttl
+        # user_id -> (loaded_at, {subscription id: row})
+        self._users: "OrderedDict[str, tuple[float, Dict[str, Dict[str, Any]]]]" = OrderedDict()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: str) -> Optional[List[Dict[str, Any]]]:
+        """All cached rows of user (newest first) or None if not loaded/expired"""
+        entry = self._users.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        loaded_at, rows = entry
+        if time.monotonic() - loaded_at > self.ttl:
+            del self._users[user_id]
+            self.misses += 1
+            return None
+
+        self._users.move_to_end(user_id)
+        self.hits += 1
+        return sorted(rows.values(), key=lambda row: row.get('created_at') or '', reverse=True)
+
+    def put(self, user_id: str, rows: List[Dict[str, Any]]) -> None:
+        """Store full set of user's rows, evicting least recently used users"""
+        self._users[user_id] = (time.monotonic(), {row['id']: row for row in rows})
+        self._users.move_to_end(user_id)
+
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+            self.evictions += 1
+
+    def add(self, user_id: str, row: Dict[str, Any]) -> None:
+        """Insert or replace one row if the user's index is loaded"""
+        entry = self._users.get(user_id)
+        if entry is None:
+            return
+        rows = entry[1]
+        # Same flight may come back with a new id after an upsert
+        for key, existing in list(rows.items()):
+            if (existing.get('flight_number'), existing.get('flight_date')) == (row.get('flight_number'), row.get('flight_date')):
+                del rows[key]
+        rows[row['id']] = row
+
+    def remove(self, user_id: str, subscription_id: str) -> None:
+        """Drop one row if the user's index is loaded"""
+        entry = self._users.get(user_id)
+        if entry is not None:
+            entry[1].pop(subscription_id, None)
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop user's index so the next read reloads it"""
+        self._users.pop(user_id, None)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache metrics"""
+        return {
+            'users': len(self._users),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'evictions': self.evictions
+        }
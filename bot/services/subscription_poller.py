@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+from bot.config import NOTIFICATIONS
+from bot.services.flight_diff import FieldChange, FlightDiffEngine
+from bot.services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# No further changes expected: polling of the flight stops
+FINAL_STATUSES = frozenset({"Arrived", "Canceled", "Diverted"})
+# Gate / boarding updates come minutes apart
+IMMINENT_STATUSES = frozenset({"Boarding", "GateClosed", "Approaching"})
+AIRBORNE_STATUSES = frozenset({"Departed", "EnRoute"})
+
+polls_total = REGISTRY.counter("subscription_poll_total", "Subscribed flight polls by outcome")
+poll_notifications_total = REGISTRY.counter("subscription_poll_notifications_total",
+                                            "Notifications sent by the subscription poller")
+
+def _field(flight: Dict[str, Any], path: Tuple[str, ...]) -> Any:
+    value: Any = flight
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+def _iata(flight: Dict[str, Any], side: str) -> str:
+    return _field(flight, (side, "airport", "iata")) or ""
+
+def pick_leg(data: Any, dep_iata: Optional[str], arr_iata: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Subscribed leg of flight-api data (list of legs), first leg if the route does not match"""
+    legs = data if isinstance(data, list) else [data] if isinstance(data, dict) else []
+    legs = [leg for leg in legs if isinstance(leg, dict)]
+    for leg in legs:
+        if (not dep_iata or _iata(leg, "departure") == dep_iata) and (not arr_iata or _iata(leg, "arrival") == arr_iata):
+            return leg
+    return legs[0] if legs else None
+
+def _leg_time(flight: Dict[str, Any], side: str) -> Optional[datetime]:
+    """Revised (or scheduled) UTC time of departure/arrival"""
+    value = _field(flight, (side, "revisedTime", "utc")) or _field(flight, (side, "scheduledTime", "utc"))
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def next_poll_delay(flight: Dict[str, Any], now: datetime, base: float, min_interval: float,
+                    max_interval: float) -> Optional[float]:
+    """Seconds until the flight is worth polling again; None once it reached a final status"""
+    status = flight.get("status") or "Unknown"
+    if status in FINAL_STATUSES:
+        return None
+    if status in IMMINENT_STATUSES:
+        return min_interval
+
+    if status in AIRBORNE_STATUSES:
+        arrival = _leg_time(flight, "arrival")
+        if arrival and (arrival - now).total_seconds() <= 3600:
+            return min_interval
+        return base
+
+    departure = _leg_time(flight, "departure")
+    if departure is None:
+        return base
+    until_departure = (departure - now).total_seconds()
+    if until_departure <= 3600:
+        delay = min_interval
+    elif until_departure <= 6 * 3600:
+        delay = base
+    elif until_departure <= 24 * 3600:
+        delay = base * 3
+    else:
+        # Far from departure: come back about a day before it
+        delay = until_departure - 24 * 3600
+    return min(max(delay, min_interval), max_interval)
+
+class _TrackedFlight:
+    __slots__ = ('flight_number', 'flight_date', 'subscribers', 'next_check_at', 'finished')
+
+    def __init__(self, flight_number: str, flight_date: str, next_check_at: float):
+        self.flight_number = flight_number
+        self.flight_date = flight_date
+        # (departure_airport, arrival_airport) -> subscription rows for that leg
+        self.subscribers: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self.next_check_at = next_check_at
+        self.finished = False
+
+class SubscriptionPoller:
+    """Background polling of flights with active subscriptions.
+
+    Webhooks from AeroDataBox can be missed, so every `check_interval` seconds
+    active flight_subscriptions are reloaded and grouped by (flight_number,
+    flight_date): a flight is fetched once however many users follow it. Due
+    flights are fetched in batches of `batch_size` through FlightService (cache,
+    request coalescing and API rate limit apply). How soon a flight is polled
+    again depends on its status and time to departure. Each subscribed leg is
+    passed to FlightDiffEngine; subscribers are notified only of the changes it
+    returns (the first poll is a baseline). A fan-out that reached nobody, failed
+    or was cancelled on shutdown is released back to the engine and sent again.
+    """
+
+    def __init__(self, db: Any, flight_service: Any, notification_service: Any,
+                 diff_engine: Optional[FlightDiffEngine] = None,
+                 check_interval: float = NOTIFICATIONS["check_interval"],
+                 batch_size: int = NOTIFICATIONS["batch_size"],
+                 min_check_interval: float = NOTIFICATIONS["min_check_interval"],
+                 max_check_interval: float = NOTIFICATIONS["max_check_interval"],
+                 tick: float = NOTIFICATIONS["tick"]):
+        self.db = db
+        self.flight_service = flight_service
+        self.notification_service = notification_service
+        self.diff_engine = diff_engine or FlightDiffEngine(db)
+        self.check_interval = check_interval
+        self.batch_size = batch_size
+        self.min_check_interval = min_check_interval
+        self.max_check_interval = max_check_interval
+        self.tick = tick
+
+        self._flights: Dict[Tuple[str, str], _TrackedFlight] = {}
+        self._refreshed_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._fanouts: Set[asyncio.Task] = set()
+
+        # Metrics
+        self.polls = 0
+        self.poll_errors = 0
+        self.changes = 0
+        self.notifications_sent = 0
+        self.notifications_failed = 0
+
+    def start(self) -> None:
+        """Start background polling"""
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop background polling and notification fan-outs still in progress"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._fanouts:
+            logger.warning(f"🗑 Cancelling {len(self._fanouts)} notification fan-outs on shutdown")
+            for task in list(self._fanouts):
+                task.cancel()
+            await asyncio.gather(*self._fanouts, return_exceptions=True)
+        # Also fan-outs cancelled before they started
+        await self.diff_engine.release_all()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Error in subscription poller: {e}")
+            await asyncio.sleep(self.tick)
+
+    async def run_once(self) -> int:
+        """Reload subscriptions when due and poll flights whose time has come; returns flights polled"""
+        now = time.monotonic()
+        if self._refreshed_at is None or now - self._refreshed_at >= self.check_interval:
+            # Set first: a failing query is retried at the next interval, not every tick
+            self._refreshed_at = now
+            await self.refresh_subscriptions()
+            now = time.monotonic()
+
+        due = sorted((flight for flight in self._flights.values()
+                      if not flight.finished and flight.next_check_at <= now),
+                     key=lambda flight: flight.next_check_at)
+        for i in range(0, len(due), self.batch_size):
+            await asyncio.gather(*(self._poll(flight) for flight in due[i:i + self.batch_size]))
+        return len(due)
+
+    async def refresh_subscriptions(self) -> None:
+        """Rebuild tracked flights from active subscriptions, keeping their poll schedule"""
+        since = (datetime.now(timezone.utc).date() - timedelta(days=1)).isoformat()
+        rows = await self.db.get_active_subscriptions_for_polling(since)
+
+        now = time.monotonic()
+        flights: Dict[Tuple[str, str], _TrackedFlight] = {}
+        for row in rows:
+            telegram_id = (row.get('users') or {}).get('telegram_id')
+            if not telegram_id or not row.get('flight_number') or not row.get('flight_date'):
+                continue
+            key = (row['flight_number'], row['flight_date'])
+            flight = flights.get(key)
+            if flight is None:
+                previous = self._flights.get(key)
+                flight = flights[key] = _TrackedFlight(key[0], key[1], now)
+                if previous:
+                    flight.next_check_at, flight.finished = previous.next_check_at, previous.finished
+            leg = (row.get('departure_airport') or '', row.get('arrival_airport') or '')
+            flight.subscribers.setdefault(leg, []).append(row)
+
+        # Legs nobody follows any more
+        for key, flight in self._flights.items():
+            current = flights.get(key)
+            for leg in flight.subscribers:
+                if not current or leg not in current.subscribers:
+                    self.diff_engine.forget((*key, *leg))
+        self._flights = flights
+        logger.info(f"📡 Polling {len(flights)} subscribed flights ({len(rows)} subscriptions)")
+
+    async def _poll(self, flight: _TrackedFlight) -> None:
+        result = await self.flight_service.get_flight_data(flight.flight_number, flight.flight_date)
+        now = time.monotonic()
+        self.polls += 1
+        if not result.get('success') or not result.get('data'):
+            self.poll_errors += 1
+            polls_total.inc(outcome='error')
+            logger.warning(f"Subscription poll failed for {flight.flight_number} {flight.flight_date}: "
+                           f"{result.get('error') or result.get('message')}")
+            flight.next_check_at = now + self.check_interval
+            return
+        polls_total.inc(outcome='ok')
+
+        utc_now = datetime.now(timezone.utc)
+        delays = []
+        for leg_key, subscribers in flight.subscribers.items():
+            leg = pick_leg(result['data'], *leg_key)
+            if leg is None:
+                continue
+            changes = await self.diff_engine.observe((flight.flight_number, flight.flight_date, *leg_key), leg)
+            if changes:
+                self.changes += 1
+                logger.info(f"🔔 {flight.flight_number} {flight.flight_date} changed: "
+                            f"{', '.join(change.field for change in changes)}, notifying {len(subscribers)}")
+                self._notify((flight.flight_number, flight.flight_date, *leg_key), leg, changes, subscribers)
+            delays.append(next_poll_delay(leg, utc_now, self.check_interval,
+                                          self.min_check_interval, self.max_check_interval))
+
+        pending = [delay for delay in delays if delay is not None]
+        if delays and not pending:
+            flight.finished = True
+        flight.next_check_at = now + (min(pending) if pending else self.check_interval)
+
+    def _notify(self, key: Tuple[str, str, str, str], leg: Dict[str, Any], changes: List[FieldChange],
+                subscribers: List[Dict[str, Any]]) -> None:
+        """Fan the change out to leg's subscribers in background, so a large list does not hold up polling"""
+        task = asyncio.create_task(self._fan_out(key, leg, changes, subscribers))
+        self._fanouts.add(task)
+        task.add_done_callback(self._fanouts.discard)
+
+    async def _fan_out(self, key: Tuple[str, str, str, str], leg: Dict[str, Any], changes: List[FieldChange],
+                       subscribers: List[Dict[str, Any]]) -> None:
+        try:
+            progress = await self.notification_service.fan_out(leg, subscribers, changes=changes,
+                                                               concurrency=self.batch_size)
+        except asyncio.CancelledError:
+            # Shutdown: report the change again after restart
+            await self.diff_engine.release(key)
+            raise
+        except Exception as e:
+            logger.error(f"Error notifying subscribers of {leg.get('number')}: {e}")
+            await self.diff_engine.release(key)
+            return
+        failed = progress.failed + progress.blocked
+        self.notifications_sent += progress.sent
+        self.notifications_failed += failed
+        poll_notifications_total.inc(progress.sent, outcome='ok')
+        poll_notifications_total.inc(failed, outcome='error')
+        if progress.sent or not progress.failed:
+            await self.diff_engine.confirm(key)
+        else:
+            # Nobody got it for a reason other than a blocked bot: retry on the next poll
+            await self.diff_engine.release(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get polling metrics"""
+        return {
+            'tracked_flights': len(self._flights),
+            'finished_flights': sum(1 for flight in self._flights.values() if flight.finished),
+            'polls': self.polls,
+            'poll_errors': self.poll_errors,
+            'changes': self.changes,
+            'notifications_sent': self.notifications_sent,
+            'notifications_failed': self.notifications_failed
+        }
@@ -3,12 +3,15 @@ from typing import Optional
 from aiogram import Bot
 from aiogram.enums import ChatAction
 from bot.config import TYPING_INDICATOR_ENABLED, TYPING_DURATION, TYPING_ACTION
+from bot.services.send_queue import TelegramSendQueue
 
 class TypingService:
     """Service for managing typing indicators during API requests"""
     
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, send_queue: Optional[TelegramSendQueue] = None):
         self.bot = bot
+        # Typing is skipped while the send queue has a backlog
+        self.send_queue = send_queue
         self.enabled = TYPING_INDICATOR_ENABLED
         self.default_duration = TYPING_DURATION
         self.default_action = TYPING_ACTION
@@ -31,7 +34,7 @@ class TypingService:
         
         try:
             # Send typing action
-            await self.bot.send_chat_action(chat_id, action)
+            await self._send_action(chat_id, action)
             
             # Keep typing indicator active for specified duration
             await asyncio.sleep(duration)
@@ -55,24 +58,22 @@ class TypingService:
         
         action = action or self.default_action
         
+        # Start typing indicator
+        typing_task = asyncio.create_task(self._keep_typing(chat_id, action))
         try:
-            # Start typing indicator
-            typing_task = asyncio.create_task(self._keep_typing(chat_id, action))
-            
             # Wait for the main operation to complete
             await future
-            
-            # Cancel typing indicator
-            typing_task.cancel()
-            
         except Exception as e:
             print(f"Error in show_typing_until: {e}")
+        finally:
+            # Cancel typing indicator even if the operation failed
+            typing_task.cancel()
     
     async def _keep_typing(self, chat_id: int, action: str) -> None:
         """Keep typing indicator active"""
         try:
             while True:
-                await self.bot.send_chat_action(chat_id, action)
+                await self._send_action(chat_id, action)
                 await asyncio.sleep(5)  # Telegram typing indicator expires after 5 seconds
         except asyncio.CancelledError:
             # Task was cancelled, which is expected
@@ -80,6 +81,11 @@ class TypingService:
         except Exception as e:
             print(f"Error in _keep_typing: {e}")
     
+    async def _send_action(self, chat_id: int, action: str) -> None:
+        if self.send_queue and self.send_queue.congested:
+            return
+        await self.bot.send_chat_action(chat_id, action)
+    
     async def show_loading_message(self, chat_id: int, message: str, 
                                  duration: Optional[int] = None) -> None:
         """
@@ -0,0 +1,116 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+class UserCache:
+    """LRU/TTL cache of users rows keyed by telegram_id with write-behind activity updates"""
+
+    def __init__(self, max_size: int = 10000, ttl: int = 600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._users: "OrderedDict[int, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # Pending last_active/username changes, coalesced per user id
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._oldest_pending_at: Optional[float] = None
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.last_flush_lag = 0.0
+
+    def get(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+        """Get cached user or None if missing/expired"""
+        entry = self._users.get(telegram_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        cached_at, user = entry
+        if time.monotonic() - cached_at > self.ttl:
+            del self._users[telegram_id]
+            self.misses += 1
+            return None
+
+        self._users.move_to_end(telegram_id)
+        self.hits += 1
+        return user
+
+    def put(self, user: Dict[str, Any]) -> None:
+        """Store user row, evicting least recently used entries"""
+        telegram_id = user['telegram_id']
+        self._users[telegram_id] = (time.monotonic(), user)
+        self._users.move_to_end(telegram_id)
+
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, telegram_id: int) -> None:
+        """Drop cached user"""
+        self._users.pop(telegram_id, None)
+
+    def touch(self, user: Dict[str, Any], username: Optional[str] = None) -> None:
+        """Record user activity to be written by the next flush"""
+        if username:
+            user['username'] = username
+
+        self._pending[user['id']] = {
+            'id': user['id'],
+            'telegram_id': user['telegram_id'],
+            'username': user.get('username'),
+            'last_active': datetime.utcnow().isoformat()
+        }
+        if self._oldest_pending_at is None:
+            self._oldest_pending_at = time.monotonic()
+
+    def drain_pending(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Take up to `limit` coalesced activity rows for a batched upsert"""
+        if not self._pending:
+            return []
+
+        if limit is None or limit >= len(self._pending):
+            rows = list(self._pending.values())
+            self._pending.clear()
+        else:
+            keys = list(self._pending)[:limit]
+            rows = [self._pending.pop(key) for key in keys]
+
+        self.last_flush_lag = time.monotonic() - self._oldest_pending_at
+        self._oldest_pending_at = time.monotonic() if self._pending else None
+        return rows
+
+    def restore_pending(self, rows: List[Dict[str, Any]]) -> None:
+        """Put rows back after a failed flush, keeping newer updates"""
+        for row in rows:
+            self._pending.setdefault(row['id'], row)
+        if self._pending and self._oldest_pending_at is None:
+            self._oldest_pending_at = time.monotonic()
+
+    def record_flush(self, rows_count: int) -> None:
+        self.flushes += 1
+        self.flushed_rows += rows_count
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache and write-behind metrics"""
+        pending_age = time.monotonic() - self._oldest_pending_at if self._oldest_pending_at else 0.0
+        return {
+            'size': len(self._users),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'evictions': self.evictions,
+            'pending': len(self._pending),
+            'pending_age': pending_age,
+            'flushes': self.flushes,
+            'flushed_rows': self.flushed_rows,
+            'last_flush_lag': self.last_flush_lag
+        }
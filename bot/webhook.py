@@ -0,0 +1,145 @@
+import asyncio
+import hmac
+import logging
+import time
+from typing import Any, Dict
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from bot.config import BOT_VERSION, METRICS, WEBHOOK
+from bot.services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Webhook handler that acks Telegram immediately and processes updates with bounded concurrency.
+
+    At most `max_concurrent` updates run at once; when `max_pending` updates are
+    already waiting, the request is rejected with 503 so Telegram redelivers it later.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_concurrent: int, max_pending: int, **kwargs: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.max_pending = max_pending
+        self.processed_updates = 0
+        self.rejected_updates = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        async with self._semaphore:
+            try:
+                await super()._background_feed_update(bot, update)
+            finally:
+                self.processed_updates += 1
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if self.in_flight >= self.max_pending:
+            self.rejected_updates += 1
+            logger.warning(f"🚦 Webhook backlog full ({self.in_flight} updates), asking Telegram to retry")
+            return web.Response(status=503)
+        return await super()._handle_request_background(bot, request)
+
+def add_health_route(app: web.Application, mode: str, handler: BoundedRequestHandler = None) -> None:
+    """Register GET /health used by the Docker HEALTHCHECK and load balancers"""
+    started_at = time.monotonic()
+
+    async def health(request: web.Request) -> web.Response:
+        payload = {
+            "status": "ok",
+            "version": BOT_VERSION,
+            "mode": mode,
+            "uptime": round(time.monotonic() - started_at)
+        }
+        if handler:
+            payload.update(
+                in_flight=handler.in_flight,
+                processed_updates=handler.processed_updates,
+                rejected_updates=handler.rejected_updates
+            )
+        return web.json_response(payload)
+
+    app.router.add_get("/health", health)
+
+def add_metrics_route(app: web.Application) -> None:
+    """Register GET /metrics in Prometheus text format, behind METRICS["token"]"""
+    if not METRICS["enabled"]:
+        return
+    if not METRICS["token"]:
+        # Same public port as the webhook: never expose metrics without a token
+        logger.warning("METRICS_TOKEN is not set, /metrics is not served")
+        return
+    expected = f"Bearer {METRICS['token']}".encode()
+
+    async def metrics(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), expected):
+            return web.Response(status=401, headers={"WWW-Authenticate": "Bearer"})
+        return web.Response(body=REGISTRY.render_prometheus().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app.router.add_get(METRICS["path"], metrics)
+
+async def start_server(app: web.Application) -> web.AppRunner:
+    """Start aiohttp app on WEBHOOK host/port"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK["host"], WEBHOOK["port"]).start()
+    except OSError:
+        await runner.cleanup()
+        raise
+    logger.info(f"HTTP server listening on {WEBHOOK['host']}:{WEBHOOK['port']}")
+    return runner
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """Receive updates via webhook until cancelled"""
+    if not WEBHOOK["secret"]:
+        logger.warning("WEBHOOK_SECRET is not set: the webhook endpoint accepts updates from anyone")
+    app = web.Application()
+    handler = BoundedRequestHandler(
+        dp, bot,
+        max_concurrent=WEBHOOK["max_concurrent_updates"],
+        max_pending=WEBHOOK["max_pending_updates"],
+        secret_token=WEBHOOK["secret"]
+    )
+    handler.register(app, path=WEBHOOK["path"])
+    add_health_route(app, "webhook", handler)
+    add_metrics_route(app)
+    setup_application(app, dp, bot=bot)
+
+    await bot.set_webhook(
+        url=f"{WEBHOOK['url'].rstrip('/')}{WEBHOOK['path']}",
+        secret_token=WEBHOOK["secret"],
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK["telegram_max_connections"]
+    )
+    logger.info(f"Webhook set to {WEBHOOK['url'].rstrip('/')}{WEBHOOK['path']}")
+
+    runner = await start_server(app)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+async def run_polling(bot: Bot, dp: Dispatcher) -> None:
+    """Receive updates via long polling; with WEBHOOK["polling_http"] also serve /health and /metrics"""
+    runner = None
+    if WEBHOOK["polling_http"]:
+        app = web.Application()
+        add_health_route(app, "polling")
+        add_metrics_route(app)
+        try:
+            runner = await start_server(app)
+        except OSError as e:
+            # E.g. several polling workers on one host: polling does not need the port
+            logger.warning(f"/health and /metrics not served, port {WEBHOOK['port']} unavailable: {e}")
+    try:
+        # Polling is rejected by Telegram while a webhook is set
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+    finally:
+        if runner:
+            await runner.cleanup()
@@ -177,9 +177,11 @@ import { v4 as uuidv4 } from "https://deno.land/std@0.168.0/uuid/mod.ts"
         if (uuid) flightDetailsUUIDs.push(uuid);
       }
 
-      // Log the API call
+      // Log the API call without delaying the response. Full payload is already
+      // in flight_details.raw_data, so the audit row keeps only a summary
       if (user_id) {
-        await supabase
+        const flights = Array.isArray(flightData) ? flightData : (flightData && !flightData.error ? [flightData] : [])
+        const auditInsert = supabase
           .from('audit_logs')
           .insert({
             user_id,
@@ -187,9 +189,16 @@ import { v4 as uuidv4 } from "https://deno.land/std@0.168.0/uuid/mod.ts"
             details: {
               flight_number,
               date,
-              result: flightData
+              error: flightData?.error || null,
+              flights: flights.length,
+              statuses: flights.map((flight: any) => flight?.status)
             }
           })
+          .then(({ error }) => {
+            if (error) console.error('❌ Error writing audit log:', error)
+          })
+        // @ts-ignore EdgeRuntime is provided by the Supabase Edge Runtime
+        if (typeof EdgeRuntime !== 'undefined') EdgeRuntime.waitUntil(auditInsert)
       }
 
       let message = '';
@@ -45,6 +45,383 @@ interface FlightNotification {
   }>
 }
 
+// Telegram allows ~30 messages/s per bot: stay below it and keep a bounded number of requests open
+const SEND_RATE = Number(Deno.env.get('TELEGRAM_SEND_RATE') ?? 25) // messages per second
+const SEND_CONCURRENCY = Number(Deno.env.get('TELEGRAM_SEND_CONCURRENCY') ?? 10)
+const MAX_ATTEMPTS = 4
+const MAX_RETRY_AFTER = 30 // seconds; longer waits fail the delivery
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms))
+
+// Token bucket shared by all sends of one webhook call
+class TokenBucket {
+  private tokens: number
+  private updatedAt = Date.now()
+  private pausedUntil = 0
+
+  // Small burst: Telegram counts messages over short windows, not per whole second
+  constructor(private rate: number, private capacity: number = Math.max(1, Math.ceil(rate / 5))) {
+    this.tokens = capacity
+  }
+
+  private refill(now: number) {
+    this.tokens = Math.min(this.capacity, this.tokens + (now - this.updatedAt) / 1000 * this.rate)
+    this.updatedAt = now
+  }
+
+  async take(): Promise<void> {
+    while (true) {
+      const now = Date.now()
+      if (now < this.pausedUntil) {
+        await sleep(this.pausedUntil - now)
+        continue
+      }
+      this.refill(now)
+      if (this.tokens >= 1) {
+        this.tokens -= 1
+        return
+      }
+      await sleep((1 - this.tokens) / this.rate * 1000)
+    }
+  }
+
+  // 429 retry_after: nobody sends until it passes
+  pause(seconds: number) {
+    this.pausedUntil = Math.max(this.pausedUntil, Date.now() + seconds * 1000)
+    this.tokens = 0
+    this.updatedAt = this.pausedUntil
+  }
+}
+
+interface Delivery {
+  user_id: string
+  telegram_id: number
+  flight_number: string
+  flight_date: string
+  status: string
+  message: string
+}
+
+interface DeliveryResult {
+  success: boolean
+  attempts: number
+  error_code?: number
+  error?: string
+}
+
+async function sendMessage(botToken: string, delivery: Delivery, bucket: TokenBucket): Promise<DeliveryResult> {
+  let lastError: DeliveryResult = { success: false, attempts: 0 }
+  for (let attempt = 1; attempt <= MAX_ATTEMPTS; attempt++) {
+    await bucket.take()
+    try {
+      const response = await fetch(`https://api.telegram.org/bot${botToken}/sendMessage`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+          chat_id: delivery.telegram_id,
+          text: delivery.message,
+          parse_mode: 'HTML'
+        })
+      })
+      if (response.ok) {
+        await response.body?.cancel()
+        return { success: true, attempts: attempt }
+      }
+
+      const errorData = await response.json().catch(() => ({}))
+      lastError = { success: false, attempts: attempt, error_code: response.status, error: errorData.description }
+      const retryAfter = errorData.parameters?.retry_after
+      if (response.status === 429 && retryAfter && retryAfter <= MAX_RETRY_AFTER) {
+        console.warn(`🚦 Telegram retry_after=${retryAfter}s (chat ${delivery.telegram_id})`)
+        bucket.pause(retryAfter)
+        continue
+      }
+      if (response.status < 500) {
+        // 400/403 (bad chat, bot blocked): retrying will not help
+        return lastError
+      }
+    } catch (error) {
+      lastError = { success: false, attempts: attempt, error: error.message }
+    }
+    // 5xx or network error
+    await sleep(500 * 2 ** (attempt - 1))
+  }
+  return lastError
+}
+
+// Runs deliveries with at most SEND_CONCURRENCY requests in flight, paced by the bucket
+async function deliverAll(botToken: string, deliveries: Delivery[]): Promise<DeliveryResult[]> {
+  const bucket = new TokenBucket(SEND_RATE)
+  const results: DeliveryResult[] = new Array(deliveries.length)
+  let next = 0
+  const worker = async () => {
+    while (next < deliveries.length) {
+      const index = next++
+      results[index] = await sendMessage(botToken, deliveries[index], bucket)
+      if (!results[index].success) {
+        console.error(`❌ Failed to send to user ${deliveries[index].telegram_id}:`, results[index])
+      }
+    }
+  }
+  await Promise.all(Array.from({ length: Math.min(SEND_CONCURRENCY, deliveries.length) }, worker))
+  return results
+}
+
+interface FlightSummary {
+  flight_number: string
+  flight_date: string
+  status: string
+  subscribers_count: number
+}
+
+// Sends all deliveries, settles each flight's claim, then writes per-recipient results
+// and per-flight summaries in one insert
+async function deliverAndRecord(supabase: any, botToken: string, deliveries: Delivery[], flights: FlightSummary[],
+                                claims: Map<string, Claim>) {
+  try {
+    const startedAt = Date.now()
+    const results = await deliverAll(botToken, deliveries)
+    const successCount = results.filter(r => r.success).length
+
+    console.log(`📊 Notification results: ${successCount} sent, ${results.length - successCount} failed in ${Date.now() - startedAt}ms`)
+
+    const auditRows: Record<string, unknown>[] = deliveries.map((delivery, i) => ({
+      user_id: delivery.user_id,
+      action: 'flight_notification_delivery',
+      details: {
+        flight_number: delivery.flight_number,
+        flight_date: delivery.flight_date,
+        status: delivery.status,
+        telegram_id: delivery.telegram_id,
+        ...results[i]
+      }
+    }))
+    for (const flight of flights) {
+      const flightResults = results.filter((_, i) =>
+        deliveries[i].flight_number === flight.flight_number && deliveries[i].flight_date === flight.flight_date)
+      const sent = flightResults.filter(r => r.success).length
+      const claim = claims.get(`${flight.flight_number}:${flight.flight_date}`)
+      if (claim) {
+        // Like the bot's poller: nobody got it for a reason other than a blocked bot, give it back
+        const failed = flightResults.filter(r => !r.success && r.error_code !== 403).length
+        await settleClaim(supabase, claim, sent > 0 || failed === 0)
+      }
+      auditRows.push({
+        action: 'flight_notification_sent',
+        details: { ...flight, success_count: sent, failure_count: flightResults.length - sent }
+      })
+    }
+    const { error } = await supabase.from('audit_logs').insert(auditRows)
+    if (error) {
+      console.error('❌ Error writing delivery results:', error)
+    }
+  } catch (error) {
+    console.error('❌ Error delivering notifications:', error)
+  }
+}
+
+// Same fields, row format and rules as bot/services/flight_diff.py. The bot's subscription
+// poller and this webhook claim each change in flight_notification_claims before sending it,
+// so only one of them notifies subscribers; flight_logs holds the last notified state
+const DIFF_FIELDS: Record<string, string[]> = {
+  status: ['status'],
+  dep_terminal: ['departure', 'terminal'],
+  dep_gate: ['departure', 'gate'],
+  dep_time: ['departure', 'revisedTime', 'utc'],
+  arr_terminal: ['arrival', 'terminal'],
+  arr_gate: ['arrival', 'gate'],
+  arr_time: ['arrival', 'revisedTime', 'utc'],
+  belt: ['arrival', 'baggageBelt'],
+}
+const TIME_FIELDS = new Set(['dep_time', 'arr_time'])
+const MIN_TIME_SHIFT = 300 // seconds, FLIGHT_DIFF["min_time_shift"] in the bot
+const DEDUPE_TTL = 6 * 3600 // seconds, FLIGHT_DIFF["dedupe_ttl"]
+// seconds, FLIGHT_DIFF["claim_lease"]: longer than this function may run, so a claim
+// of an invocation killed mid fan-out is taken over by the poller afterwards
+const CLAIM_LEASE = 15 * 60
+
+type Snapshot = Record<string, string | null>
+
+function takeSnapshot(flight: any): Snapshot {
+  const snapshot: Snapshot = {}
+  for (const [name, path] of Object.entries(DIFF_FIELDS)) {
+    const value = path.reduce((node: any, key) => (node && typeof node === 'object' ? node[key] : undefined), flight)
+    snapshot[name] = value === null || value === undefined ? null : String(value).trim() || null
+  }
+  return snapshot
+}
+
+function flightLeg(flight: any): string {
+  return `${flight.departure?.airport?.iata ?? ''}-${flight.arrival?.airport?.iata ?? ''}`
+}
+
+// 'leg=DEP-ARR;field=value;...' (flight_logs.status_after)
+function formatSnapshot(snapshot: Snapshot, leg: string): string {
+  const values = Object.keys(DIFF_FIELDS)
+    .filter((name) => snapshot[name] !== null && snapshot[name] !== undefined)
+    .map((name) => `${name}=${snapshot[name]}`)
+  return [`leg=${leg}`, ...values].join(';')
+}
+
+function parseSnapshot(text: string | null): { leg: string | null, snapshot: Snapshot } {
+  let leg: string | null = null
+  const snapshot: Snapshot = {}
+  for (const item of (text ?? '').split(';')) {
+    const separator = item.indexOf('=')
+    if (separator < 0) continue
+    const name = item.slice(0, separator)
+    const value = item.slice(separator + 1)
+    if (name === 'leg') leg = value
+    else if (name in DIFF_FIELDS && value) snapshot[name] = value
+  }
+  return { leg, snapshot }
+}
+
+// A field missing from the newer snapshot is not a change; small revised-time shifts are ignored
+function diffSnapshots(before: Snapshot, after: Snapshot): Array<{ field: string, before: string | null, after: string }> {
+  const changes = []
+  for (const name of Object.keys(DIFF_FIELDS)) {
+    const oldValue = before[name] ?? null
+    const newValue = after[name]
+    if (!newValue || newValue === oldValue) continue
+    if (TIME_FIELDS.has(name) && oldValue) {
+      const shift = Math.abs(Date.parse(newValue.replace(' ', 'T')) - Date.parse(oldValue.replace(' ', 'T'))) / 1000
+      if (shift < MIN_TIME_SHIFT) continue
+    }
+    changes.push({ field: name, before: oldValue, after: newValue })
+  }
+  return changes
+}
+
+async function getFlightId(supabase: any, flightNumber: string, flightDate: string): Promise<string> {
+  const { data, error } = await supabase
+    .from('flights')
+    .select('id')
+    .eq('flight_number', flightNumber)
+    .eq('date', flightDate)
+    .maybeSingle()
+  if (error) throw error
+  if (data) return data.id
+  const { data: created, error: insertError } = await supabase
+    .from('flights')
+    .upsert({ flight_number: flightNumber, date: flightDate }, { onConflict: 'flight_number,date' })
+    .select('id')
+    .single()
+  if (insertError) throw insertError
+  return created.id
+}
+
+interface Claim {
+  flightId: string
+  leg: string
+  changes: string[] // 'field=value', claimed for this invocation
+  statusBefore: string
+  statusAfter: string
+}
+
+// Compares the flight with the latest flight_logs row of its leg and claims the changes.
+// fresh is false when there is nothing to send: no changes, or all of them delivered or
+// being delivered by the bot's poller (or an earlier webhook). The claim is settled by
+// settleClaim() once the sends are done
+async function claimChanges(supabase: any, flight: any, flightNumber: string, flightDate: string):
+    Promise<{ fresh: boolean, claim?: Claim }> {
+  try {
+    const flightId = await getFlightId(supabase, flightNumber, flightDate)
+    const { data: rows, error } = await supabase
+      .from('flight_logs')
+      .select('status_after')
+      .eq('flight_id', flightId)
+      .order('event_time', { ascending: false })
+      .limit(20)
+    if (error) throw error
+
+    const leg = flightLeg(flight)
+    const logged = (rows ?? []).map((row: any) => parseSnapshot(row.status_after)).find((row) => row.leg === leg)
+    const changes = diffSnapshots(logged?.snapshot ?? {}, takeSnapshot(flight))
+    if (changes.length === 0) {
+      return { fresh: !logged }
+    }
+
+    // One INSERT ... ON CONFLICT in the database: of concurrent senders only one gets a change
+    const { data: outcomes, error: claimError } = await supabase.rpc('claim_flight_changes', {
+      p_flight_id: flightId,
+      p_leg: leg,
+      p_changes: changes.map((change) => `${change.field}=${change.after}`),
+      p_lease: CLAIM_LEASE,
+      p_dedupe_ttl: DEDUPE_TTL
+    })
+    if (claimError) throw claimError
+    const claimed = new Set((outcomes ?? []).filter((row: any) => row.outcome === 'claimed').map((row: any) => row.change))
+    const fresh = changes.filter((change) => claimed.has(`${change.field}=${change.after}`))
+    if (fresh.length === 0) {
+      return { fresh: false }
+    }
+
+    // Unchanged and missing fields keep the last logged value
+    const current: Snapshot = { ...(logged?.snapshot ?? {}) }
+    for (const change of fresh) current[change.field] = change.after
+    return {
+      fresh: true,
+      claim: {
+        flightId,
+        leg,
+        changes: fresh.map((change) => `${change.field}=${change.after}`),
+        statusBefore: fresh.map((change) => `${change.field}=${change.before ?? ''}`).join(';'),
+        statusAfter: formatSnapshot(current, leg)
+      }
+    }
+  } catch (error) {
+    // A possible duplicate is better than a lost notification
+    console.error(`❌ Error claiming changes of ${flightNumber}:`, error)
+    return { fresh: true }
+  }
+}
+
+// Delivered: marks the claimed changes delivered and logs the new state in flight_logs.
+// Not delivered: deletes the claims, so the bot's poller sends the changes on its next poll
+async function settleClaim(supabase: any, claim: Claim, delivered: boolean) {
+  try {
+    const claims = supabase.from('flight_notification_claims')
+    const query = delivered
+      ? claims.update({ delivered_at: new Date().toISOString() })
+      : claims.delete().is('delivered_at', null)
+    const { error } = await query
+      .eq('flight_id', claim.flightId)
+      .eq('leg', claim.leg)
+      .in('change', claim.changes)
+    if (error) throw error
+    if (delivered) {
+      const { error: insertError } = await supabase.from('flight_logs').insert({
+        flight_id: claim.flightId,
+        status_before: claim.statusBefore,
+        status_after: claim.statusAfter,
+        event_time: new Date().toISOString()
+      })
+      if (insertError) throw insertError
+    }
+  } catch (error) {
+    // Left pending: the poller takes the claim over after CLAIM_LEASE
+    console.error(`❌ Error settling claimed changes (${claim.leg}):`, error)
+  }
+}
+
+function getFlightDate(flight: FlightNotification['flights'][number]): string {
+  // Get flight date from departure or arrival time
+  try {
+    if (flight.departure?.scheduledTimeUtc) {
+      return new Date(flight.departure.scheduledTimeUtc).toISOString().split('T')[0]
+    } else if (flight.arrival?.scheduledTimeUtc) {
+      return new Date(flight.arrival.scheduledTimeUtc).toISOString().split('T')[0]
+    }
+  } catch (error) {
+    console.error('❌ Error parsing flight date:', error)
+  }
+  // Fallback to current date if no valid time found
+  return new Date().toISOString().split('T')[0]
+}
+
 serve(async (req) => {
   // Handle CORS preflight requests
   if (req.method === 'OPTIONS') {
@@ -59,8 +436,6 @@ serve(async (req) => {
 
     // Get notification data from AeroDataBox
     const notification: FlightNotification = await req.json()
-    
-    console.log('📡 Received webhook notification:', JSON.stringify(notification, null, 2))
 
     // Validate notification
     if (!notification.flights || notification.flights.length === 0) {
@@ -71,124 +446,116 @@ serve(async (req) => {
       })
     }
 
-    const flight = notification.flights[0]
-    const flightNumber = flight.number.replace(/\s+/g, '') // Remove spaces
-    
-    console.log(`🛫 Processing flight: ${flightNumber}, status: ${flight.status}`)
-
-    // Get flight date from departure or arrival time
-    let flightDate: string
-    try {
-      if (flight.departure?.scheduledTimeUtc) {
-        flightDate = new Date(flight.departure.scheduledTimeUtc).toISOString().split('T')[0]
-      } else if (flight.arrival?.scheduledTimeUtc) {
-        flightDate = new Date(flight.arrival.scheduledTimeUtc).toISOString().split('T')[0]
-      } else {
-        // Fallback to current date if no valid time found
-        flightDate = new Date().toISOString().split('T')[0]
-      }
-    } catch (error) {
-      console.error('❌ Error parsing flight date:', error)
-      // Fallback to current date
-      flightDate = new Date().toISOString().split('T')[0]
-    }
+    console.log(`📡 Received webhook notification: subscription ${notification.subscription?.id}, ${notification.flights.length} flight(s)`)
 
-    // Get all users subscribed to this flight with their telegram_id
-    const { data: subscriptions, error: subError } = await supabase
-      .from('flight_subscriptions')
-      .select(`
-        user_id,
-        users!inner(telegram_id)
-      `)
-      .eq('flight_number', flightNumber)
-      .eq('flight_date', flightDate)
-      .eq('status', 'active')
-
-    if (subError) {
-      console.error('❌ Error fetching subscriptions:', subError)
-      return new Response(JSON.stringify({ error: 'Database error' }), {
+    // Get Telegram bot token
+    const botToken = Deno.env.get('BOT_TOKEN')
+    if (!botToken) {
+      console.error('❌ BOT_TOKEN not set')
+      return new Response(JSON.stringify({ error: 'Bot token not configured' }), {
         status: 500,
         headers: { ...corsHeaders, 'Content-Type': 'application/json' }
       })
     }
 
-    if (!subscriptions || subscriptions.length === 0) {
-      console.log(`ℹ️ No active subscriptions for flight ${flightNumber} on ${flightDate}`)
-      return new Response(JSON.stringify({ message: 'No subscriptions found' }), {
-        status: 200,
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' }
-      })
+    // Every flight of the notification; legs sharing number and date have the same subscribers
+    const flights = new Map<string, { flight: FlightNotification['flights'][number], flightNumber: string, flightDate: string }>()
+    for (const flight of notification.flights) {
+      if (!flight.number) continue
+      const flightNumber = flight.number.replace(/\s+/g, '') // Remove spaces
+      const flightDate = getFlightDate(flight)
+      const key = `${flightNumber}:${flightDate}`
+      if (!flights.has(key)) flights.set(key, { flight, flightNumber, flightDate })
     }
 
-    console.log(`📱 Found ${subscriptions.length} subscriptions for flight ${flightNumber}`)
-
-    // Format notification message
-    const message = formatFlightNotification(flight)
-    
-    // Get Telegram bot token
-    const botToken = Deno.env.get('BOT_TOKEN')
-    if (!botToken) {
-      console.error('❌ BOT_TOKEN not set')
-      return new Response(JSON.stringify({ error: 'Bot token not configured' }), {
+    // Subscribers of all flights looked up in parallel
+    const lookups = await Promise.all([...flights.values()].map(async ({ flight, flightNumber, flightDate }) => {
+      console.log(`🛫 Processing flight: ${flightNumber} ${flightDate}, status: ${flight.status}`)
+
+      // Get all users subscribed to this flight with their telegram_id
+      const { data: subscriptions, error } = await supabase
+        .from('flight_subscriptions')
+        .select(`
+          user_id,
+          users!inner(telegram_id)
+        `)
+        .eq('flight_number', flightNumber)
+        .eq('flight_date', flightDate)
+        .eq('status', 'active')
+      const { fresh, claim } = !error && subscriptions?.length
+        ? await claimChanges(supabase, flight, flightNumber, flightDate)
+        : { fresh: false, claim: undefined }
+      return { flight, flightNumber, flightDate, subscriptions: subscriptions ?? [], error, fresh, claim }
+    }))
+
+    const failedLookup = lookups.find((lookup) => lookup.error)
+    if (failedLookup && lookups.every((lookup) => lookup.error || lookup.subscriptions.length === 0)) {
+      console.error('❌ Error fetching subscriptions:', failedLookup.error)
+      return new Response(JSON.stringify({ error: 'Database error' }), {
         status: 500,
         headers: { ...corsHeaders, 'Content-Type': 'application/json' }
       })
     }
 
-    // Send notifications to all subscribed users
-    const notificationPromises = subscriptions.map(async (sub) => {
-      const telegram_id = sub.users.telegram_id
-      try {
-        const response = await fetch(`https://api.telegram.org/bot${botToken}/sendMessage`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({
-            chat_id: telegram_id,
-            text: message,
-            parse_mode: 'HTML'
-          })
+    // Format each flight's message once
+    const deliveries: Delivery[] = []
+    for (const { flight, flightNumber, flightDate, subscriptions, error, fresh } of lookups) {
+      if (error) {
+        console.error(`❌ Error fetching subscriptions for ${flightNumber}:`, error)
+        continue
+      }
+      if (subscriptions.length === 0) {
+        console.log(`ℹ️ No active subscriptions for flight ${flightNumber} on ${flightDate}`)
+        continue
+      }
+      if (!fresh) {
+        console.log(`ℹ️ Subscribers of ${flightNumber} on ${flightDate} already notified (or being notified) of this state`)
+        continue
+      }
+      console.log(`📱 Found ${subscriptions.length} subscriptions for flight ${flightNumber}`)
+      const message = formatFlightNotification(flight)
+      for (const sub of subscriptions) {
+        deliveries.push({
+          user_id: sub.user_id,
+          telegram_id: sub.users.telegram_id,
+          flight_number: flightNumber,
+          flight_date: flightDate,
+          status: flight.status,
+          message
         })
-
-        if (!response.ok) {
-          const errorData = await response.json()
-          console.error(`❌ Failed to send to user ${telegram_id}:`, errorData)
-          return { success: false, user_id: telegram_id, error: errorData }
-        }
-
-        console.log(`✅ Notification sent to user ${telegram_id}`)
-        return { success: true, user_id: telegram_id }
-      } catch (error) {
-        console.error(`❌ Error sending to user ${telegram_id}:`, error)
-        return { success: false, user_id: telegram_id, error: error.message }
       }
-    })
-
-    const results = await Promise.all(notificationPromises)
-    const successCount = results.filter(r => r.success).length
-    const failureCount = results.filter(r => !r.success).length
+    }
 
-    console.log(`📊 Notification results: ${successCount} sent, ${failureCount} failed`)
+    if (deliveries.length === 0) {
+      return new Response(JSON.stringify({ message: 'No new notifications' }), {
+        status: 200,
+        headers: { ...corsHeaders, 'Content-Type': 'application/json' }
+      })
+    }
 
-    // Log notification to audit
-    await supabase.from('audit_logs').insert({
-      action: 'flight_notification_sent',
-      details: {
+    const claims = new Map<string, Claim>()
+    for (const { flightNumber, flightDate, claim } of lookups) {
+      if (claim) claims.set(`${flightNumber}:${flightDate}`, claim)
+    }
+    const flightSummaries = lookups
+      .filter(({ fresh }) => fresh)
+      .map(({ flight, flightNumber, flightDate, subscriptions }) => ({
         flight_number: flightNumber,
         flight_date: flightDate,
         status: flight.status,
-        subscribers_count: subscriptions.length,
-        success_count: successCount,
-        failure_count: failureCount
-      }
-    })
+        subscribers_count: subscriptions.length
+      }))
+
+    // Sending paced to Telegram limits takes minutes for popular flights: answer
+    // AeroDataBox right away, so it does not time out and redeliver the webhook
+    const delivery = deliverAndRecord(supabase, botToken, deliveries, flightSummaries, claims)
+    // @ts-ignore EdgeRuntime is provided by the Supabase Edge Runtime
+    if (typeof EdgeRuntime !== 'undefined') EdgeRuntime.waitUntil(delivery)
 
     return new Response(JSON.stringify({
-      message: 'Notifications processed',
-      sent: successCount,
-      failed: failureCount,
-      total: subscriptions.length
+      message: 'Notifications queued',
+      total: deliveries.length,
+      flights: flightSummaries
     }), {
       status: 200,
       headers: { ...corsHeaders, 'Content-Type': 'application/json' }
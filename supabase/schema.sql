@@ -101,6 +101,18 @@ CREATE TABLE flight_logs (
   event_time TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Flight notification claims: the bot's subscription poller and the flight-webhook
+-- function claim each change ('field=value' of a leg) before notifying subscribers,
+-- so only one of them sends it (see claim_flight_changes below)
+CREATE TABLE flight_notification_claims (
+  flight_id UUID REFERENCES flights(id) ON DELETE CASCADE,
+  leg TEXT NOT NULL, -- DEP-ARR
+  change TEXT NOT NULL, -- field=value
+  claimed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+  delivered_at TIMESTAMP WITH TIME ZONE, -- NULL while the claimant is still sending
+  PRIMARY KEY (flight_id, leg, change)
+);
+
 -- Translations table
 CREATE TABLE translations (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -238,6 +250,7 @@ ALTER TABLE subscriptions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE messages ENABLE ROW LEVEL SECURITY;
 ALTER TABLE feature_requests ENABLE ROW LEVEL SECURITY;
 ALTER TABLE flight_logs ENABLE ROW LEVEL SECURITY;
+ALTER TABLE flight_notification_claims ENABLE ROW LEVEL SECURITY;
 ALTER TABLE translations ENABLE ROW LEVEL SECURITY;
 ALTER TABLE flight_selections ENABLE ROW LEVEL SECURITY;
 ALTER TABLE active_searches ENABLE ROW LEVEL SECURITY;
@@ -252,7 +265,36 @@ CREATE POLICY "Allow all operations on subscriptions" ON subscriptions FOR ALL U
 CREATE POLICY "Allow all operations on messages" ON messages FOR ALL USING (true);
 CREATE POLICY "Allow all operations on feature_requests" ON feature_requests FOR ALL USING (true);
 CREATE POLICY "Allow all operations on flight_logs" ON flight_logs FOR ALL USING (true);
+CREATE POLICY "Allow all operations on flight_notification_claims" ON flight_notification_claims FOR ALL USING (true);
 CREATE POLICY "Allow all operations on translations" ON translations FOR ALL USING (true);
 CREATE POLICY "Allow all operations on flight_selections" ON flight_selections FOR ALL USING (true);
 CREATE POLICY "Allow all operations on active_searches" ON active_searches FOR ALL USING (true);
-CREATE POLICY "Allow all operations on audit_logs" ON audit_logs FOR ALL USING (true); 
\ No newline at end of file
+CREATE POLICY "Allow all operations on audit_logs" ON audit_logs FOR ALL USING (true);
+
+-- Claims changes of a flight leg for notification. One INSERT ... ON CONFLICT, so of
+-- concurrent callers exactly one gets 'claimed' for a change. A change stays 'pending'
+-- while its claimant sends it (taken over once p_lease seconds pass unconfirmed: the
+-- claimant died) and 'delivered' for p_dedupe_ttl seconds after it was confirmed.
+-- A claimant confirms by setting delivered_at, or gives the claim back by deleting it.
+CREATE OR REPLACE FUNCTION claim_flight_changes(p_flight_id UUID, p_leg TEXT, p_changes TEXT[],
+                                                p_lease INTEGER, p_dedupe_ttl INTEGER)
+RETURNS TABLE (change TEXT, outcome TEXT)
+LANGUAGE sql AS $$
+  WITH claimed AS (
+    INSERT INTO flight_notification_claims AS claim (flight_id, leg, change)
+    SELECT DISTINCT p_flight_id, p_leg, requested.change FROM unnest(p_changes) AS requested(change)
+    ON CONFLICT (flight_id, leg, change) DO UPDATE
+      SET claimed_at = NOW(), delivered_at = NULL
+      WHERE (claim.delivered_at IS NULL AND claim.claimed_at < NOW() - make_interval(secs => p_lease))
+         OR claim.delivered_at < NOW() - make_interval(secs => p_dedupe_ttl)
+    RETURNING claim.change
+  )
+  SELECT requested.change,
+         CASE WHEN claimed.change IS NOT NULL THEN 'claimed'
+              WHEN existing.delivered_at IS NOT NULL THEN 'delivered'
+              ELSE 'pending' END
+  FROM unnest(p_changes) AS requested(change)
+  LEFT JOIN claimed ON claimed.change = requested.change
+  LEFT JOIN flight_notification_claims AS existing
+    ON existing.flight_id = p_flight_id AND existing.leg = p_leg AND existing.change = requested.change
+$$;
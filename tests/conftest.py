@@ -0,0 +1,9 @@
+import os
+import sys
+
+# bot.config refuses to import without these
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:8765")
+os.environ.setdefault("SUPABASE_ANON_KEY", "test-key")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,210 @@
+import asyncio
+import time
+
+from bot.services.flight_diff import FieldChange, FlightDiffEngine, diff_snapshots, parse_snapshot, take_snapshot
+
+KEY = ("QR1", "2025-07-20", "EDI", "DOH")
+
+
+def make_flight(status="Expected", gate=None, revised=None, belt=None) -> dict:
+    flight = {
+        "number": "QR 1",
+        "status": status,
+        "departure": {"airport": {"iata": "EDI"}, "terminal": "1"},
+        "arrival": {"airport": {"iata": "DOH"}},
+    }
+    if gate:
+        flight["departure"]["gate"] = gate
+    if revised:
+        flight["departure"]["revisedTime"] = {"utc": revised}
+    if belt:
+        flight["arrival"]["baggageBelt"] = belt
+    return flight
+
+
+class FakeDatabase:
+    """flight_logs, flight_notification_claims and claim_flight_changes() of supabase/schema.sql"""
+
+    def __init__(self):
+        self.rows = []
+        self.immediate = []
+        # (flight_number, date, leg, change) -> [claimed_at, delivered_at]
+        self.claims = {}
+
+    async def log_flight_change(self, flight_number, date, status_before, status_after, immediate=False):
+        self.rows.append((status_before, status_after))
+        self.immediate.append(immediate)
+
+    async def get_flight_log_snapshots(self, flight_number, date, limit=20):
+        return [status_after for _, status_after in reversed(self.rows)][:limit]
+
+    async def claim_flight_changes(self, flight_number, date, leg, changes, lease, dedupe_ttl):
+        now = time.monotonic()
+        outcomes = {}
+        for change in changes:
+            claim = self.claims.get((flight_number, date, leg, change))
+            if (claim is None or (claim[1] is None and claim[0] < now - lease)
+                    or (claim[1] is not None and claim[1] < now - dedupe_ttl)):
+                self.claims[(flight_number, date, leg, change)] = [now, None]
+                outcomes[change] = "claimed"
+            else:
+                outcomes[change] = "delivered" if claim[1] is not None else "pending"
+        return outcomes
+
+    async def settle_flight_claims(self, flight_number, date, leg, changes, delivered):
+        for change in changes:
+            key = (flight_number, date, leg, change)
+            if delivered:
+                self.claims[key][1] = time.monotonic()
+            elif key in self.claims and self.claims[key][1] is None:
+                del self.claims[key]
+
+    def webhook_claim(self, *changes):
+        """What flight-webhook does before sending"""
+        return asyncio.run(self.claim_flight_changes(KEY[0], KEY[1], "EDI-DOH", list(changes), 900, 3600))
+
+
+def observe(engine, flight):
+    return asyncio.run(engine.observe(KEY, flight))
+
+
+def test_missing_field_is_not_a_change():
+    before = take_snapshot(make_flight("Boarding", gate="D7", belt="5"))
+    after = take_snapshot(make_flight("Boarding"))
+    assert diff_snapshots(before, after) == []
+
+
+def test_field_appearing_is_a_change():
+    before = take_snapshot(make_flight("Boarding"))
+    after = take_snapshot(make_flight("Boarding", gate="D7"))
+    assert diff_snapshots(before, after) == [FieldChange("dep_gate", None, "D7")]
+
+
+def test_time_shift_below_threshold_is_ignored():
+    before = take_snapshot(make_flight(revised="2025-07-20 10:00Z"))
+    small = take_snapshot(make_flight(revised="2025-07-20 10:04Z"))
+    large = take_snapshot(make_flight(revised="2025-07-20 10:05Z"))
+    assert diff_snapshots(before, small, min_time_shift=300) == []
+    assert diff_snapshots(before, large, min_time_shift=300) == [
+        FieldChange("dep_time", "2025-07-20 10:00Z", "2025-07-20 10:05Z")
+    ]
+    # Without a threshold any shift counts
+    assert len(diff_snapshots(before, small)) == 1
+
+
+def test_first_observation_is_a_baseline():
+    engine = FlightDiffEngine()
+    assert observe(engine, make_flight("Expected", gate="D7")) == []
+    assert engine.get_stats()["baselines"] == 1
+
+
+def test_flapping_gate_is_not_notified_again_within_ttl():
+    engine = FlightDiffEngine(dedupe_ttl=3600)
+    observe(engine, make_flight("Boarding", gate="D7"))
+    notified = []
+    for gate in ["D9", "D7", "D9", "D7"]:
+        changes = observe(engine, make_flight("Boarding", gate=gate))
+        if changes:
+            asyncio.run(engine.confirm(KEY))
+        notified.extend(change.after for change in changes)
+    # Back to the baseline gate is news once; further flaps are not
+    assert notified == ["D9", "D7"]
+    assert engine.get_stats()["suppressed"] == 2
+
+
+def test_flapping_value_is_notified_again_after_ttl():
+    engine = FlightDiffEngine(dedupe_ttl=0)
+    observe(engine, make_flight("Boarding", gate="D7"))
+    for gate in ["D9", "D7", "D9"]:
+        assert [change.after for change in observe(engine, make_flight("Boarding", gate=gate))] == [gate]
+        asyncio.run(engine.confirm(KEY))
+
+
+def test_pending_changes_are_not_reported_twice():
+    engine = FlightDiffEngine()
+    observe(engine, make_flight("Expected"))
+    assert observe(engine, make_flight("Boarding")) == [FieldChange("status", "Expected", "Boarding")]
+    # Delivery still running
+    assert observe(engine, make_flight("Boarding")) == []
+
+
+def test_released_change_is_reported_again():
+    db = FakeDatabase()
+    engine = FlightDiffEngine(db)
+    observe(engine, make_flight("Expected"))
+    assert observe(engine, make_flight("Boarding"))
+    asyncio.run(engine.release(KEY))
+    assert observe(engine, make_flight("Boarding")) == [FieldChange("status", "Expected", "Boarding")]
+    # The log is rolled back too
+    status_before, status_after = db.rows[-2]
+    assert status_before.startswith("undelivered:")
+    assert parse_snapshot(status_after)[1]["status"] == "Expected"
+    # Not left to the batched sink, which may drop it or flush it too late
+    assert db.immediate[-2] is True
+
+
+def test_state_is_restored_from_flight_logs_after_restart():
+    db = FakeDatabase()
+    engine = FlightDiffEngine(db)
+    observe(engine, make_flight("CheckIn", gate="D1"))
+
+    restarted = FlightDiffEngine(db)
+    changes = observe(restarted, make_flight("Boarding", gate="D3"))
+    assert changes == [FieldChange("status", "CheckIn", "Boarding"), FieldChange("dep_gate", "D1", "D3")]
+    assert restarted.get_stats()["restored"] == 1
+
+
+def test_change_delivered_by_webhook_is_skipped():
+    db = FakeDatabase()
+    engine = FlightDiffEngine(db)
+    observe(engine, make_flight("CheckIn", gate="D1"))
+    # flight-webhook claimed the new status and delivered it
+    assert db.webhook_claim("status=Boarding") == {"status=Boarding": "claimed"}
+    asyncio.run(db.settle_flight_claims(KEY[0], KEY[1], "EDI-DOH", ["status=Boarding"], delivered=True))
+    assert observe(engine, make_flight("Boarding", gate="D1")) == []
+    assert engine.get_stats()["delivered_elsewhere"] == 1
+    # A newer change is still reported
+    assert observe(engine, make_flight("Boarding", gate="D4")) == [FieldChange("dep_gate", "D1", "D4")]
+
+
+def test_change_claimed_here_is_not_sent_by_webhook():
+    db = FakeDatabase()
+    engine = FlightDiffEngine(db)
+    observe(engine, make_flight("CheckIn"))
+    assert observe(engine, make_flight("Boarding")) == [FieldChange("status", "CheckIn", "Boarding")]
+    assert db.webhook_claim("status=Boarding") == {"status=Boarding": "pending"}
+    asyncio.run(engine.confirm(KEY))
+    assert db.webhook_claim("status=Boarding") == {"status=Boarding": "delivered"}
+
+
+def test_change_webhook_fails_to_deliver_is_sent_here():
+    db = FakeDatabase()
+    engine = FlightDiffEngine(db)
+    observe(engine, make_flight("CheckIn"))
+    db.webhook_claim("status=Boarding")
+    # flight-webhook still sending: not sent here, but not taken as delivered either
+    assert observe(engine, make_flight("Boarding")) == []
+    assert engine.get_stats()["deferred"] == 1
+    assert observe(engine, make_flight("Boarding")) == []
+    # Its delivery failed and it gave the claim back
+    asyncio.run(db.settle_flight_claims(KEY[0], KEY[1], "EDI-DOH", ["status=Boarding"], delivered=False))
+    assert observe(engine, make_flight("Boarding")) == [FieldChange("status", "CheckIn", "Boarding")]
+
+
+def test_claim_of_dead_sender_is_taken_over_after_lease():
+    db = FakeDatabase()
+    engine = FlightDiffEngine(db, claim_lease=0)
+    observe(engine, make_flight("CheckIn"))
+    # flight-webhook claimed the change and was killed before confirming it
+    db.webhook_claim("status=Boarding")
+    assert observe(engine, make_flight("Boarding")) == [FieldChange("status", "CheckIn", "Boarding")]
+
+
+def test_released_change_gives_claim_back():
+    db = FakeDatabase()
+    engine = FlightDiffEngine(db)
+    observe(engine, make_flight("CheckIn"))
+    assert observe(engine, make_flight("Boarding"))
+    asyncio.run(engine.release(KEY))
+    assert db.claims == {}
+    assert db.webhook_claim("status=Boarding") == {"status=Boarding": "claimed"}
@@ -0,0 +1,28 @@
+from bot.services.metrics import MetricsRegistry
+
+
+def test_summary_covers_only_the_last_interval():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("db_duration_seconds")
+    for _ in range(1000):
+        histogram.observe(0.010, method="get")
+    assert "n=1000" in registry.summary_lines()[0]
+
+    # A regression after a long quiet period shows up in full
+    for _ in range(10):
+        histogram.observe(0.500, method="get")
+    [line] = registry.summary_lines()
+    assert "n=10 " in line
+    assert "p50=500.00ms" in line
+
+    # Nothing observed since the previous summary
+    assert registry.summary_lines() == []
+
+
+def test_prometheus_series_stay_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("db_duration_seconds")
+    histogram.observe(0.010, method="get")
+    registry.summary_lines()
+    histogram.observe(0.020, method="get")
+    assert 'db_duration_seconds_count{method="get"} 2' in registry.render_prometheus()
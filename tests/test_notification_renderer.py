@@ -0,0 +1,119 @@
+from datetime import date
+
+import pytest
+
+from bot.services.notification_renderer import NotificationRenderer, parse_clock, parse_timestamp
+
+DAY = date(2025, 7, 20).toordinal() * 1440
+
+
+@pytest.mark.parametrize("value", [
+    "2025-07-20 14:43",
+    "2025-07-20T14:43",
+    "2025-07-20 14:43:59",
+    "2025-07-20T14:43:00.000",
+    "2025-07-20T14:43:00.123456",
+    "2025-07-20 14:43Z",
+    "2025-07-20T14:43:00Z",
+    "2025-07-20 14:43+00:00",
+])
+def test_timestamp_forms_without_offset(value):
+    assert parse_timestamp(value) == ("14:43", DAY + 14 * 60 + 43)
+
+
+@pytest.mark.parametrize("value, utc_minutes", [
+    ("2025-07-20 14:43+03:00", 11 * 60 + 43),
+    ("2025-07-20T14:43:00.000+05:30", 9 * 60 + 13),
+    ("2025-07-20 14:43-04:00", 18 * 60 + 43),
+])
+def test_timestamp_offsets_are_applied(value, utc_minutes):
+    timestamp = parse_timestamp(value)
+    # The clock stays local, minutes are UTC
+    assert timestamp.clock == "14:43"
+    assert timestamp.minutes == DAY + utc_minutes
+
+
+@pytest.mark.parametrize("value", [
+    None, 1721486580, "", "2025-07-20", "2025-07-20 14", "2025-07-20/14:43", "2025-07-20 1443x",
+    "2025-13-20 14:43", "2025-07-32 14:43", "2025-07-20 ab:43", "20.07.2025 14:43",
+])
+def test_malformed_timestamp_is_none(value):
+    assert parse_timestamp(value) is None
+
+
+def test_parse_clock():
+    assert parse_clock("2025-07-20T14:43+03:00") == "14:43"
+    assert parse_clock("14:43") is None
+
+
+def make_flight(status, **extra) -> dict:
+    flight = {
+        "number": "QR 1",
+        "status": status,
+        "departure": {
+            "gate": "D7",
+            "terminal": "1",
+            "scheduledTime": {"local": "2025-07-20 23:50+01:00"},
+            "actualTime": {"local": "2025-07-21 00:15+01:00"},
+        },
+        "arrival": {
+            "revisedTime": {"local": "2025-07-21 07:05+03:00"},
+            "actualTime": {"local": "2025-07-21 07:01+03:00"},
+        },
+    }
+    flight.update(extra)
+    return flight
+
+
+@pytest.mark.parametrize("status, en, ru", [
+    ("Boarding", "QR1: Boarding, gate D7 🛂", "QR1: Идет посадка, выход D7 🛂"),
+    ("Departed", "QR1: Departed at 00:15 ✈️\nEstimated arrival 07:05",
+     "QR1: Отправлен в 00:15 ✈️\nПримерное время прибытия 07:05"),
+    ("Arrived", "QR1: Arrived at 07:01 ✅", "QR1: Прибыл в 07:01 ✅"),
+    ("Delayed", "QR1: Delayed ⏰", "QR1: Задержка ⏰"),
+    ("Canceled", "QR1: Canceled ❌", "QR1: Отменен ❌"),
+    ("EnRoute", "QR1: En route ✈️", "QR1: В пути ✈️"),
+    ("CheckIn", "QR1: Check-in open 📋", "QR1: Регистрация открыта 📋"),
+    ("GateClosed", "QR1: Gate closed 🔒", "QR1: Выход закрыт 🔒"),
+    ("Approaching", "QR1: Approaching 🛬", "QR1: Заходит на посадку 🛬"),
+    ("Diverted", "QR1: Status: Diverted 🔄", "QR1: Статус: Diverted 🔄"),
+    ("Expected", "QR1: Status: Expected ⏳", "QR1: Статус: Expected ⏳"),
+])
+def test_status_lines(status, en, ru):
+    renderer = NotificationRenderer()
+    flight = make_flight(status)
+    assert renderer.render(flight, "en") == en
+    assert renderer.render(flight, "ru") == ru
+
+
+def test_template_falls_back_to_less_complete_alternative():
+    renderer = NotificationRenderer()
+    no_arrival = make_flight("Departed", arrival={})
+    assert renderer.render(no_arrival, "en") == "QR1: Departed at 00:15 ✈️"
+    no_times = make_flight("Departed", departure={}, arrival={})
+    assert renderer.render(no_times, "ru") == "QR1: Отправлен ✈️"
+    no_gate = make_flight("Boarding", departure={"terminal": "1"})
+    assert renderer.render(no_gate, "en") == "QR1: Boarding 🛂"
+    # Unknown statuses prefer the AeroDataBox summary
+    diverted = make_flight("Diverted", notificationSummary="Diverted to DOH")
+    assert renderer.render(diverted, "en") == "QR1: Diverted to DOH 🔄"
+
+
+def test_details_line():
+    renderer = NotificationRenderer()
+    # Delay across midnight, from local times with an offset
+    assert renderer.render(make_flight("Delayed"), "en", with_details=True) == \
+        "QR1: Delayed ⏰\nDelayed 25 min, Terminal 1"
+    assert renderer.render(make_flight("Boarding"), "ru", with_details=True) == \
+        "QR1: Идет посадка, выход D7 🛂\nВыход D7, Терминал 1"
+
+
+@pytest.mark.parametrize("code, language", [
+    ("ru", "ru"), ("en", "en"), ("uk", "ru"), ("en-GB", "en"), ("ru-RU", "ru"), ("RU", "ru"),
+    ("de", "en"), ("zz", "en"), (None, "en"),
+])
+def test_language_mapping(code, language):
+    renderer = NotificationRenderer()
+    assert renderer.language(code) == language
+    # render_fields accepts raw user codes too
+    assert renderer.render(make_flight("Canceled"), code) == renderer.render(make_flight("Canceled"), language)
@@ -0,0 +1,84 @@
+import asyncio
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from bot.services.notification_renderer import NotificationRenderer
+from bot.services.notification_service import NotificationService
+
+FLIGHT = {"number": "QR 1", "status": "Boarding", "departure": {"gate": "D7", "terminal": "1"}, "arrival": {}}
+
+
+class StubBot:
+    """send_message fails per chat_id as scripted: a list of exceptions raised before the send succeeds"""
+
+    def __init__(self, script):
+        self.script = script
+        self.attempts = {}
+        self.delivered = {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        attempt = self.attempts.get(chat_id, 0)
+        self.attempts[chat_id] = attempt + 1
+        errors = self.script.get(chat_id, [])
+        if attempt < len(errors):
+            raise errors[attempt]
+        self.delivered.setdefault(chat_id, []).append(text)
+
+
+class CountingRenderer(NotificationRenderer):
+    def __init__(self):
+        super().__init__()
+        self.renders = []
+
+    def render_fields(self, values, language, with_details=False, changes=None):
+        self.renders.append(language)
+        return super().render_fields(values, language, with_details, changes)
+
+
+def forbidden(chat_id):
+    return TelegramForbiddenError(SendMessage(chat_id=chat_id, text=""), "bot was blocked by the user")
+
+
+def retry_after(chat_id, seconds):
+    return TelegramRetryAfter(SendMessage(chat_id=chat_id, text=""), "Too Many Requests", seconds)
+
+
+def subscriber(chat_id, language_code="en"):
+    return {"user_id": f"u{chat_id}", "users": {"telegram_id": chat_id, "language_code": language_code}}
+
+
+def test_fan_out_accounting():
+    bot = StubBot({
+        4: [forbidden(4)],
+        5: [retry_after(5, 0.01)],
+        6: [retry_after(6, 0.01)] * 3,
+        7: [retry_after(7, 3600)],
+        8: [RuntimeError("Bad Request: chat not found")],
+    })
+    renderer = CountingRenderer()
+    service = NotificationService(bot, renderer)
+    subscribers = [subscriber(1), subscriber(2, "en-GB"), subscriber(3, "ru"), subscriber(4), subscriber(5, "uk"),
+                   subscriber(6), subscriber(7), subscriber(8),
+                   # Second subscription of the same user, and a user without telegram_id
+                   subscriber(1), {"users": {"telegram_id": None}}]
+
+    progress = asyncio.run(service.fan_out(FLIGHT, subscribers))
+
+    assert (progress.total, progress.sent, progress.blocked, progress.failed) == (8, 4, 1, 3)
+    # Rendered once per language
+    assert sorted(renderer.renders) == ["en", "ru"]
+    assert progress.languages == 2
+    # One message per chat
+    assert bot.delivered == {
+        1: ["QR1: Boarding, gate D7 🛂\nGate D7, Terminal 1"],
+        2: ["QR1: Boarding, gate D7 🛂\nGate D7, Terminal 1"],
+        3: ["QR1: Идет посадка, выход D7 🛂\nВыход D7, Терминал 1"],
+        5: ["QR1: Идет посадка, выход D7 🛂\nВыход D7, Терминал 1"],
+    }
+    # 403 is not retried; retry_after is, up to the attempt limit, unless it exceeds max_retry_after
+    assert bot.attempts[4] == 1
+    assert bot.attempts[5] == 2
+    assert bot.attempts[6] == 3
+    assert bot.attempts[7] == 1
+    assert bot.attempts[8] == 1
@@ -0,0 +1,144 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from bot.services.send_queue import PRIORITY_INTERACTIVE, PRIORITY_NOTIFICATION, TelegramSendQueue
+
+
+def make_queue(**kwargs) -> TelegramSendQueue:
+    options = dict(global_rate=1000, per_chat_rate=1000, per_chat_burst=1000, max_in_flight=1,
+                   max_queue=100, max_retries=3, max_retry_after=5, congestion_threshold=50)
+    options.update(kwargs)
+    return TelegramSendQueue(**options)
+
+
+def recorder(log: list, label):
+    async def call():
+        log.append(label)
+        return label
+    return call
+
+
+def retry_after(chat_id: int, seconds: float) -> TelegramRetryAfter:
+    return TelegramRetryAfter(SendMessage(chat_id=chat_id, text="x"), "Too Many Requests", seconds)
+
+
+async def run_queue(queue: TelegramSendQueue, futures: list, timeout: float = 5.0) -> list:
+    queue.start()
+    try:
+        return await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), timeout)
+    finally:
+        await queue.close(timeout=0)
+
+
+def test_interactive_calls_go_before_notifications():
+    async def scenario():
+        queue = make_queue()
+        log = []
+        futures = [queue.submit(chat_id, recorder(log, f"n{chat_id}"), priority=PRIORITY_NOTIFICATION)
+                   for chat_id in range(3)]
+        futures += [queue.submit(chat_id, recorder(log, f"i{chat_id}"), priority=PRIORITY_INTERACTIVE)
+                    for chat_id in range(10, 12)]
+        await run_queue(queue, futures)
+        return log
+
+    # Same priority keeps submission order
+    assert asyncio.run(scenario()) == ["i10", "i11", "n0", "n1", "n2"]
+
+
+def test_chat_waiting_for_its_bucket_does_not_hold_back_others():
+    async def scenario():
+        # One message per 0.1s per chat, no burst
+        queue = make_queue(per_chat_rate=10, per_chat_burst=1)
+        log = []
+        futures = [queue.submit(1, recorder(log, f"a{i}")) for i in range(3)]
+        futures.append(queue.submit(2, recorder(log, "b0")))
+        started = time.monotonic()
+        await run_queue(queue, futures)
+        return log, time.monotonic() - started
+
+    log, elapsed = asyncio.run(scenario())
+    assert log == ["a0", "b0", "a1", "a2"]
+    assert elapsed >= 0.2
+
+
+def test_retry_after_requeues_call_and_pauses_every_chat():
+    async def scenario():
+        queue = make_queue()
+        dispatched = []
+
+        async def flooded():
+            dispatched.append(("a", time.monotonic()))
+            if len(dispatched) == 1:
+                raise retry_after(1, 0.3)
+            return "sent"
+
+        async def other_chat():
+            dispatched.append(("b", time.monotonic()))
+            return "sent"
+
+        first = queue.submit(1, flooded)
+        queue.start()
+        await asyncio.sleep(0.05)
+        # Submitted after the 429: flood control covers this chat too
+        second = queue.submit(2, other_chat)
+        results = await run_queue(queue, [first, second])
+        return results, dispatched, queue
+
+    results, dispatched, queue = asyncio.run(scenario())
+    assert results == ["sent", "sent"]
+    assert queue.retried == 1
+    flooded_at = dispatched[0][1]
+    assert [label for label, _ in dispatched] == ["a", "a", "b"]
+    assert all(at - flooded_at >= 0.29 for _, at in dispatched[1:])
+
+
+def test_gives_up_after_max_retries():
+    async def scenario():
+        queue = make_queue(max_retries=2)
+        attempts = 0
+
+        async def always_flooded():
+            nonlocal attempts
+            attempts += 1
+            raise retry_after(1, 0.01)
+
+        results = await run_queue(queue, [queue.submit(1, always_flooded)])
+        return results[0], attempts, queue
+
+    error, attempts, queue = asyncio.run(scenario())
+    assert isinstance(error, TelegramRetryAfter)
+    assert attempts == 3
+    assert queue.failed == 1 and queue.retried == 2
+
+
+def test_retry_after_above_limit_fails_without_retry():
+    async def scenario():
+        queue = make_queue(max_retry_after=1)
+        attempts = 0
+
+        async def long_flood():
+            nonlocal attempts
+            attempts += 1
+            raise retry_after(1, 60)
+
+        results = await run_queue(queue, [queue.submit(1, long_flood)])
+        return results[0], attempts
+
+    error, attempts = asyncio.run(scenario())
+    assert isinstance(error, TelegramRetryAfter)
+    assert attempts == 1
+
+
+def test_full_queue_rejects_submit():
+    async def scenario():
+        queue = make_queue(max_queue=1)
+        queue.submit(1, recorder([], "a"))
+        with pytest.raises(asyncio.QueueFull):
+            queue.submit(1, recorder([], "b"))
+        await queue.close(timeout=0)
+
+    asyncio.run(scenario())
@@ -0,0 +1,136 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from bot.services.subscription_poller import SubscriptionPoller, next_poll_delay, pick_leg
+
+NOW = datetime(2025, 7, 20, 12, 0, tzinfo=timezone.utc)
+
+
+def make_leg(status="Expected", dep="EDI", arr="DOH", departs_in=None, arrives_in=None) -> dict:
+    leg = {
+        "number": "QR 1",
+        "status": status,
+        "departure": {"airport": {"iata": dep}},
+        "arrival": {"airport": {"iata": arr}},
+    }
+    if departs_in is not None:
+        leg["departure"]["scheduledTime"] = {"utc": (NOW + departs_in).strftime("%Y-%m-%d %H:%MZ")}
+    if arrives_in is not None:
+        leg["arrival"]["scheduledTime"] = {"utc": (NOW + arrives_in).strftime("%Y-%m-%d %H:%MZ")}
+    return leg
+
+
+def delay(leg) -> float:
+    return next_poll_delay(leg, NOW, base=300, min_interval=60, max_interval=6 * 3600)
+
+
+def test_final_status_stops_polling():
+    for status in ("Arrived", "Canceled", "Diverted"):
+        assert delay(make_leg(status, departs_in=timedelta(hours=-3))) is None
+
+
+def test_imminent_status_is_polled_at_min_interval():
+    for status in ("Boarding", "GateClosed", "Approaching"):
+        assert delay(make_leg(status, departs_in=timedelta(hours=5))) == 60
+
+
+def test_departure_within_the_hour_is_polled_at_min_interval():
+    assert delay(make_leg(departs_in=timedelta(minutes=40))) == 60
+
+
+def test_airborne_flight_is_polled_often_near_arrival():
+    assert delay(make_leg("EnRoute", arrives_in=timedelta(minutes=30))) == 60
+    assert delay(make_leg("EnRoute", arrives_in=timedelta(hours=5))) == 300
+
+
+def test_far_departure_is_clamped_to_max_interval():
+    assert delay(make_leg(departs_in=timedelta(days=3))) == 6 * 3600
+    # Within a day: three base intervals
+    assert delay(make_leg(departs_in=timedelta(hours=12))) == 900
+
+
+def test_pick_leg_matches_route_and_falls_back_to_first():
+    legs = [make_leg(dep="EDI", arr="DOH"), make_leg(dep="DOH", arr="SYD")]
+    assert pick_leg(legs, "DOH", "SYD") is legs[1]
+    assert pick_leg(legs, "LHR", "JFK") is legs[0]
+    assert pick_leg(legs[0], "EDI", "DOH") is legs[0]
+    assert pick_leg([], "EDI", "DOH") is None
+
+
+class FakeDatabase:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def get_active_subscriptions_for_polling(self, since_date, page_size=1000):
+        return self.rows
+
+
+class FakeDiffEngine:
+    def __init__(self):
+        self.forgotten = []
+
+    def forget(self, key):
+        self.forgotten.append(key)
+
+
+def subscription(telegram_id, number="QR1", date="2025-07-20", dep="EDI", arr="DOH") -> dict:
+    return {"flight_number": number, "flight_date": date, "departure_airport": dep,
+            "arrival_airport": arr, "users": {"telegram_id": telegram_id}}
+
+
+def test_refresh_groups_subscriptions_per_flight_and_leg():
+    db = FakeDatabase([subscription(1), subscription(2), subscription(3, dep="DOH", arr="SYD"),
+                       subscription(4, number="BA5"), {"flight_number": "BA6", "flight_date": "2025-07-20"}])
+    poller = SubscriptionPoller(db, None, None, diff_engine=FakeDiffEngine())
+    asyncio.run(poller.refresh_subscriptions())
+    assert sorted(poller._flights) == [("BA5", "2025-07-20"), ("QR1", "2025-07-20")]
+    legs = poller._flights[("QR1", "2025-07-20")].subscribers
+    assert {leg: len(rows) for leg, rows in legs.items()} == {("EDI", "DOH"): 2, ("DOH", "SYD"): 1}
+
+
+def test_refresh_keeps_schedule_and_forgets_legs_nobody_follows():
+    db = FakeDatabase([subscription(1), subscription(2, dep="DOH", arr="SYD"), subscription(3, number="BA5")])
+    engine = FakeDiffEngine()
+    poller = SubscriptionPoller(db, None, None, diff_engine=engine)
+    asyncio.run(poller.refresh_subscriptions())
+    poller._flights[("QR1", "2025-07-20")].next_check_at = 12345.0
+
+    # The DOH-SYD subscriber and the only BA5 subscriber left
+    db.rows = [subscription(1)]
+    asyncio.run(poller.refresh_subscriptions())
+    assert sorted(engine.forgotten) == [("BA5", "2025-07-20", "EDI", "DOH"), ("QR1", "2025-07-20", "DOH", "SYD")]
+    assert list(poller._flights) == [("QR1", "2025-07-20")]
+    assert poller._flights[("QR1", "2025-07-20")].next_check_at == 12345.0
+
+
+class FakeNotificationService:
+    def __init__(self, sent=0, failed=0, blocked=0):
+        self.progress = type("Progress", (), {"sent": sent, "failed": failed, "blocked": blocked})()
+
+    async def fan_out(self, leg, subscribers, changes=None, concurrency=50):
+        return self.progress
+
+
+class SettlingDiffEngine:
+    def __init__(self):
+        self.settled = []
+
+    async def confirm(self, key):
+        self.settled.append("confirm")
+
+    async def release(self, key):
+        self.settled.append("release")
+
+
+def settle(**progress):
+    engine = SettlingDiffEngine()
+    poller = SubscriptionPoller(None, None, FakeNotificationService(**progress), diff_engine=engine)
+    asyncio.run(poller._fan_out(("QR1", "2025-07-20", "EDI", "DOH"), make_leg(), [], [subscription(1)]))
+    return engine.settled
+
+
+def test_fan_out_that_reached_nobody_is_released():
+    assert settle(sent=1, failed=3) == ["confirm"]
+    assert settle(failed=2) == ["release"]
+    # Blocked bots will not get it on a retry either
+    assert settle(blocked=2) == ["confirm"]